@@ -1,34 +1,177 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import hashlib
 import json
+import os
+import sqlite3
+import threading
+import time
 from openai import OpenAI
-from Retrieval.config import OPENAI_API_KEY, PROMPT_TEMPLATE  # PROMPT_TEMPLATE contains "{full_description}" placeholder
+from Retrieval.config import (  # PROMPT_TEMPLATE contains "{full_description}" placeholder
+    OPENAI_API_KEY, PROMPT_TEMPLATE, AGENTIC_MODEL, AGENTIC_CACHE_PATH,
+    AGENTIC_CONCURRENCY, AGENTIC_RETRIES, AGENTIC_BACKOFF_S,
+)
 
 _client = OpenAI(api_key=OPENAI_API_KEY)
+_PROMPT_HASH = hashlib.sha256(PROMPT_TEMPLATE.encode("utf-8")).hexdigest()[:16]
 
 
-def _llm(full_description: str) -> str:
+# ---------- 1. Persistent cache ---------- #
+class _LLMCache:
+    """sqlite (prompt hash, model, description) → query; đổi PROMPT_TEMPLATE / model = key mới."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (prompt_hash TEXT, model TEXT, description TEXT, "
+            "result TEXT, created REAL, PRIMARY KEY (prompt_hash, model, description))"
+        )
+        self._db.commit()
+
+    def get(self, description: str, model: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result FROM llm_cache WHERE prompt_hash = ? AND model = ? AND description = ?",
+                (_PROMPT_HASH, model, description),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, description: str, model: str, result: str) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?)",
+                             (_PROMPT_HASH, model, description, result, time.time()))
+            self._db.commit()
+
+
+_cache: Optional[_LLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def _get_cache() -> Optional[_LLMCache]:
+    """Mở sqlite lần đầu cần (import module – vd frontend – không tạo file)."""
+    global _cache
+    if _cache is None and AGENTIC_CACHE_PATH:
+        with _cache_lock:
+            if _cache is None:
+                _cache = _LLMCache(AGENTIC_CACHE_PATH)
+    return _cache
+
+
+def _parse(txt: str):
+    """→ (query, parsed_ok); output không đúng JSON thì dùng nguyên text (không cache)."""
+    try:
+        return json.loads(txt)["query_full"], True
+    except Exception:
+        return txt, False
+
+
+def _llm(full_description: str, model: str = AGENTIC_MODEL) -> str:
+    cache = _get_cache()
+    cached = cache.get(full_description, model) if cache else None
+    if cached is not None:
+        return cached
     prompt: str = PROMPT_TEMPLATE.replace("{full_description}", full_description)
     resp = _client.chat.completions.create(
-        model="gpt-4o-mini",
+        model=model,
         messages=[{"role": "user", "content": prompt}],
     )
-    txt: str = resp.choices[0].message.content
-    try:
-        return json.loads(txt)["query_full"]
-    except Exception:
-        return txt  
+    q, ok = _parse(resp.choices[0].message.content)
+    if ok and cache:
+        cache.put(full_description, model, q)
+    return q
 
 
-def agentic(full_description: str) -> Dict[str, Any]:
-    q: str = _llm(full_description)
+# ---------- 2. Async batch ---------- #
+async def _allm(client, full_description: str, sem: asyncio.Semaphore, model: str,
+                retries: int, backoff: float) -> Tuple[str, float, bool]:
+    """→ (query, latency giây, cached). Latency tính từ lúc có slot (không gồm thời gian chờ semaphore)."""
+    t0 = time.perf_counter()
+    cache = _get_cache()
+    cached = cache.get(full_description, model) if cache else None
+    if cached is not None:
+        return cached, time.perf_counter() - t0, True
+    prompt: str = PROMPT_TEMPLATE.replace("{full_description}", full_description)
+    t0 = None
+    for attempt in range(retries + 1):
+        try:
+            async with sem:
+                t0 = t0 or time.perf_counter()
+                resp = await client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                )
+            break
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print(f"[WARN] agentic retry {attempt + 1}/{retries}: {e!r}")
+            await asyncio.sleep(backoff * 2 ** attempt)
+    q, ok = _parse(resp.choices[0].message.content)
+    if ok and cache:
+        cache.put(full_description, model, q)
+    return q, time.perf_counter() - t0, False
+
+
+async def _agentic_batch(descriptions: List[str], concurrency: int, retries: int, backoff: float,
+                         model: str) -> List:
+    from openai import AsyncOpenAI
+    client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    sem = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(
+        *[_allm(client, d, sem, model, retries, backoff) for d in descriptions], return_exceptions=True
+    )
+
+
+def agentic_batch(descriptions: List[str],
+                  concurrency: int = AGENTIC_CONCURRENCY,
+                  retries: int = AGENTIC_RETRIES,
+                  backoff: float = AGENTIC_BACKOFF_S,
+                  model: str = AGENTIC_MODEL,
+                  return_stats: bool = False):
+    """
+    agentic() cho cả list descriptions: tối đa `concurrency` lời gọi LLM đồng thời, retry + backoff mũ;
+    description đã có trong cache không gọi LLM. Thứ tự giữ nguyên; None = lỗi sau khi hết retry.
+    return_stats=True → (params, stats): stats["items"][i] = {"latency", "cached"} của descriptions[i]
+    (None nếu lỗi) + tổng cached / generated / failed / elapsed của batch.
+    """
+    unique = list(dict.fromkeys(descriptions))
+    t0 = time.time()
+    results = dict(zip(unique, asyncio.run(_agentic_batch(unique, concurrency, retries, backoff, model))))
+    failed = [d for d, r in results.items() if isinstance(r, Exception)]
+    for d in failed:
+        print(f"[WARN] agentic failed for {d[:60]!r}: {results[d]!r}")
+    hits = sum(r[2] for r in results.values() if not isinstance(r, Exception))
+    elapsed = time.time() - t0
+    print(f"[🚀] agentic_batch: {len(unique)} descriptions | {hits} cached | "
+          f"{len(unique) - hits - len(failed)} generated | {len(failed)} failed in {elapsed:.1f}s")
+    params = [None if isinstance(results[d], Exception) else _params(results[d][0]) for d in descriptions]
+    if not return_stats:
+        return params
+    return params, {
+        "descriptions": len(unique), "cached": hits, "generated": len(unique) - hits - len(failed),
+        "failed": len(failed), "elapsed": elapsed,
+        "items": [None if isinstance(results[d], Exception) else {"latency": results[d][1], "cached": results[d][2]}
+                  for d in descriptions],
+    }
+
+
+# ---------- 3. Params ---------- #
+def _params(q: str) -> Dict[str, Any]:
     return {
         "query": q,
         "full_query": q,
-        "top_k1": 500,
+        "top_k1": 500,          # giới hạn trên – "cutoff" cắt theo phân phối score
+        "cutoff": "knee",
         "search_type": "frame",
         "search_method": "clip",
         "enable_s2": True,
         "top_m2": 20,
         "enable_s3": True,
         "top_k3": 50,
-    }
\ No newline at end of file
+    }
+
+
+def agentic(full_description: str) -> Dict[str, Any]:
+    return _params(_llm(full_description))
@@ -1,10 +1,35 @@
-import argparse, json, csv
+"""
+Đánh giá auto mode trên testset: agentic → Stage 1 → Stage 2 → Stage 3, rank ground truth ở mỗi stage.
+
+    python -m Retrieval.auto_mode_evaluate --testset test.json --output eval.csv [--workers 8]
+
+• Nhiều câu hỏi chạy song song (EVAL_WORKERS threads – phần lớn thời gian là LLM / FAISS, nhả GIL).
+• Query generation (agentic) cho mọi câu hỏi chạy trước bằng agentic_batch – song song, retry,
+  cache sqlite (AGENTIC_CACHE_PATH) → đánh giá lại cùng testset không tốn lời gọi LLM nào.
+• Stage 1 chạy 1 lần (refine_stage2=False); shot paths cho Stage 2 lấy từ "source" của frame results
+  (giống hệt stage1_materialize với refine_stage2=True) → không encode / search 2 lần.
+• Mỗi câu hỏi xong được append vào checkpoint JSONL (<output>.checkpoint.jsonl); chạy lại cùng lệnh sẽ bỏ qua
+  các câu đã có (câu lỗi được chạy lại). --no-resume để chạy lại từ đầu.
+• Kết thúc: CSV (1 hàng / câu hỏi) + summary JSON (<output>.summary.json): recall@k, MRR và
+  phân phối latency (mean / p50 / p95 / max) của từng stage; agentic: latency từng câu trong batch
+  + số câu lấy từ cache / số lời gọi LLM.
+"""
+
+import argparse, json, csv, os, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from Retrieval.cache_loader import preload_all_caches, shot_cache
+from Retrieval.config import EVAL_RECALL_KS, EVAL_WORKERS, STAGE1_CUTOFF, STAGE1_MIN_SCORE
 from Retrieval.embedder import CLIPEmbedder
 from Retrieval.stage1 import stage1_retrieve_shots
 from Retrieval.stage2_dp import refine_shots_with_dp
 from Retrieval.stage3_rerank import rerank_with_openai_parallel
-from Retrieval.auto_mode import agentic
+from Retrieval.auto_mode import agentic, agentic_batch
+
+STAGES = ("stage1", "stage2", "stage3")
+FIELDS = ["question_number", "full_description", "full_query",
+          "rank_stage1", "rank_stage2", "rank_stage3",
+          "agentic_cached", "latency_agentic", "latency_stage1", "latency_stage2", "latency_stage3"]
 
 def _endswith_any(path, targets):
     return any(path.endswith(t) for t in targets)
@@ -24,79 +49,179 @@ def _match_shot(item, gts):
     frames = shot_cache[item["shot_path"]]["frame_paths"]
     return any(_endswith_any(fp, gts) for fp in frames)
 
-def evaluate(test_json, csv_out):
-    preload_all_caches()
-    embedder = CLIPEmbedder()
+
+# ---------- 1. 1 câu hỏi ---------- #
+def _evaluate_one(q, embedder, params=None, agentic_stats=None):
+    """params / agentic_stats ({"latency", "cached"}) sinh trước bằng agentic_batch; None → gọi agentic()."""
+    gts = q["ground_truth"]
+    lat = {"agentic": agentic_stats and agentic_stats["latency"]}
+    cached = agentic_stats and agentic_stats["cached"]
+
+    if params is None:
+        t0 = time.perf_counter()
+        params = agentic(q["query"])
+        lat["agentic"] = time.perf_counter() - t0
+        cached = False
+    top_k1 = int(params.get("top_k1", 500))
+    top_k3 = int(params.get("top_k3", 50))
+
+    # === Stage 1 một lần → frame view (rank1) + shot view (input Stage 2)
+    t0 = time.perf_counter()
+    stage1_results = stage1_retrieve_shots(
+        query=params["query"],
+        embedder=embedder,
+        search_type="frame",
+        top_k=top_k1,
+        type_search="clip",
+        refine_stage2=False,
+        min_score=params.get("min_score", STAGE1_MIN_SCORE),
+        cutoff=params.get("cutoff", STAGE1_CUTOFF),
+    )
+    shot_paths = list(dict.fromkeys(r["source"] for r in stage1_results))
+    lat["stage1"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    stage2_results = refine_shots_with_dp(shot_paths, params["full_query"], embedder)
+    lat["stage2"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    stage3_results = rerank_with_openai_parallel(
+        query=params["full_query"],
+        items=stage2_results,
+        top_k_rerank=top_k3,
+        max_workers=16,
+        search_type="frame"
+    )
+    lat["stage3"] = time.perf_counter() - t0
+
+    return {
+        "question_number": q.get("question_number"),
+        "full_description": q["query"],
+        "full_query": params["full_query"],
+        "rank_stage1": _rank(stage1_results, _match_frame, gts),
+        "rank_stage2": _rank(stage2_results, _match_shot, gts),
+        "rank_stage3": _rank(stage3_results, _match_shot, gts),
+        "agentic_cached": cached,
+        **{f"latency_{k}": v for k, v in lat.items()},
+    }
+
+
+# ---------- 2. Checkpoint ---------- #
+def _load_checkpoint(path):
+    """question_number → row đã xong (bỏ row lỗi / dòng ghi dở khi crash)."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" not in row:
+                done[row["question_number"]] = row
+    return done
+
+
+# ---------- 3. Metrics ---------- #
+def summarize(rows, ks=EVAL_RECALL_KS):
+    """
+    recall@k + MRR (rank -1 = miss → 0) và latency distribution (ms) cho từng stage;
+    agentic thêm cache_hits / llm_calls (chạy lại cùng testset → llm_calls = 0).
+    """
+    out = {"questions": len(rows)}
+    for stage in STAGES:
+        ranks = np.array([r[f"rank_{stage}"] for r in rows], dtype=np.int64)
+        hit = ranks > 0
+        out[stage] = {
+            **{f"recall@{k}": float(np.mean(hit & (ranks <= k))) if len(ranks) else 0.0 for k in ks},
+            "mrr": float(np.mean(np.where(hit, 1.0 / np.maximum(ranks, 1), 0.0))) if len(ranks) else 0.0,
+        }
+    for stage in ("agentic", *STAGES):
+        ms = np.array([r[f"latency_{stage}"] for r in rows if r[f"latency_{stage}"] is not None],
+                      dtype=np.float64) * 1e3
+        out.setdefault(stage, {})["latency_ms"] = {
+            "mean": float(ms.mean()), "p50": float(np.percentile(ms, 50)),
+            "p95": float(np.percentile(ms, 95)), "max": float(ms.max()),
+        } if len(ms) else {}
+    cached = [r.get("agentic_cached") for r in rows]
+    out["agentic"].update(cache_hits=cached.count(True), llm_calls=cached.count(False))
+    return out
+
+
+def _print_summary(summary, ks=EVAL_RECALL_KS):
+    print(f"\n=== Evaluation ({summary['questions']} questions) ===")
+    print(f"{'stage':<8} " + " ".join(f"{'R@' + str(k):>7}" for k in ks) + f" {'MRR':>7} {'p50 ms':>9} {'p95 ms':>9}")
+    for stage in STAGES:
+        s, l = summary[stage], summary[stage]["latency_ms"]
+        print(f"{stage:<8} " + " ".join(f"{s[f'recall@{k}']:7.3f}" for k in ks)
+              + f" {s['mrr']:7.3f} {l.get('p50', 0):9.1f} {l.get('p95', 0):9.1f}")
+    a, l = summary["agentic"], summary["agentic"]["latency_ms"]
+    print(f"{'agentic':<8} {a['cache_hits']} cached | {a['llm_calls']} LLM calls | "
+          f"p50 {l.get('p50', 0):.1f} ms | p95 {l.get('p95', 0):.1f} ms")
+
+
+# ---------- 4. Runner ---------- #
+def evaluate(test_json, csv_out, workers=EVAL_WORKERS, checkpoint=None, resume=True):
+    checkpoint = checkpoint or os.path.splitext(csv_out)[0] + ".checkpoint.jsonl"
     with open(test_json, "r", encoding="utf-8") as f:
         questions = json.load(f)
+    if not resume and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    done = _load_checkpoint(checkpoint)
+    pending = [q for q in questions if q.get("question_number") not in done]
+    print(f"[📥] {len(questions)} questions | {len(done)} done in {checkpoint} | {len(pending)} to run")
 
-    with open(csv_out, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=[
-            "question_number",
-            "full_description",
-            "full_query",
-            "rank_stage1",
-            "rank_stage2",
-            "rank_stage3"
-        ])
-        writer.writeheader()
+    if pending:
+        preload_all_caches()
+        embedder = CLIPEmbedder()
+        lock = threading.Lock()
+        # === Query generation cho cả batch trước (song song + retry, cache sqlite → chạy lại = 0 lời gọi)
+        params, stats = agentic_batch([q["query"] for q in pending], return_stats=True)
+        params = dict(zip((q.get("question_number") for q in pending), zip(params, stats["items"])))
 
-        for q in questions:
-            qnum = q.get("question_number")
-            full_desc = q["query"]
-            gts = q["ground_truth"]
-            print(f"[⚡] Q{qnum}: {full_desc[:60]}…")
+        def _run(q):
             try:
-                params = agentic(full_desc)
-                top_k1 = int(params.get("top_k1", 500))
-                top_k3 = int(params.get("top_k3", 50))
-
-                stage1_results = stage1_retrieve_shots(
-                    query=params["query"],
-                    embedder=embedder,
-                    search_type="frame",
-                    top_k=top_k1,
-                    type_search="clip",
-                    refine_stage2=False
-                )
-                rank1 = _rank(stage1_results, _match_frame, gts)
-
-                shot_paths = stage1_retrieve_shots(
-                    query=params["query"],
-                    embedder=embedder,
-                    search_type="frame",
-                    top_k=top_k1,
-                    type_search="clip",
-                    refine_stage2=True
-                )
-                stage2_results = refine_shots_with_dp(shot_paths, params["full_query"], embedder)
-                rank2 = _rank(stage2_results, _match_shot, gts)
-
-                stage3_results = rerank_with_openai_parallel(
-                    query=params["full_query"],
-                    items=stage2_results,
-                    top_k_rerank=top_k3,
-                    max_workers=16,
-                    search_type="frame"
-                )
-                rank3 = _rank(stage3_results, _match_shot, gts)
-
-                writer.writerow({
-                    "question_number": qnum,
-                    "full_description": full_desc,
-                    "full_query": params["full_query"],
-                    "rank_stage1": rank1,
-                    "rank_stage2": rank2,
-                    "rank_stage3": rank3
-                })
-                print(f"    ✓ Saved row: Q{qnum} → ({rank1}, {rank2}, {rank3})")
-
+                row = _evaluate_one(q, embedder, *params[q.get("question_number")])
             except Exception as e:
-                print(f"    ✗ Error Q{qnum}: {e}")
+                row = {"question_number": q.get("question_number"), "error": repr(e)}
+            with lock, open(checkpoint, "a", encoding="utf-8") as f:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            return row
+
+        with ThreadPoolExecutor(workers) as ex:
+            futs = {ex.submit(_run, q): q for q in pending}
+            for fut in as_completed(futs):
+                row = fut.result()
+                qnum = row["question_number"]
+                if "error" in row:
+                    print(f"    ✗ Error Q{qnum}: {row['error']}")
+                else:
+                    done[qnum] = row
+                    print(f"    ✓ Saved row: Q{qnum} → ({row['rank_stage1']}, {row['rank_stage2']}, "
+                          f"{row['rank_stage3']}) [{len(done)}/{len(questions)}]")
+
+    order = {q.get("question_number"): i for i, q in enumerate(questions)}
+    rows = sorted((r for qn, r in done.items() if qn in order), key=lambda r: order[r["question_number"]])
+    with open(csv_out, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    summary = summarize(rows)
+    with open(os.path.splitext(csv_out)[0] + ".summary.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    _print_summary(summary)
+    if len(rows) < len(questions):
+        print(f"[WARN] {len(questions) - len(rows)} questions failed – rerun the same command to retry them")
+    return summary
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--testset", required=True)
     parser.add_argument("--output", required=True)
+    parser.add_argument("--workers", type=int, default=EVAL_WORKERS)
+    parser.add_argument("--checkpoint", default=None, help="JSONL checkpoint (mặc định <output>.checkpoint.jsonl)")
+    parser.add_argument("--no-resume", dest="resume", action="store_false", help="bỏ checkpoint cũ, chạy lại từ đầu")
     args = parser.parse_args()
-    evaluate(args.testset, args.output)
+    evaluate(args.testset, args.output, args.workers, args.checkpoint, args.resume)
@@ -1,4 +1,4 @@
-import glob, json, os, time, faiss, h5py, numpy as np
+import glob, json, os, threading, time, faiss, h5py, numpy as np
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from scipy.sparse import load_npz
@@ -6,15 +6,22 @@ import joblib
 
 from Retrieval.config import (
     JSON_ROOT, H5_DIR, CORE_H5, FAISS_DIR,
-    TFIDF_MATRIX, OCR_PATHS_JSON, OCR_VECTORIZER, EMB_ROOT, MAX_WORKERS
+    TFIDF_MATRIX, OCR_PATHS_JSON, OCR_VECTORIZER, EMB_ROOT, MAX_WORKERS, SHARD_SUBSET,
+    EMB_CACHE_DTYPE, EMB_STORE_DIR, SHARD_DIR, PRELOAD_PARALLEL, SHOT_TABLE_DIR,
+    LAZY_CAPTIONS, SHARED_CACHE_ATTACH, SHARED_CACHE_DIR, OCR_ROOT, RELOAD_POLL_S
 )
+from Retrieval.shards import preload_shards, sharded_index_names, read_manifest
+from Retrieval.snapshot import (
+    CacheView, activate, current_snapshot, fingerprint, new_snapshot, publish_snapshot
+)
+from Retrieval.startup_report import Loader, run_loaders, print_report
 
-# === GLOBAL CACHES ===
-shot_cache       = {}
-core_cache       = {}
-faiss_index_cache= {}
-ocr_cache        = {}
-embedding_cache  = {}
+# === GLOBAL CACHES (view của snapshot đang active – xem Retrieval.snapshot) ===
+shot_cache       = CacheView("shot_cache")
+core_cache       = CacheView("core_cache")
+faiss_index_cache= CacheView("faiss_index_cache")
+ocr_cache        = CacheView("ocr_cache")
+embedding_cache  = CacheView("embedding_cache")
 
 
 # ---------- 1. Shot-level JSON ---------- #
@@ -45,11 +52,58 @@ def preload_shot_json():
     print(f"[✅] Shot cache: {len(shot_cache)} entries")
 
 
+def preload_shot_table(table_dir: str = SHOT_TABLE_DIR):
+    """
+    Thay cho preload_shot_json: đọc bảng shot nhị phân (scripts/build_shot_table.py)
+    – không parse JSON / embedding list, chỉ các cột cần cho shot_cache.
+    """
+    def _col(name):
+        return np.load(os.path.join(table_dir, f"{name}.npy"))
+
+    paths        = _col("paths").astype(str).tolist()
+    sources      = _col("source").astype(str).tolist()
+    frame_paths  = _col("frame_paths").astype(str).tolist()
+    offsets      = _col("frame_offsets")
+    shot_id, fps = _col("shot_id"), _col("fps")
+    start, end   = _col("start_time"), _col("end_time")
+    frames       = _col("frames")
+    print(f"[📥] Preload shot table ({len(paths)} shots)")
+
+    for i, path in enumerate(paths):
+        if shot_id[i] < 0:   # shot có trong core.h5 nhưng không có JSON
+            continue
+        shot_cache[path] = {
+            "shot_id": int(shot_id[i]),
+            "frame_paths": frame_paths[offsets[i]:offsets[i + 1]],
+            "start_time": float(start[i]),
+            "end_time": float(end[i]),
+            "fps": float(fps[i]),
+            "frames": frames[i].tolist(),
+            "source": sources[i],
+        }
+    print(f"[✅] Shot cache: {len(shot_cache)} entries")
+
+
+def shot_table_is_fresh(table_dir: str = SHOT_TABLE_DIR) -> bool:
+    """Bảng shot đã build xong và core.h5 chưa bị build lại kể từ đó (so core_h5_mtime trong meta.json)."""
+    meta_path = os.path.join(table_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, encoding="utf-8") as f:
+        built_for = json.load(f).get("core_h5_mtime")
+    if built_for is None or not os.path.exists(CORE_H5) or os.path.getmtime(CORE_H5) != built_for:
+        print(f"[WARN] Shot table {table_dir} is stale (core.h5 changed since build) – "
+              f"falling back to JSON shots; rerun scripts/build_shot_table.py")
+        return False
+    return True
+
+
 # ---------- 2. FAISS ---------- #
-def preload_faiss():
+def preload_faiss(skip=()):
+    """Load các .index nguyên khối trong FAISS_DIR, bỏ qua index_name có trong `skip` (đã sharded)."""
     print("[📥] Preload FAISS indexes")
     for fname in os.listdir(FAISS_DIR):
-        if fname.endswith(".index"):
+        if fname.endswith(".index") and fname[:-len(".index")] not in skip:
             index_path = os.path.join(FAISS_DIR, fname)
             faiss_index_cache[index_path] = faiss.read_index(index_path)
             print(f"   • {fname} ({faiss_index_cache[index_path].ntotal} vec)")
@@ -59,12 +113,21 @@ def preload_faiss():
 def _decode(a):
     return [x.decode() if isinstance(x, bytes) else x for x in a]
 
-def preload_core_h5():
-    print("[📥] Preload core.h5")
+def preload_core_h5(lazy_captions: bool = LAZY_CAPTIONS):
+    print(f"[📥] Preload core.h5{' (lazy captions)' if lazy_captions else ''}")
+    if lazy_captions:
+        from Retrieval.caption_store import CaptionStore, LazyColumn
+        store = CaptionStore(CORE_H5)
+        core_cache["caption_store"] = store
+        for level in ("frame", "shot"):
+            core_cache[f"{level}_blip"] = LazyColumn(store, f"{level}/blip_caption")
+            core_cache[f"{level}_llm"]  = LazyColumn(store, f"{level}/llm_caption")
+
     with h5py.File(CORE_H5, "r") as f:
         core_cache["frame_paths"] = _decode(f["frame/paths"][:])
-        core_cache["frame_blip"]  = _decode(f["frame/blip_caption"][:])
-        core_cache["frame_llm"]   = _decode(f["frame/llm_caption"][:])
+        if not lazy_captions:
+            core_cache["frame_blip"]  = _decode(f["frame/blip_caption"][:])
+            core_cache["frame_llm"]   = _decode(f["frame/llm_caption"][:])
         core_cache["frame_meta"]  = {
             k: _decode(f["frame/metadata"][k][:]) if f["frame/metadata"][k].dtype.kind == "S"
             else f["frame/metadata"][k][:]
@@ -72,15 +135,56 @@ def preload_core_h5():
         }
 
         core_cache["shot_paths"] = _decode(f["shot/paths"][:])
-        core_cache["shot_blip"]  = _decode(f["shot/blip_caption"][:])
-        core_cache["shot_llm"]   = _decode(f["shot/llm_caption"][:])
+        if not lazy_captions:
+            core_cache["shot_blip"]  = _decode(f["shot/blip_caption"][:])
+            core_cache["shot_llm"]   = _decode(f["shot/llm_caption"][:])
         core_cache["shot_meta"]  = {
             k: _decode(f["shot/metadata"][k][:]) if f["shot/metadata"][k].dtype.kind == "S"
             else f["shot/metadata"][k][:]
             for k in f["shot/metadata"]
         }
+    _build_row_maps()
     print(f"[✅] core.h5: {len(core_cache['frame_paths'])} frames | {len(core_cache['shot_paths'])} shots")
 
+
+def _build_row_maps():
+    """shot_path → shot row, frame row → shot row và bảng CSR shot row → frame rows."""
+    shot_row = {p: i for i, p in enumerate(core_cache["shot_paths"])}
+    frame_shot = np.fromiter(
+        (shot_row.get(s, -1) for s in core_cache["frame_meta"]["source"]),
+        dtype=np.int64, count=len(core_cache["frame_paths"]),
+    )
+    order = np.argsort(frame_shot, kind="stable")
+    order = order[frame_shot[order] >= 0]
+    counts = np.bincount(frame_shot[order], minlength=len(shot_row))
+
+    core_cache["shot_row"]           = shot_row
+    core_cache["frame_shot_row"]     = frame_shot
+    core_cache["shot_frame_offsets"] = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    core_cache["shot_frame_rows"]    = order.astype(np.int64)
+
+    # === per-video row table ("Lxx/Vyyy" → sorted rows) cho metadata filters
+    shot_video = [video_key(p) for p in core_cache["shot_paths"]]
+    videos, shot_codes = np.unique(np.array(shot_video, dtype=object), return_inverse=True)
+    frame_codes = np.where(frame_shot >= 0, shot_codes[np.maximum(frame_shot, 0)], -1)
+    core_cache["videos"]           = [str(v) for v in videos]
+    core_cache["shot_video_rows"]  = group_rows(shot_codes, core_cache["videos"])
+    core_cache["frame_video_rows"] = group_rows(frame_codes, core_cache["videos"])
+
+
+def video_key(shot_path: str) -> str:
+    """".../Lxx/Vyyy/Shot_xxxx.mp4" → "Lxx/Vyyy" (dùng chung cho filters / dedupe)."""
+    parts = shot_path.split("/")
+    return f"{parts[-3]}/{parts[-2]}"
+
+
+def group_rows(codes: np.ndarray, names: list) -> dict:
+    """codes [n] (chỉ số vào names, -1 = bỏ qua) → {name: rows đã sort} – bảng row theo video cho filters."""
+    order = np.argsort(codes, kind="stable")
+    order = order[codes[order] >= 0]
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(codes[order], minlength=len(names)))))
+    return {name: order[bounds[i]:bounds[i + 1]] for i, name in enumerate(names)}
+
 # ---------- 4. OCR TF-IDF ---------- #
 def preload_ocr():
     """
@@ -109,29 +213,180 @@ def preload_ocr():
     print(f"[✅] OCR matrix shape: {ocr_cache['matrix'].shape}")
 
 # ---------- 5. NPZ Embeddings ---------- #
-def preload_embeddings_npz():
+def quantize_vectors(vectors, dtype: str):
+    """float32 → dtype lưu trữ trong embedding_cache; int8 dùng scale per-vector (max|v| / 127)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "float32":
+        return vectors, None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unsupported embedding dtype: {dtype}")
+
+
+def preload_embeddings_npz(dtype: str = EMB_CACHE_DTYPE):
     npz_files = glob.glob(os.path.join(EMB_ROOT, "L*", "V*.npz"))
-    print(f"[📥] Preload NPZ embeddings ({len(npz_files)})")
+    print(f"[📥] Preload NPZ embeddings ({len(npz_files)}, {dtype})")
 
     def _load(npz_path):
         Lxx = os.path.basename(os.path.dirname(npz_path))
         Vyyy = os.path.splitext(os.path.basename(npz_path))[0]
         key = f"{Lxx}/{Vyyy}"
         data = np.load(npz_path, allow_pickle=True)
-        return key, {"paths": list(data["paths"]), "vectors": data["embeddings"]}
+        vectors, scales = quantize_vectors(data["embeddings"], dtype)
+        return key, {"paths": list(data["paths"]), "vectors": vectors, "scales": scales}
 
     with ThreadPoolExecutor(MAX_WORKERS) as ex:
         futs = [ex.submit(_load, p) for p in npz_files]
         for fut in tqdm(as_completed(futs), total=len(futs)):
             k, v = fut.result()
             embedding_cache[k] = v
-    print(f"[✅] NPZ cache: {len(embedding_cache)} videos")
+    nbytes = sum(v["vectors"].nbytes + (0 if v["scales"] is None else v["scales"].nbytes)
+                 for v in embedding_cache.values())
+    print(f"[✅] NPZ cache: {len(embedding_cache)} videos ({nbytes / 2**20:.1f} MiB vectors)")
+
+
+# ---------- 6. Consolidated embedding store ---------- #
+def preload_embedding_store(store_dir: str = EMB_STORE_DIR):
+    """
+    Thay cho preload_embeddings_npz: 1 mảng vectors liên tục (mmap) + bảng paths (bytes, không pickle)
+    + offset theo video – xem scripts/build_embedding_store.py. Mỗi entry là view, không copy.
+    """
+    with open(os.path.join(store_dir, "videos.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    print(f"[📥] Map embedding store ({len(meta['videos'])} videos, {meta['dtype']})")
+
+    vectors = np.load(os.path.join(store_dir, "vectors.npy"), mmap_mode="r")
+    paths   = np.load(os.path.join(store_dir, "paths.npy"), mmap_mode="r")
+    scales_path = os.path.join(store_dir, "scales.npy")
+    scales  = np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None
+
+    for key, (start, end) in meta["videos"].items():
+        embedding_cache[key] = {
+            "paths": paths[start:end],
+            "vectors": vectors[start:end],
+            "scales": None if scales is None else scales[start:end],
+        }
+    print(f"[✅] Embedding store: {vectors.shape[0]} frames ({vectors.nbytes / 2**20:.1f} MiB mapped)")
 
 
 # ---------- Helper để preload tất cả ---------- #
-def preload_all_caches():
-    preload_shot_json()
-    preload_faiss()
-    preload_core_h5()
-    preload_ocr()
-    preload_embeddings_npz()
+def _loader_plan():
+    """Các loader độc lập (I/O riêng) – không có deps nên chạy song song được hoàn toàn."""
+    from Retrieval.config import CLIP_H5, BLIP_H5, LLM_H5
+    from Retrieval.exact_search import preload_vectors
+
+    sharded = sharded_index_names()
+    use_store = os.path.exists(os.path.join(EMB_STORE_DIR, "videos.json"))
+    use_shot_table = shot_table_is_fresh()
+    plan = [
+        Loader("shot_table", preload_shot_table,
+               lambda: glob.glob(os.path.join(SHOT_TABLE_DIR, "*.npy")))
+        if use_shot_table else
+        Loader("shot_json", preload_shot_json,
+               lambda: glob.glob(os.path.join(JSON_ROOT, "L*", "V*.json"))),
+        Loader("faiss", lambda: preload_faiss(skip=sharded),
+               lambda: [os.path.join(FAISS_DIR, f) for f in os.listdir(FAISS_DIR)
+                        if f.endswith(".index") and f[:-len(".index")] not in sharded]),
+        Loader("core_h5", preload_core_h5, lambda: [CORE_H5]),
+        Loader("ocr", preload_ocr, lambda: [TFIDF_MATRIX, OCR_PATHS_JSON, OCR_VECTORIZER]),
+        Loader("embeddings", preload_embedding_store if use_store else preload_embeddings_npz,
+               (lambda: glob.glob(os.path.join(EMB_STORE_DIR, "*.npy"))) if use_store
+               else (lambda: glob.glob(os.path.join(EMB_ROOT, "L*", "V*.npz")))),
+        Loader("vectors", preload_vectors, lambda: [CLIP_H5, BLIP_H5, LLM_H5]),
+    ]
+    if sharded:
+        plan.insert(1, Loader(
+            "faiss_shards", lambda: preload_shards(SHARD_SUBSET),
+            lambda: [os.path.join(SHARD_DIR, e["file"]) for e in read_manifest()
+                     if SHARD_SUBSET is None or e["shard"] in SHARD_SUBSET],
+        ))
+    return plan
+
+
+def _plan(shared: bool):
+    if shared:
+        from Retrieval.shared_cache import attach_caches, shared_manifest_path
+        manifest = shared_manifest_path(SHARED_CACHE_DIR)
+        if os.path.exists(manifest):
+            return [Loader("shared_attach", attach_caches, lambda: [manifest])]
+        print(f"[WARN] No shared caches at {SHARED_CACHE_DIR} – loading privately")
+    return _loader_plan()
+
+
+def _watched_paths(shared: bool):
+    if shared:
+        from Retrieval.shared_cache import shared_manifest_path
+        return [shared_manifest_path(SHARED_CACHE_DIR)]
+    roots = [H5_DIR, EMB_ROOT, OCR_ROOT, JSON_ROOT, SHOT_TABLE_DIR, EMB_STORE_DIR]
+    return [r for r in dict.fromkeys(roots) if os.path.exists(r)]
+
+
+def build_snapshot(parallel: bool = PRELOAD_PARALLEL, shared: bool = SHARED_CACHE_ATTACH):
+    """Load mọi cache vào 1 snapshot mới (chưa publish) → (snapshot, startup report)."""
+    snap = new_snapshot(fingerprint(_watched_paths(shared)))
+    with activate(snap):
+        report = run_loaders(_plan(shared), parallel=parallel)
+    report["snapshot_version"] = snap.version
+    return snap, report
+
+
+def preload_all_caches(parallel: bool = PRELOAD_PARALLEL, report_path: str = None,
+                       shared: bool = SHARED_CACHE_ATTACH):
+    """
+    Preload mọi cache; parallel=True chạy các loader đồng thời. Trả về startup report.
+    shared=True: attach bản đã publish trong SHARED_CACHE_DIR (Retrieval.shared_cache) nếu có.
+    """
+    snap, report = build_snapshot(parallel, shared)
+    publish_snapshot(snap)
+    print_report(report, report_path)
+    return report
+
+
+# ---------- 7. Hot reload ---------- #
+_reloader = None
+
+
+def reload_caches(parallel: bool = True, shared: bool = SHARED_CACHE_ATTACH) -> bool:
+    """Build snapshot mới off request path rồi swap; lỗi → giữ snapshot cũ."""
+    old_version = current_snapshot().version
+    try:
+        snap, report = build_snapshot(parallel, shared)
+    except Exception as e:
+        print(f"[WARN] Hot reload failed, keeping snapshot v{old_version}: {e!r}")
+        return False
+    publish_snapshot(snap)
+    print(f"[🔄] Cache snapshot v{old_version} → v{snap.version} ({report['wall_s']:.1f}s)")
+    return True
+
+
+def start_hot_reload(interval: float = RELOAD_POLL_S, shared: bool = SHARED_CACHE_ATTACH) -> threading.Event:
+    """
+    Thread nền poll fingerprint (size + mtime) của các thư mục dữ liệu mỗi `interval` giây.
+    Chỉ reload khi fingerprint mới giữ nguyên qua 2 lần poll liên tiếp (file copy xong).
+    Trả về Event – set() để dừng. Gọi lại lần nữa không tạo thread thứ hai.
+    """
+    global _reloader
+    if _reloader is not None:
+        return _reloader
+    stop = threading.Event()
+
+    def _loop():
+        pending = failed = None
+        while not stop.wait(interval):
+            fp = fingerprint(_watched_paths(shared))
+            if fp in (current_snapshot().fingerprint, failed):
+                pending = None
+            elif fp != pending:
+                pending = fp
+            else:
+                pending = None
+                failed = None if reload_caches(shared=shared) else fp
+
+    threading.Thread(target=_loop, name="cache-hot-reload", daemon=True).start()
+    print(f"[🔄] Hot reload: polling data dirs every {interval:g}s")
+    _reloader = stop
+    return stop
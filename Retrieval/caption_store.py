@@ -0,0 +1,134 @@
+"""
+Lazy accessor cho các cột text của core.h5 (captions, string metadata).
+
+Thay vì decode mọi row lúc preload, core.h5 được giữ mở read-only; rows cần dùng
+(kết quả Stage 1 / Stage 2 / Stage 3) được đọc theo batch: sort, gộp các đoạn gần
+nhau thành 1 lần đọc slice, rồi lưu vào LRU có giới hạn. RAM cho text vì thế tỉ lệ
+với working set chứ không với kích thước archive.
+
+    store = CaptionStore(CORE_H5)
+    core_cache["frame_blip"] = LazyColumn(store, "frame/blip_caption")
+    core_cache["frame_blip"].prefetch(rows)   # 1 batch I/O cho cả trang kết quả
+    core_cache["frame_blip"][idx]             # như list thường
+"""
+
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Tuple
+
+import h5py
+import numpy as np
+
+from Retrieval.config import CORE_H5, CAPTION_LRU_ROWS, CAPTION_COALESCE_GAP
+
+
+def _as_str(x) -> str:
+    return x.decode() if isinstance(x, bytes) else x
+
+
+def _coalesce(rows: List[int], max_gap: int) -> List[Tuple[int, int]]:
+    """
+    rows đã sort → các đoạn [start, end). Row kế tiếp được gộp vào đoạn trước nếu cách <= max_gap
+    và số row thừa trong đoạn không vượt số row cần (+ 1 gap) – batch thưa không nối thành 1 lần
+    đọc trải qua nhiều chunk.
+    """
+    runs: List[Tuple[int, int]] = []
+    wanted: List[int] = []
+    for r in rows:
+        if runs and r - runs[-1][1] <= max_gap:
+            start = runs[-1][0]
+            span, payload = r + 1 - start, wanted[-1] + 1
+            if span - payload <= payload + max_gap:
+                runs[-1] = (start, r + 1)
+                wanted[-1] = payload
+                continue
+        runs.append((r, r + 1))
+        wanted.append(1)
+    return runs
+
+
+class CaptionStore:
+    def __init__(self, h5_path: str = CORE_H5, max_rows: int = CAPTION_LRU_ROWS):
+        self._file = h5py.File(h5_path, "r")
+        self._max_rows = max_rows
+        self._lru: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.reads = 0
+
+    def length(self, dataset: str) -> int:
+        return self._file[dataset].shape[0]
+
+    def fetch(self, dataset: str, rows: Iterable[int]) -> List[str]:
+        rows = [int(r) for r in rows]
+        with self._lock:
+            missing = sorted({r for r in rows if (dataset, r) not in self._lru})
+            self.hits += len(rows) - len(missing)
+            self.misses += len(missing)
+
+            if missing:
+                ds = self._file[dataset]
+                # gộp các row nằm gần nhau (trong 1 chunk) – 1 lần đọc rẻ hơn nhiều lần đọc lẻ
+                max_gap = min(ds.chunks[0], CAPTION_COALESCE_GAP) if ds.chunks else CAPTION_COALESCE_GAP
+                wanted = set(missing)
+                for start, end in _coalesce(missing, max_gap):
+                    block = ds[start:end]
+                    self.reads += 1
+                    for r in range(start, end):
+                        if r in wanted:
+                            self._lru[(dataset, r)] = _as_str(block[r - start])
+
+            out = []
+            for r in rows:
+                self._lru.move_to_end((dataset, r))
+                out.append(self._lru[(dataset, r)])
+            while len(self._lru) > self._max_rows:
+                self._lru.popitem(last=False)
+            return out
+
+    def stats(self) -> dict:
+        return {"cached_rows": len(self._lru), "hits": self.hits, "misses": self.misses, "reads": self.reads}
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class LazyColumn:
+    """Cột text đọc lazy qua CaptionStore, dùng thay list trong core_cache (index int / slice / iter)."""
+
+    def __init__(self, store: CaptionStore, dataset: str):
+        self._store = store
+        self._dataset = dataset
+        self._len = store.length(dataset)
+
+    @property
+    def dataset(self) -> str:
+        return self._dataset
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self._store.fetch(self._dataset, range(*idx.indices(self._len)))
+        idx = int(idx)
+        if idx < 0:
+            idx += self._len
+        return self._store.fetch(self._dataset, [idx])[0]
+
+    def __iter__(self):
+        step = 4096
+        for start in range(0, self._len, step):
+            yield from self[start:min(start + step, self._len)]
+
+    def prefetch(self, rows) -> None:
+        rows = np.asarray(rows, dtype=np.int64).ravel()
+        if len(rows):
+            self._store.fetch(self._dataset, rows[rows >= 0])
+
+
+def prefetch_rows(columns, rows) -> None:
+    """Gọi prefetch trên các cột lazy (bỏ qua list thường)."""
+    for col in columns:
+        if isinstance(col, LazyColumn):
+            col.prefetch(rows)
@@ -0,0 +1,96 @@
+"""
+Client mỏng cho Retrieval.service (chỉ dùng stdlib).
+
+Các method mang cùng tên + tham số với hàm local (stage1_retrieve_shots,
+refine_shots_with_dp, rerank_with_openai_parallel) nên CLI / UI đổi qua lại
+giữa chạy local và gọi service mà không phải sửa call site. `embedder` được
+nhận để giữ chữ ký nhưng bị bỏ qua – service dùng model của nó.
+"""
+
+from __future__ import annotations
+import json
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+
+
+class SearchClient:
+    def __init__(self, base_url: str, timeout: float = 300.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    # ---------- transport ---------- #
+    def _request(self, method: str, path: str, body: Optional[Dict] = None) -> Dict:
+        data = None if body is None else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        req = urllib.request.Request(
+            self.base_url + path, data=data, method=method,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode("utf-8", errors="replace")
+            raise RuntimeError(f"{method} {path} → HTTP {e.code}: {detail}") from None
+
+    # ---------- health ---------- #
+    def healthy(self) -> bool:
+        try:
+            return self._request("GET", "/healthz").get("status") == "ok"
+        except Exception:
+            return False
+
+    def ready(self) -> bool:
+        try:
+            self._request("GET", "/readyz")
+            return True
+        except Exception:
+            return False
+
+    def wait_ready(self, timeout: float = 600.0, interval: float = 2.0) -> None:
+        deadline = time.time() + timeout
+        while not self.ready():
+            if time.time() > deadline:
+                raise TimeoutError(f"Search service not ready after {timeout:.0f}s: {self.base_url}")
+            time.sleep(interval)
+
+    # ---------- stages ---------- #
+    def stage1_retrieve_shots(self, query: str, embedder=None, search_type: str = "frame", top_k: int = 50,
+                              type_search: str = "clip", refine_stage2: bool = True, coarse_k: int = 0,
+                              filters: Optional[Dict] = None, dedupe_threshold: Optional[float] = None,
+                              dedupe_scope: Optional[str] = None, min_score: Optional[float] = None,
+                              cutoff: Optional[str] = None):
+        return self._request("POST", "/stage1", {
+            "query": query, "search_type": search_type, "top_k": top_k, "type_search": type_search,
+            "refine_stage2": refine_stage2, "coarse_k": coarse_k, "filters": filters,
+            "dedupe_threshold": dedupe_threshold, "dedupe_scope": dedupe_scope,
+            "min_score": min_score, "cutoff": cutoff,
+        })["results"]
+
+    def search_page(self, query: str, embedder=None, search_type: str = "frame", type_search: str = "clip",
+                    page_size: int = 50, filters: Optional[Dict] = None) -> Dict:
+        return self._request("POST", "/stage1/page", {
+            "query": query, "search_type": search_type, "type_search": type_search,
+            "page_size": page_size, "filters": filters,
+        })
+
+    def next_page(self, cursor: str, page_size: int = 50) -> Dict:
+        return self._request("POST", "/stage1/page/next", {"cursor": cursor, "page_size": page_size})
+
+    def refine_shots_with_dp(self, shot_paths: List[str], query: str, embedder=None) -> List[Dict]:
+        return self._request("POST", "/stage2", {"shot_paths": shot_paths, "query": query})["results"]
+
+    def rerank_with_openai_parallel(self, query: str, items: List[Dict], *, top_k_rerank: int,
+                                    max_workers: int, search_type: str, min_confident: Optional[int] = None,
+                                    confident_score: Optional[float] = None, max_calls: Optional[int] = None,
+                                    budget_s: Optional[float] = None, return_stats: bool = False):
+        payload = {
+            "query": query, "items": items[:top_k_rerank], "top_k_rerank": top_k_rerank,
+            "max_workers": max_workers, "search_type": search_type,
+        }
+        cascade = {"min_confident": min_confident, "confident_score": confident_score,
+                   "max_calls": max_calls, "budget_s": budget_s}
+        payload.update({k: v for k, v in cascade.items() if v is not None})   # None → mặc định của service
+        resp = self._request("POST", "/stage3", payload)
+        return (resp["results"], resp.get("stats")) if return_stats else resp["results"]
@@ -7,18 +7,25 @@ import os
 from pathlib import Path
 
 # === ROOT DIRECTORIES ===
-DATA_ROOT: str = "/content/drive/MyDrive/News-Events-Retrieval"
+DATA_ROOT: str = os.getenv("DATA_ROOT", "/content/drive/MyDrive/News-Events-Retrieval")   # scripts/bench_e2e.py trỏ sang archive tổng hợp
 H5_DIR:    str = f"{DATA_ROOT}/data_layout_h5"
 JSON_ROOT: str = f"{DATA_ROOT}/Data/Short_Video_JSON_Size8"
+SHOT_TABLE_DIR: str = f"{DATA_ROOT}/Data/shot_table"              # build_shot_table.py
 EMB_ROOT:  str = f"{DATA_ROOT}/Data/CLIP_L14_embedding/embeddings_with_paths"
+EMB_STORE_DIR: str = f"{DATA_ROOT}/Data/CLIP_L14_embedding/store"   # build_embedding_store.py
 OCR_ROOT:  str = f"{DATA_ROOT}/Data/ocr_index_hybrid_v2"
 
 # === FILE PATHS ===
 CORE_H5:       str = f"{H5_DIR}/core.h5"
+CLIP_H5:       str = f"{H5_DIR}/clip.h5"
+BLIP_H5:       str = f"{H5_DIR}/blip.h5"
+LLM_H5:        str = f"{H5_DIR}/llm.h5"
 FAISS_DIR:     str = H5_DIR                        # .index files nằm chung thư mục
 TFIDF_MATRIX:  str = f"{OCR_ROOT}/tfidf_matrix.npz"
 OCR_PATHS_JSON:str = f"{OCR_ROOT}/rel_paths.json"
 OCR_VECTORIZER:str = f"{OCR_ROOT}/vectorizer.pkl"
+SHARD_DIR:     str = f"{H5_DIR}/shards"            # <index_name>/<Lxx>.index + manifest.json
+SHARD_MANIFEST:str = f"{SHARD_DIR}/manifest.json"
 
 # === OPENAI ===
 import os
@@ -29,6 +36,89 @@ OPENAI_API_KEY: str = os.getenv(
 
 # === CONCURRENCY ===
 MAX_WORKERS: int = 16
+PRELOAD_PARALLEL: bool = False   # chạy các cache loader đồng thời khi khởi động
+
+# === STAGE 2 EMBEDDING CACHE ===
+EMB_CACHE_DTYPE: str = "float32"   # "float16" | "int8" (int8 kèm scale per-vector)
+
+# === CORE.H5 TEXT COLUMNS ===
+LAZY_CAPTIONS: bool = False        # captions đọc lazy từ core.h5 (CaptionStore + LRU) thay vì preload hết
+CAPTION_LRU_ROWS: int = 50_000     # số rows text giữ trong LRU
+CAPTION_COALESCE_GAP: int = 32     # 2 row cần đọc cách nhau <= gap (và không quá thưa) → gộp 1 lần đọc slice
+
+# === EXACT SEARCH ===
+EXACT_CHUNK_ROWS: int = 4096   # số vectors / chunk matmul (fp16 768-d ≈ 6 MB)
+EXACT_PRELOAD_IN_RAM: bool = False   # dataset chunk/nén (không mmap được): True = đọc vào RAM lúc startup, False = lazy ở exact search đầu tiên
+
+# === STAGE 1 RANGE SEARCH / ADAPTIVE CUTOFF ===
+STAGE1_MIN_SCORE = None          # float: trả mọi candidate có score >= ngưỡng (top_k thành giới hạn trên)
+STAGE1_CUTOFF = None             # "knee" | "gap": cắt danh sách theo phân phối score
+ADAPTIVE_MIN_KEEP: int = 10      # cutoff không bao giờ giữ ít hơn số này
+ADAPTIVE_GAP_RATIO: float = 5.0  # "gap": bước giảm phải > ratio × median bước giảm
+
+# === STAGE 1 PAGINATION ===
+PAGE_SIZE: int = 50
+PAGE_CACHE_MAX_CURSORS: int = 256          # cursor cache (LRU) – giới hạn số cursor
+PAGE_CACHE_MAX_BYTES: int = 512 * 2**20    # ... và tổng bytes buffer (score buffer ~ 4 B × N vectors)
+PAGE_CURSOR_TTL_S: float = 900.0
+
+# === TELEMETRY ===
+TELEMETRY: bool = os.getenv("TELEMETRY", "1") != "0"   # tắt → span / counter là no-op
+TELEMETRY_PRINT_DEPTH: int = 2                          # in span có độ sâu < N (0 = không in)
+TELEMETRY_JSONL = os.getenv("TELEMETRY_JSONL") or None  # file JSON lines nhận 1 trace / span gốc
+
+# === PROFILING ===
+PROFILE_DIR: str = "profiles"              # main.py --profile / sidebar: mỗi lần chạy 1 thư mục con
+PROFILE_TOP_N: int = 30                    # số hotspot / allocation trong summary
+PROFILE_SAMPLE_INTERVAL_S: float = 0.005   # chu kỳ lấy mẫu stack (flamegraph)
+
+# === STREAMING PIPELINE ===
+STREAM_CHUNK_SIZE: int = 25     # Stage 1 → 2 → 3 streaming: số candidates mỗi chunk Stage 1
+RERANK_BATCH_SIZE: int = 5      # số items mỗi lời gọi LLM ở Stage 3
+
+# === DEADLINE-AWARE EXECUTION ===
+DEADLINE_MS = None                    # float: deadline mặc định cho pipeline (None = không giới hạn)
+DEADLINE_STAGE3_SHARE: float = 0.5    # phần deadline dành cho Stage 3 (khi bật); Stage 1+2 dùng phần còn lại
+DEADLINE_MARGIN_MS: float = 100.0     # chừa lại cho merge / trả kết quả
+DEADLINE_DP_STEP: int = 8             # Stage 2 chấm theo nhóm N shots, kiểm tra thời gian giữa các nhóm
+
+# === STAGE 3 CASCADE RERANK ===
+RERANK_CONFIDENT_SCORE: float = 90.0   # điểm LLM (0–100) coi là "chắc chắn đúng"
+RERANK_MIN_CONFIDENT: int = 0          # dừng khi đã có N kết quả >= RERANK_CONFIDENT_SCORE (0 = tắt)
+RERANK_MAX_CALLS = None                # int: trần số lời gọi LLM / query
+RERANK_BUDGET_S = None                 # float: trần thời gian Stage 3 / query (giây)
+RERANK_CASCADE_WIDTH: int = 2          # số batch chạy đồng thời khi cascade (nhỏ → dừng sớm hiệu quả hơn)
+
+# === STAGE 1 NEAR-DUPLICATE SUPPRESSION ===
+DEDUPE_THRESHOLD: float = 0.0   # cosine CLIP > threshold với candidate xếp trên → bỏ (0 = tắt; vd 0.95)
+DEDUPE_SCOPE: str = "video"     # "video" (chỉ so trong cùng video) | "global"
+
+# === SEARCH SERVICE ===
+SEARCH_SERVICE_URL: str = os.getenv("SEARCH_SERVICE_URL", "")   # vd "http://localhost:8000"; rỗng = chạy local
+BATCH_WINDOW_MS: float = 5.0    # micro-batching: thời gian gom queries trước khi encode + search
+BATCH_MAX_SIZE: int = 32
+
+# === SHARED-MEMORY CACHES (nhiều worker / máy) ===
+SHARED_CACHE_DIR: str = os.getenv("SHARED_CACHE_DIR", "/dev/shm/news_events_retrieval")
+SHARED_CACHE_ATTACH: bool = os.getenv("SHARED_CACHE_ATTACH", "0") == "1"   # attach bản đã publish thay vì tự preload
+
+# === HOT RELOAD ===
+HOT_RELOAD: bool = os.getenv("HOT_RELOAD", "0") == "1"   # tự reload caches khi dữ liệu thay đổi
+RELOAD_POLL_S: float = 30.0                               # chu kỳ poll fingerprint thư mục dữ liệu
+
+# === AGENTIC QUERY GENERATION (auto_mode) ===
+AGENTIC_MODEL: str = "gpt-4o-mini"
+AGENTIC_CACHE_PATH: str = os.getenv("AGENTIC_CACHE_PATH", f"{DATA_ROOT}/agentic_cache.sqlite")   # "" = tắt cache; mở lúc gọi LLM đầu tiên
+AGENTIC_CONCURRENCY: int = 8     # agentic_batch: số lời gọi LLM đồng thời
+AGENTIC_RETRIES: int = 3         # số lần thử lại / description (backoff mũ)
+AGENTIC_BACKOFF_S: float = 1.0
+
+# === EVALUATION (auto_mode_evaluate) ===
+EVAL_WORKERS: int = 4                    # số câu hỏi chạy đồng thời
+EVAL_RECALL_KS: tuple = (1, 5, 10, 50)   # recall@k cho mỗi stage
+
+# === SHARDING ===
+SHARD_SUBSET = None   # vd ["L01", "L02"]: worker chỉ load các shard này (None = tất cả)
 
 PROMPT_TEMPLATE = """
 # News-Events Retrieval System: Query Generation Prompt
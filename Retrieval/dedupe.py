@@ -0,0 +1,98 @@
+"""
+Near-duplicate suppression cho kết quả Stage 1.
+
+Tin tức lặp lại rất nhiều cảnh MC / đồ hoạ tĩnh → top_k frames thường có nhiều
+frame gần như giống hệt nhau, và chúng đi tiếp vào Stage 2 / Stage 3 (tốn tiền).
+Greedy NMS theo thứ hạng: candidate bị loại nếu cosine (CLIP vector đã lưu) với 1
+candidate xếp trên và còn được giữ > threshold, trong cùng video ("video") hoặc
+toàn cục ("global").
+"""
+
+from __future__ import annotations
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from Retrieval.cache_loader import core_cache, faiss_index_cache, video_key
+from Retrieval.config import DEDUPE_SCOPE, FAISS_DIR
+
+
+# ---------- 1. Stored CLIP vectors ---------- #
+def candidate_vectors(rows: np.ndarray, level: str) -> Optional[np.ndarray]:
+    """
+    CLIP vectors (float32, đã normalize) của `rows` – ưu tiên clip.h5 mmap (vector_cache),
+    sau đó index clip_<level> nguyên khối. None nếu không lấy được (vd chỉ có shards).
+    """
+    from Retrieval.exact_search import vector_cache
+    from Retrieval.search_utils import flat_vectors, get_index_path
+
+    key = f"clip_{level}"
+    if key in vector_cache:
+        order = np.argsort(rows)   # đọc mmap theo thứ tự tăng dần
+        vecs = np.empty((len(rows), vector_cache[key].shape[1]), dtype=np.float32)
+        vecs[order] = vector_cache[key][rows[order]]
+    else:
+        index = faiss_index_cache.get(get_index_path("clip", level, FAISS_DIR))
+        if index is None:
+            return None
+        xb = flat_vectors(index)
+        if xb is not None:
+            vecs = np.asarray(xb[rows], dtype=np.float32)
+        else:
+            try:
+                vecs = index.reconstruct_batch(rows.astype(np.int64))
+            except RuntimeError:   # IVF chưa có direct map
+                return None
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs / np.maximum(norms, 1e-12)
+
+
+def _video_codes(rows: np.ndarray, level: str) -> np.ndarray:
+    sources = core_cache["frame_meta"]["source"] if level == "frame" else core_cache["shot_paths"]
+    videos = [video_key(sources[r]) for r in rows]
+    return np.unique(np.array(videos, dtype=object), return_inverse=True)[1]
+
+
+# ---------- 2. Greedy suppression ---------- #
+def suppress_near_duplicates(vecs: np.ndarray, threshold: float,
+                             groups: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    vecs [n, d] normalize, theo thứ hạng giảm dần → mask giữ lại.
+    Chỉ lặp qua các candidate được giữ; mỗi bước là 1 phép OR vector trên hàng của ma trận sim.
+    """
+    n = len(vecs)
+    dup = (vecs @ vecs.T) > threshold
+    if groups is not None:
+        dup &= groups[:, None] == groups[None, :]
+    dup = np.triu(dup, k=1)   # chỉ candidate xếp trên mới loại được candidate xếp dưới
+
+    suppressed = np.zeros(n, dtype=bool)
+    for i in range(n):
+        if not suppressed[i]:
+            suppressed |= dup[i]
+    return ~suppressed
+
+
+def dedupe_candidates(D_row: np.ndarray, I_row: np.ndarray, level: str, threshold: float,
+                      scope: str = DEDUPE_SCOPE) -> Tuple[np.ndarray, np.ndarray, Dict]:
+    """1 hàng (D, I) của Stage 1 → (D, I) đã bỏ near-duplicates + stats."""
+    assert scope in ("video", "global"), "scope must be 'video' or 'global'"
+    valid = I_row >= 0
+    D_row, I_row = D_row[valid], I_row[valid]
+    stats = {"candidates": len(I_row), "kept": len(I_row), "suppressed": 0}
+    if len(I_row) < 2:
+        return D_row, I_row, stats
+
+    vecs = candidate_vectors(I_row, level)
+    if vecs is None:
+        print(f"[WARN] Dedupe skipped: no stored CLIP vectors for {level} rows")
+        return D_row, I_row, stats
+
+    groups = _video_codes(I_row, level) if scope == "video" else None
+    keep = suppress_near_duplicates(vecs, threshold, groups)
+    stats.update(kept=int(keep.sum()), suppressed=int((~keep).sum()))
+    if level == "frame":
+        source = core_cache["frame_meta"]["source"]
+        stats["shots_before"] = len({source[r] for r in I_row})
+        stats["shots_after"] = len({source[r] for r in I_row[keep]})
+    return D_row[keep], I_row[keep], stats
@@ -1,7 +1,7 @@
 import torch
 import clip
 from PIL import Image
-from typing import Union
+from typing import List, Union
 
 
 class CLIPEmbedder:
@@ -29,3 +29,10 @@ class CLIPEmbedder:
         toks = clip.tokenize([text]).to(self.device)
         emb = self.model.encode_text(toks)
         return (emb / emb.norm(p=2, dim=-1, keepdim=True)).squeeze(0)
+
+    @torch.no_grad()
+    def encode_texts(self, texts: List[str]):
+        """Batch encode – 1 forward pass cho cả list (mỗi hàng đã L2-normalize)."""
+        toks = clip.tokenize(list(texts)).to(self.device)
+        emb = self.model.encode_text(toks)
+        return emb / emb.norm(p=2, dim=-1, keepdim=True)
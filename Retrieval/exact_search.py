@@ -0,0 +1,90 @@
+"""
+Exact brute-force search trên vectors lưu trong clip.h5 / blip.h5 / llm.h5.
+
+Dataset `frame/vectors`, `shot/vectors` (float16 hoặc float32) được memory-map
+trực tiếp từ file HDF5 (khi lưu contiguous, không nén) nên không cần FAISS index
+và không chiếm RAM ngoài page cache. Dataset bị chunk/nén phải đọc vào RAM → mặc định
+để tới lần exact search đầu tiên dùng tới (EXACT_PRELOAD_IN_RAM=True để đọc lúc startup). Score được tính theo chunk bằng matmul
+(upcast float32) với running top-k – xem search_utils.chunked_topk.
+"""
+
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import h5py
+import numpy as np
+
+from Retrieval.config import CLIP_H5, BLIP_H5, LLM_H5, EXACT_CHUNK_ROWS, EXACT_PRELOAD_IN_RAM
+from Retrieval.search_utils import chunked_topk
+from Retrieval.snapshot import CacheView
+
+# index_name ("clip_frame") → [N, D] memmap (hoặc ndarray nếu dataset bị chunk/nén)
+vector_cache: Dict[str, np.ndarray] = CacheView("vector_cache")
+
+_H5_BY_MODALITY = {"clip": CLIP_H5, "blip": BLIP_H5, "llm": LLM_H5}
+_lazy_lock = threading.Lock()
+
+
+# ---------- 1. mmap HDF5 datasets ---------- #
+def open_h5_vectors(h5_path: str, dataset: str, in_ram: bool = True) -> Optional[np.ndarray]:
+    """memmap nếu dataset contiguous; không thì đọc vào RAM (in_ram=False → None)."""
+    with h5py.File(h5_path, "r") as f:
+        ds = f[dataset]
+        offset = ds.id.get_offset()
+        if ds.chunks is None and ds.compression is None and offset is not None:
+            return np.memmap(h5_path, dtype=ds.dtype, mode="r", offset=offset, shape=ds.shape)
+        if not in_ram:
+            return None
+        print(f"[WARN] {h5_path}:{dataset} is chunked/compressed – reading into RAM")
+        return ds[:]
+
+
+def preload_vectors(in_ram: bool = EXACT_PRELOAD_IN_RAM) -> None:
+    print("[📥] Map vector matrices for exact search")
+    for modality, h5_path in _H5_BY_MODALITY.items():
+        if not os.path.exists(h5_path):
+            continue
+        for level in ("frame", "shot"):
+            vecs = open_h5_vectors(h5_path, f"{level}/vectors", in_ram)
+            if vecs is None:
+                print(f"   • {modality}_{level}: chunked/compressed – deferred to first exact search")
+                continue
+            vector_cache[f"{modality}_{level}"] = vecs
+            print(f"   • {modality}_{level}: {vecs.shape} {vecs.dtype}")
+
+
+def _lazy_vectors(index_name: str) -> np.ndarray:
+    """Dataset không mmap được → đọc vào RAM 1 lần, lưu vào snapshot đang dùng (bảng dẫn xuất lazy)."""
+    modality, level = index_name.split("_")
+    h5_path = _H5_BY_MODALITY.get(modality)
+    if h5_path is None or not os.path.exists(h5_path):
+        raise RuntimeError(f" Vectors not mapped: {index_name}\nDid you forget to run preload_vectors()?")
+    with _lazy_lock:
+        if index_name not in vector_cache:
+            t0 = time.perf_counter()
+            vector_cache[index_name] = open_h5_vectors(h5_path, f"{level}/vectors")
+            print(f"[✅] {index_name} loaded on first exact search in {time.perf_counter() - t0:.2f}s")
+    return vector_cache[index_name]
+
+
+# ---------- 2. Search ---------- #
+def exact_search(index_name: str, query_vecs: np.ndarray, top_k: int, rows: Optional[np.ndarray] = None,
+                 min_score: Optional[float] = None):
+    """
+    Exact inner-product top-k trên vector_cache[index_name] (hoặc chỉ `rows`).
+    min_score: range mode – chỉ giữ score >= min_score, top_k là giới hạn trên (I = -1 khi thiếu).
+    Trả về (D, I, stats) – stats gồm bytes đã quét và thông lượng GB/s.
+    """
+    xb = vector_cache[index_name] if index_name in vector_cache else _lazy_vectors(index_name)
+
+    t0 = time.perf_counter()
+    D, I = chunked_topk(xb, query_vecs, top_k, rows=rows, chunk_rows=EXACT_CHUNK_ROWS, min_score=min_score)
+    seconds = time.perf_counter() - t0
+
+    n = len(xb) if rows is None else len(rows)
+    scanned = n * xb.shape[1] * xb.dtype.itemsize
+    stats = {"rows": n, "bytes": scanned, "seconds": seconds, "gbps": scanned / 1e9 / max(seconds, 1e-9)}
+    return D, I, stats
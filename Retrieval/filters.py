@@ -0,0 +1,101 @@
+"""
+Metadata filters cho Stage 1 (push xuống vector search).
+
+    filters = {
+        "videos":     ["L01", "L02/V005", "L03_V010"],  # batch Lxx hoặc video Lxx/Vyyy
+        "time_range": (start_s, end_s),                 # frame: timestamp | shot: overlap [start, end]
+        "tags":       ["flood", "interview"],           # khớp ít nhất 1 tag
+    }
+
+compile_filters() trả về mảng rows (sorted, int64) hợp lệ của frame/shot index,
+dựa trên bảng per-video rows dựng sẵn trong core_cache khi preload core.h5.
+"""
+
+from __future__ import annotations
+import re
+from typing import Dict, Optional
+
+import numpy as np
+
+from Retrieval.cache_loader import core_cache, ocr_cache, group_rows
+
+_KEYS = {"videos", "time_range", "tags"}
+
+
+def _normalize_video(v: str) -> str:
+    return v.strip().strip("/").replace("_", "/")
+
+
+def _split_tags(raw) -> list:
+    return [t for t in (x.strip(" []'\"").lower() for x in re.split(r"[,;|]", str(raw))) if t]
+
+
+def _video_rows(videos, table: Dict[str, np.ndarray]) -> np.ndarray:
+    picked = []
+    for v in map(_normalize_video, videos):
+        if "/" in v:                      # 1 video
+            if v in table:
+                picked.append(table[v])
+        else:                             # cả batch Lxx
+            picked.extend(rows for name, rows in table.items() if name.split("/")[0] == v)
+    return np.unique(np.concatenate(picked)) if picked else np.empty(0, dtype=np.int64)
+
+
+def _tag_index(level: str) -> Dict[str, np.ndarray]:
+    """Inverted index tag → rows, dựng lazy ở lần lọc theo tag đầu tiên."""
+    key = f"{level}_tag_rows"
+    if key not in core_cache:
+        buckets: Dict[str, list] = {}
+        for row, raw in enumerate(core_cache[f"{level}_meta"]["tags"]):
+            for t in _split_tags(raw):
+                buckets.setdefault(t, []).append(row)
+        core_cache[key] = {t: np.asarray(r, dtype=np.int64) for t, r in buckets.items()}
+    return core_cache[key]
+
+
+def compile_filters(filters: Optional[Dict], search_type: str) -> Optional[np.ndarray]:
+    """filters → rows hợp lệ (None = không lọc) cho frame/shot index."""
+    if not filters:
+        return None
+    unknown = set(filters) - _KEYS
+    if unknown:
+        raise ValueError(f"Unsupported filter keys: {sorted(unknown)}")
+
+    rows = None
+    if filters.get("videos"):
+        rows = _video_rows(filters["videos"], core_cache[f"{search_type}_video_rows"])
+
+    if filters.get("time_range"):
+        t0, t1 = filters["time_range"]
+        meta = core_cache[f"{search_type}_meta"]
+        if search_type == "frame":
+            ts = np.asarray(meta["timestamp"])
+            mask = (ts >= t0) & (ts <= t1)
+        else:
+            mask = (np.asarray(meta["end_time"]) >= t0) & (np.asarray(meta["start_time"]) <= t1)
+        rows = np.flatnonzero(mask) if rows is None else rows[mask[rows]]
+
+    if filters.get("tags"):
+        index = _tag_index(search_type)
+        hits = [index[t] for t in map(str.lower, filters["tags"]) if t in index]
+        tag_rows = np.unique(np.concatenate(hits)) if hits else np.empty(0, dtype=np.int64)
+        rows = tag_rows if rows is None else np.intersect1d(rows, tag_rows, assume_unique=True)
+
+    return None if rows is None else rows.astype(np.int64)
+
+
+def compile_ocr_filters(filters: Optional[Dict]) -> Optional[np.ndarray]:
+    """OCR matrix chỉ biết đường dẫn ảnh → chỉ hỗ trợ lọc theo videos."""
+    if not filters:
+        return None
+    if set(filters) - {"videos"}:
+        raise ValueError("OCR search only supports the 'videos' filter")
+    if "video_rows" not in ocr_cache:
+        keys = []
+        for p in ocr_cache["paths"]:
+            parts = p.split("/")
+            i = parts.index("Mid_Frames") if "Mid_Frames" in parts else len(parts) - 3
+            keys.append("/".join(parts[i + 1:i + 3]))
+        videos, codes = np.unique(np.array(keys, dtype=object), return_inverse=True)
+        ocr_cache["video_rows"] = group_rows(codes, [str(v) for v in videos])
+    return _video_rows(filters["videos"], ocr_cache["video_rows"])
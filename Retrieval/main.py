@@ -1,4 +1,15 @@
 import argparse
+import contextvars
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext, redirect_stdout
+from typing import Dict, List
+import numpy as np
 from Retrieval import (
     preload_all_caches,
     CLIPEmbedder,
@@ -6,51 +17,313 @@ from Retrieval import (
     refine_shots_with_dp,
     rerank_with_openai_parallel,
 )
-from Retrieval.config import MAX_WORKERS
+from Retrieval.stage1 import stage1_retrieve_batch
+from Retrieval.client import SearchClient
+from Retrieval.pipeline import stream_search
+from Retrieval import telemetry
+from Retrieval.profiling import profile_session, profile_stage
+from Retrieval.config import (
+    MAX_WORKERS, SEARCH_SERVICE_URL, DEDUPE_THRESHOLD, DEDUPE_SCOPE, DEADLINE_MS, PROFILE_DIR,
+    RERANK_MIN_CONFIDENT, RERANK_MAX_CALLS, RERANK_BUDGET_S, BATCH_MAX_SIZE,
+)
 
 
 def parse_args():
     p = argparse.ArgumentParser()
-    p.add_argument("--query", required=True, type=str)
-    p.add_argument("--type_search", default="clip", choices=["clip", "llm_caption", "blip_caption", "ocr"])
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument("--query", type=str)
+    src.add_argument("--queries-file", dest="queries_file", default=None,
+                     help="batch mode: JSONL / CSV, mỗi dòng 1 query (cột \"query\" bắt buộc; các cột "
+                          "type_search, search_type, top_k, ... ghi đè tham số CLI cho query đó)")
+    p.add_argument("--output", default="-", help="batch mode: file JSON lines nhận kết quả (mặc định stdout)")
+    p.add_argument("--batch_size", default=BATCH_MAX_SIZE, type=int,
+                   help="batch mode: số queries / lần encode + search Stage 1")
+    p.add_argument("--type_search", default="clip", choices=["clip", "llm_caption", "blip_caption", "ocr",
+                                                           "clip_exact", "llm_caption_exact", "blip_caption_exact"])
     p.add_argument("--search_type", default="frame", choices=["frame", "shot"])
     p.add_argument("--top_k", default=50, type=int)
+    p.add_argument("--coarse_k", default=0, type=int,
+                   help="frame search: số shots lấy từ shot index trước khi search frames (0 = tắt)")
+    p.add_argument("--videos", nargs="*", default=None, help="lọc theo batch Lxx hoặc video Lxx/Vyyy")
+    p.add_argument("--time_range", nargs=2, type=float, default=None, metavar=("START", "END"))
+    p.add_argument("--tags", nargs="*", default=None)
+    p.add_argument("--dedupe", type=float, default=DEDUPE_THRESHOLD,
+                   help="bỏ near-duplicates Stage 1: cosine CLIP > ngưỡng (0 = tắt)")
+    p.add_argument("--dedupe_scope", default=DEDUPE_SCOPE, choices=["video", "global"])
+    p.add_argument("--min_score", type=float, default=None,
+                   help="range mode: mọi candidate có score >= ngưỡng, --top_k là giới hạn trên")
+    p.add_argument("--cutoff", default=None, choices=["knee", "gap"],
+                   help="cắt kết quả Stage 1 theo phân phối score")
     p.add_argument("--enable_dp", action="store_true")
     p.add_argument("--enable_rerank", action="store_true")
+    p.add_argument("--rerank_confident", type=int, default=RERANK_MIN_CONFIDENT,
+                   help="cascade rerank: dừng khi đủ N kết quả điểm cao (0 = rerank hết)")
+    p.add_argument("--rerank_max_calls", type=int, default=RERANK_MAX_CALLS, help="trần số lời gọi LLM")
+    p.add_argument("--rerank_budget_s", type=float, default=RERANK_BUDGET_S, help="trần thời gian Stage 3")
+    p.add_argument("--stream", action="store_true",
+                   help="streaming pipeline: Stage 2/3 chạy ngay trên từng chunk Stage 1 (chỉ local)")
+    p.add_argument("--deadline_ms", type=float, default=DEADLINE_MS,
+                   help="trả kết quả tốt nhất trong thời hạn (chạy qua streaming pipeline)")
+    p.add_argument("--trace_out", default=None, help="ghi trace (spans lồng nhau) ra file JSON lines")
+    p.add_argument("--metrics_out", default=None, help="ghi counters + histograms (Prometheus text) ra file")
+    p.add_argument("--profile", nargs="?", const="", default=None, metavar="DIR",
+                   help="cProfile + sampling (flamegraph) mỗi stage, tracemalloc khi dựng kết quả; "
+                        f"ghi vào DIR (mặc định {PROFILE_DIR}/<timestamp>)")
+    p.add_argument("--parallel_preload", action="store_true", help="chạy các cache loader đồng thời")
+    p.add_argument("--preload_report", default=None, help="ghi startup report (JSON) ra file")
+    p.add_argument("--server", default=SEARCH_SERVICE_URL,
+                   help="URL của Retrieval.service – gọi service thay vì preload caches + model local")
     return p.parse_args()
 
 
 def main():
     args = parse_args()
+    if args.trace_out:
+        telemetry.enable(True, jsonl_path=args.trace_out)
+    args.stream = args.stream or args.deadline_ms is not None
+    if args.stream and args.server:
+        raise SystemExit("--stream chỉ hỗ trợ chạy local (bỏ --server / SEARCH_SERVICE_URL)")
+    if args.stream and args.queries_file:
+        raise SystemExit("--stream / --deadline_ms chưa hỗ trợ --queries-file")
+
+    if args.server:
+        client = SearchClient(args.server)
+        client.wait_ready()
+        embedder = None
+        stage1_fn = client.stage1_retrieve_shots
+        stage1_batch_fn = None   # service tự micro-batch các request /stage1 đồng thời
+        stage2_fn = client.refine_shots_with_dp
+        stage3_fn = client.rerank_with_openai_parallel
+    else:
+        with redirect_stdout(sys.stderr) if args.queries_file else nullcontext():   # batch: stdout chỉ có JSON
+            print("🔧 Preloading caches ...")
+            preload_all_caches(parallel=args.parallel_preload, report_path=args.preload_report)
+            embedder = CLIPEmbedder()
+        stage1_fn, stage2_fn, stage3_fn = stage1_retrieve_shots, refine_shots_with_dp, rerank_with_openai_parallel
+        stage1_batch_fn = stage1_retrieve_batch
 
-    print("🔧 Preloading caches ...")
-    preload_all_caches()
+    filters = {
+        k: v for k, v in
+        {"videos": args.videos, "time_range": args.time_range, "tags": args.tags}.items()
+        if v
+    }
 
-    embedder = CLIPEmbedder()
+    if args.profile is not None:
+        if args.server:
+            print("[WARN] --profile với --server chỉ đo phía client (thời gian chờ HTTP)")
+        profile_dir = args.profile or os.path.join(PROFILE_DIR, time.strftime("%Y%m%d-%H%M%S"))
+    with profile_session(profile_dir) if args.profile is not None else nullcontext():
+        if args.queries_file:
+            _run_batch(args, embedder, stage1_batch_fn, stage1_fn, stage2_fn, stage3_fn)
+        else:
+            final = _search(args, embedder, filters, stage1_fn, stage2_fn, stage3_fn)
+    if args.queries_file:
+        if args.metrics_out:
+            telemetry.write_prometheus(args.metrics_out)
+        return
+    _report(final, args)
 
-    stage1 = stage1_retrieve_shots(
-        query=args.query,
-        embedder=embedder,
-        search_type=args.search_type,
-        top_k=args.top_k,
-        type_search=args.type_search,
-        refine_stage2=args.enable_dp,
-    )
+
+def _search(args, embedder, filters, stage1_fn, stage2_fn, stage3_fn):
+    if args.stream:
+        with profile_stage("pipeline"):
+            for ev in stream_search(
+                args.query,
+                embedder,
+                search_type=args.search_type,
+                type_search=args.type_search,
+                top_k=args.top_k,
+                filters=filters or None,
+                refine_query=args.query if args.enable_dp else None,
+                top_m=args.top_k,
+                rerank_query=args.query if args.enable_rerank else None,
+                top_k_rerank=args.top_k,
+                max_workers=MAX_WORKERS,
+                deadline_ms=args.deadline_ms,
+            ):
+                if ev["event"] != "done":
+                    print(f"[{ev['t']:7.3f}s] {ev['event']:<6} → {len(ev.get('results', []))} ranked")
+        print(f"[⚡] Time-to-first-result: {ev['ttfr']:.4f}s | total: {ev['total']:.4f}s")
+        print(f"[✅] Stages completed: {ev['stages_completed']}")
+        return ev["results"]
+
+    with profile_stage("stage1"):
+        stage1 = stage1_fn(
+            query=args.query,
+            embedder=embedder,
+            search_type=args.search_type,
+            top_k=args.top_k,
+            type_search=args.type_search,
+            refine_stage2=args.enable_dp,
+            coarse_k=args.coarse_k,
+            filters=filters or None,
+            dedupe_threshold=args.dedupe,
+            dedupe_scope=args.dedupe_scope,
+            min_score=args.min_score,
+            cutoff=args.cutoff,
+        )
 
     if args.enable_dp:
-        stage2 = refine_shots_with_dp(stage1, args.query, embedder)
+        with profile_stage("stage2"):
+            stage2 = stage2_fn(stage1, args.query, embedder)
     else:
         stage2 = stage1  # đã có metadata rồi
 
     if args.enable_rerank:
-        final = rerank_with_openai_parallel(args.query, stage2)
+        with profile_stage("stage3"):
+            final = stage3_fn(args.query, stage2, top_k_rerank=args.top_k,
+                              max_workers=MAX_WORKERS, search_type=args.search_type,
+                              min_confident=args.rerank_confident, max_calls=args.rerank_max_calls,
+                              budget_s=args.rerank_budget_s)
     else:
         final = stage2
+    return final
+
+
+# ---------- Batch mode (--queries-file) ---------- #
+_QUERY_FIELDS = {"type_search": str, "search_type": str, "top_k": int, "coarse_k": int, "dedupe": float,
+                 "dedupe_scope": str, "min_score": float, "cutoff": str}
+
+
+def _read_queries(path: str, args) -> List[Dict]:
+    """JSONL hoặc CSV → specs; cột thiếu / rỗng lấy giá trị CLI. CSV: videos / tags / time_range cách nhau bởi space."""
+    with open(path, encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            rows = [{k: v for k, v in r.items() if v not in (None, "")} for r in csv.DictReader(f)]
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    specs = []
+    for i, row in enumerate(rows):
+        spec = {"id": row.get("id", i), "query": row["query"]}
+        for name, cast in _QUERY_FIELDS.items():
+            value = row.get(name, getattr(args, name))
+            spec[name] = None if value is None else cast(value)
+        filters = {}
+        for name in ("videos", "time_range", "tags"):
+            value = row.get(name, getattr(args, name))
+            if isinstance(value, str):
+                value = value.split()
+            if value:
+                filters[name] = [float(x) for x in value] if name == "time_range" else value
+        spec["filters"] = filters or None
+        specs.append(spec)
+    return specs
+
+
+def _group_key(spec: Dict):
+    """
+    Queries cùng key → 1 lần encode theo batch + 1 lần search nhiều hàng. top_k nằm trong key:
+    kết quả mỗi query không phụ thuộc query nào khác rơi vào cùng batch (--batch-size).
+    """
+    return (spec["type_search"], spec["search_type"], spec["top_k"], spec["coarse_k"], spec["dedupe"],
+            spec["dedupe_scope"], spec["min_score"], spec["cutoff"], json.dumps(spec["filters"], sort_keys=True))
+
+
+def _stage1_chunk(chunk: List[Dict], args, embedder, stage1_batch_fn, stage1_fn):
+    spec = chunk[0]
+    kwargs = dict(embedder=embedder, top_k=spec["top_k"], search_type=spec["search_type"],
+                  type_search=spec["type_search"], refine_stage2=args.enable_dp, coarse_k=spec["coarse_k"], filters=spec["filters"],
+                  dedupe_threshold=spec["dedupe"], dedupe_scope=spec["dedupe_scope"],
+                  min_score=spec["min_score"], cutoff=spec["cutoff"])
+    if stage1_batch_fn is not None:
+        return stage1_batch_fn([s["query"] for s in chunk], **kwargs)
+    # --server: gửi đồng thời → micro-batcher của service gom lại
+    with ThreadPoolExecutor(len(chunk)) as ex:
+        return list(ex.map(lambda s: stage1_fn(query=s["query"], **kwargs), chunk))
+
+
+def _run_batch(args, embedder, stage1_batch_fn, stage1_fn, stage2_fn, stage3_fn):
+    """
+    Chạy mọi query trong --queries-file: Stage 1 theo nhóm cấu hình (batch encode + multi-row search),
+    Stage 2/3 song song từng query; mỗi query xong → 1 dòng JSON (stdout hoặc --output).
+    Khi kết quả ra stdout, log của pipeline được chuyển sang stderr.
+    """
+    specs = _read_queries(args.queries_file, args)
+    groups: Dict = {}
+    for spec in specs:
+        groups.setdefault(_group_key(spec), []).append(spec)
+    to_stdout = args.output in (None, "-")
+    out = sys.stdout if to_stdout else open(args.output, "w", encoding="utf-8")
+    lock = threading.Lock()
+    stats = {"ok": 0, "errors": 0, "batches": 0, "latency": []}
+    t_run = time.perf_counter()
+
+    def _emit(spec: Dict, lat: Dict, results=None, error=None):
+        row = {"id": spec["id"], "query": spec["query"], "type_search": spec["type_search"],
+               "search_type": spec["search_type"], "latency_s": lat,
+               "elapsed_s": time.perf_counter() - t_run}
+        row.update({"error": error} if error else {"results": results})
+        line = json.dumps(row, ensure_ascii=False, default=str)
+        with lock:
+            out.write(line + "\n")
+            out.flush()
+            stats["errors" if error else "ok"] += 1
+            stats["latency"].append(sum(lat.values()))
+
+    def _finish(spec: Dict, stage1, t_stage1: float):
+        lat = {"stage1": t_stage1}
+        try:
+            if args.enable_dp:
+                t0 = time.perf_counter()
+                stage1 = stage2_fn(stage1, spec["query"], embedder)
+                lat["stage2"] = time.perf_counter() - t0
+            if args.enable_rerank:
+                t0 = time.perf_counter()
+                stage1 = stage3_fn(spec["query"], stage1, top_k_rerank=spec["top_k"],
+                                   max_workers=MAX_WORKERS, search_type=spec["search_type"],
+                                   min_confident=args.rerank_confident, max_calls=args.rerank_max_calls,
+                                   budget_s=args.rerank_budget_s)
+                lat["stage3"] = time.perf_counter() - t0
+            _emit(spec, lat, results=stage1[:spec["top_k"]])
+        except Exception as e:
+            _emit(spec, lat, error=repr(e))
+
+    print(f"[📥] {len(specs)} queries → {len(groups)} Stage 1 groups", file=sys.stderr)
+    with redirect_stdout(sys.stderr) if to_stdout else nullcontext(), ThreadPoolExecutor(MAX_WORKERS) as ex:
+        for members in groups.values():
+            for i in range(0, len(members), args.batch_size):
+                chunk = members[i:i + args.batch_size]
+                t0 = time.perf_counter()
+                try:
+                    with profile_stage("stage1"):
+                        stage1 = _stage1_chunk(chunk, args, embedder, stage1_batch_fn, stage1_fn)
+                except Exception as e:
+                    for spec in chunk:
+                        _emit(spec, {"stage1": time.perf_counter() - t0}, error=repr(e))
+                    continue
+                stats["batches"] += 1
+                t_stage1 = time.perf_counter() - t0
+                for spec, res in zip(chunk, stage1):
+                    # giữ profile session (ContextVar) cho alloc_section của Stage 2 trong worker
+                    ex.submit(contextvars.copy_context().run, _finish, spec, res, t_stage1)
+    if not to_stdout:
+        out.close()
+
+    wall = time.perf_counter() - t_run
+    lat_ms = np.array(stats["latency"]) * 1e3
+    print(f"\n=== Batch summary ===\n"
+          f"queries {len(specs)} | ok {stats['ok']} | errors {stats['errors']} | "
+          f"groups {len(groups)} | Stage 1 batches {stats['batches']}\n"
+          f"wall {wall:.2f}s | throughput {len(specs) / max(wall, 1e-9):.2f} queries/s"
+          + (f" | latency p50 {np.percentile(lat_ms, 50):.1f} ms, p95 {np.percentile(lat_ms, 95):.1f} ms"
+             if len(lat_ms) else ""),
+          file=sys.stderr)
+
+
+def _fmt_score(score) -> str:
+    """None (stage chưa chạy trên item, vd hết deadline) → "–"."""
+    return "–" if score is None else f"{score:.4f}"
+
 
+def _report(final, args):
+    if args.metrics_out:
+        telemetry.write_prometheus(args.metrics_out)
     print("\n=== Top-10 results ===")
     for i, item in enumerate(final[:10], 1):
         path = item.get("shot_path") or item.get("frame_path")
-        print(f"{i:02d}. {path} | Stage1={item.get('score'):.4f} | BGE={item.get('bge_score', -1):.4f}")
+        stages = f" [{'+'.join(item['stages'])}]" if item.get("stages") else ""
+        print(f"{i:02d}. {path} | score={_fmt_score(item.get('score'))} | "
+              f"BGE={_fmt_score(item.get('bge_score'))}{stages}")
 
 
 if __name__ == "__main__":
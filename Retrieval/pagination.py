@@ -0,0 +1,258 @@
+"""
+Cursor-based pagination cho Stage 1.
+
+Trang đầu encode query 1 lần và lưu trạng thái search vào cache phía server
+(LRU có giới hạn số cursor / bytes / TTL), trả về 1 cursor token. "Trang sau"
+dùng lại trạng thái đó thay vì chạy lại embed + scan toàn bộ index:
+
+  • "scores"   – index flat / exact / OCR: tính score của mọi vector 1 lần (1 buffer
+                 float32 [N]); trang sau chỉ là argpartition trên buffer, không matmul / I/O.
+  • "frontier" – index xấp xỉ (IVF, HNSW, shards): search lại với k tăng gấp đôi
+                 (dùng lại query vector), bỏ các id đã trả → không trùng giữa các trang.
+
+Cursor giữ snapshot cache lúc bắt đầu (Retrieval.snapshot) nên các trang nhất quán.
+Snapshot giữ toàn bộ cache (FAISS, core.h5, embeddings) – sau hot reload, cursor của snapshot
+cũ bị bỏ ngay (trang sau → "cursor expired", chạy lại search) thay vì giữ RAM gấp đôi tới hết
+TTL; PAGE_CACHE_MAX_BYTES chỉ tính buffer của cursor. Cache là per-process (nhiều worker → sticky).
+"""
+
+from __future__ import annotations
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, Optional
+
+import faiss
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+from Retrieval.cache_loader import faiss_index_cache, ocr_cache
+from Retrieval.config import (
+    FAISS_DIR, PAGE_SIZE, PAGE_CACHE_MAX_CURSORS, PAGE_CACHE_MAX_BYTES, PAGE_CURSOR_TTL_S
+)
+from Retrieval.exact_search import vector_cache
+from Retrieval.filters import compile_filters, compile_ocr_filters
+from Retrieval.search_utils import (
+    encode_queries_for_search, flat_vectors, get_index_path, split_backend, topk_from_scores
+)
+from Retrieval.shards import shard_cache
+from Retrieval.snapshot import CacheSnapshot, activate, current_snapshot, on_publish
+from Retrieval.stage1 import stage1_materialize, stage1_search
+
+
+@dataclass
+class _Cursor:
+    snapshot: CacheSnapshot
+    query_vec: np.ndarray
+    search_type: str
+    type_search: str
+    filters: Optional[Dict]
+    strategy: str = "frontier"
+    ids: Optional[np.ndarray] = None       # "scores": row của từng phần tử trong scores (None = 0..N-1)
+    scores: Optional[np.ndarray] = None    # "scores": score của mọi vector hợp lệ (lớn hơn = tốt hơn)
+    D: np.ndarray = field(default_factory=lambda: np.empty(0, np.float32))   # buffer đã sort
+    I: np.ndarray = field(default_factory=lambda: np.empty(0, np.int64))
+    frontier: int = 0
+    served: int = 0
+    exhausted: bool = False
+    last_used: float = field(default_factory=time.time)
+    lock: threading.Lock = field(default_factory=threading.Lock)   # 2 request "next" cùng cursor
+
+    @property
+    def nbytes(self) -> int:
+        extra = 0 if self.scores is None else self.scores.nbytes + (0 if self.ids is None else self.ids.nbytes)
+        return self.query_vec.nbytes + self.D.nbytes + self.I.nbytes + extra
+
+
+_cursors: "OrderedDict[str, _Cursor]" = OrderedDict()
+_lock = threading.Lock()
+
+
+# ---------- 1. Cursor cache ---------- #
+def _evict() -> None:
+    now, snap = time.time(), current_snapshot()
+    for token in [t for t, c in _cursors.items()
+                  if now - c.last_used > PAGE_CURSOR_TTL_S or c.snapshot is not snap]:
+        del _cursors[token]
+    total = sum(c.nbytes for c in _cursors.values())
+    while _cursors and (len(_cursors) > PAGE_CACHE_MAX_CURSORS or total > PAGE_CACHE_MAX_BYTES):
+        _, c = _cursors.popitem(last=False)
+        total -= c.nbytes
+
+
+def _store(cur: _Cursor) -> str:
+    token = secrets.token_urlsafe(12)
+    with _lock:
+        _cursors[token] = cur
+        _evict()
+    return token
+
+
+def _get(token: str) -> _Cursor:
+    with _lock:
+        _evict()
+        if token not in _cursors:
+            raise ValueError("Cursor expired or unknown – run the search again")
+        _cursors.move_to_end(token)
+        cur = _cursors[token]
+        cur.last_used = time.time()
+        return cur
+
+
+def _drop_stale(old: CacheSnapshot) -> None:
+    """Sau publish_snapshot: thả cursor của snapshot cũ để GC giải phóng cả bộ cache cũ."""
+    with _lock:
+        _evict()
+
+
+on_publish(_drop_stale)
+
+
+def cursor_stats() -> Dict:
+    with _lock:
+        return {"cursors": len(_cursors), "bytes": sum(c.nbytes for c in _cursors.values())}
+
+
+# ---------- 2. Score buffer ("scores" strategy) ---------- #
+def _chunked_scores(xb, q: np.ndarray, rows: Optional[np.ndarray], inner_product: bool,
+                    chunk_rows: int = 16384) -> np.ndarray:
+    n = len(xb) if rows is None else len(rows)
+    out = np.empty(n, dtype=np.float32)
+    for a in range(0, n, chunk_rows):
+        b = min(a + chunk_rows, n)
+        block = np.asarray(xb[a:b] if rows is None else xb[rows[a:b]], dtype=np.float32)
+        s = block @ q
+        if not inner_product:   # L2 → score = -(||x||² - 2 x·q), cùng thứ tự với -distance
+            s = 2 * s - (block ** 2).sum(1)
+        out[a:b] = s
+    return out
+
+
+def _init_scores(cur: _Cursor) -> bool:
+    """Tính score buffer nếu backend cho phép scan trực tiếp; False → dùng "frontier"."""
+    base, backend = split_backend(cur.type_search)
+    if base == "ocr":
+        rows = compile_ocr_filters(cur.filters)
+        matrix = ocr_cache["matrix"] if rows is None else ocr_cache["matrix"][rows]
+        cur.ids, cur.scores = rows, cosine_similarity(cur.query_vec, matrix, dense_output=True).ravel()
+        return True
+
+    index_path = get_index_path(base, cur.search_type, FAISS_DIR)
+    index_name = os.path.splitext(os.path.basename(index_path))[0]
+    xb, inner_product = None, True
+    if backend == "exact":
+        xb = vector_cache.get(index_name)
+    elif index_name not in shard_cache and index_path in faiss_index_cache:
+        index = faiss_index_cache[index_path]
+        xb = flat_vectors(index)
+        inner_product = index.metric_type == faiss.METRIC_INNER_PRODUCT
+    if xb is None:
+        return False
+    rows = compile_filters(cur.filters, cur.search_type)
+    cur.ids = rows
+    cur.scores = _chunked_scores(xb, cur.query_vec[0], rows, inner_product)
+    if not inner_product:
+        cur.scores -= float((cur.query_vec[0] ** 2).sum())   # → đúng -distance
+    return True
+
+
+# ---------- 3. Frontier ---------- #
+def _grow(cur: _Cursor, need: int) -> None:
+    """Mở rộng buffer đã sort lên ít nhất `need` phần tử (frontier tăng gấp đôi)."""
+    k = max(need, 2 * cur.frontier)
+    if cur.strategy == "scores":
+        k = min(k, len(cur.scores))
+        D, pos = topk_from_scores(cur.scores[None, :], k)
+        cur.D, cur.I = D[0], (pos[0] if cur.ids is None else cur.ids[pos[0]])
+        cur.exhausted = k == len(cur.scores)
+    else:
+        D, I = stage1_search(cur.query_vec, cur.search_type, k, cur.type_search, filters=cur.filters)
+        valid = I[0] >= 0
+        D, I = D[0][valid], I[0][valid]
+        # index xấp xỉ có thể đổi thứ tự khi k lớn hơn → giữ phần đã trả, chỉ nối id mới
+        fresh = ~np.isin(I, cur.I[:cur.served])
+        cur.D = np.concatenate([cur.D[:cur.served], D[fresh]])
+        cur.I = np.concatenate([cur.I[:cur.served], I[fresh]])
+        cur.exhausted = len(I) < k
+    cur.frontier = k
+
+
+def _take(cur: _Cursor, page_size: int, refine_stage2: bool = False) -> Dict:
+    need = cur.served + page_size
+    if need > len(cur.I) and not cur.exhausted:
+        _grow(cur, need)
+    start, end = cur.served, min(need, len(cur.I))
+    cur.served = end
+    return {
+        "results": stage1_materialize(cur.D[start:end], cur.I[start:end], cur.search_type, refine_stage2),
+        "offset": start,
+        "frontier": cur.frontier,
+        "strategy": cur.strategy,
+        "done": cur.exhausted and end >= len(cur.I),
+    }
+
+
+# ---------- 4. API ---------- #
+def search_page(query: str, embedder, search_type: str = "frame", type_search: str = "clip",
+                page_size: int = PAGE_SIZE, filters: Optional[Dict] = None) -> Dict:
+    """
+    Trang đầu của Stage 1 → {"cursor", "results", "offset", "frontier", "strategy", "done"}.
+    cursor = None khi đã hết kết quả.
+    """
+    assert search_type in ["frame", "shot"], "search_type must be 'frame' or 'shot'"
+    t0 = time.time()
+    snap = current_snapshot()
+    with activate(snap):
+        q = encode_queries_for_search([query], type_search=split_backend(type_search)[0], embedder=embedder)
+        cur = _Cursor(snapshot=snap, query_vec=q, search_type=search_type,
+                      type_search=type_search, filters=filters)
+        if _init_scores(cur):
+            cur.strategy = "scores"
+        page = _take(cur, page_size)
+    page["cursor"] = None if page["done"] else _store(cur)
+    print(f"[📄] Page 1 ({cur.strategy}): {len(page['results'])} results in {time.time() - t0:.4f}s")
+    return page
+
+
+def next_page(cursor: str, page_size: int = PAGE_SIZE) -> Dict:
+    """Trang tiếp theo của cursor – không encode lại, không scan lại với "scores"."""
+    t0 = time.time()
+    cur = _get(cursor)
+    with cur.lock, activate(cur.snapshot):
+        page = _take(cur, page_size)
+    if page["done"]:
+        with _lock:
+            _cursors.pop(cursor, None)
+    page["cursor"] = None if page["done"] else cursor
+    print(f"[📄] Page @{page['offset']} ({cur.strategy}): {len(page['results'])} results "
+          f"in {time.time() - t0:.4f}s")
+    return page
+
+
+def iter_pages(query: str, embedder, search_type: str = "frame", type_search: str = "clip",
+               page_size: int = PAGE_SIZE, filters: Optional[Dict] = None, limit: Optional[int] = None,
+               refine_stage2: bool = False, snapshot: Optional[CacheSnapshot] = None) -> Iterator[Dict]:
+    """
+    Các trang liên tiếp của 1 query, không qua cursor cache (dùng trong process, vd Retrieval.pipeline).
+    Dừng khi hết kết quả hoặc đã trả `limit` candidates; refine_stage2 → trang chỉ chứa shot paths.
+    """
+    assert search_type in ["frame", "shot"], "search_type must be 'frame' or 'shot'"
+    snap = snapshot or current_snapshot()
+    with activate(snap):
+        q = encode_queries_for_search([query], type_search=split_backend(type_search)[0], embedder=embedder)
+        cur = _Cursor(snapshot=snap, query_vec=q, search_type=search_type,
+                      type_search=type_search, filters=filters)
+        if _init_scores(cur):
+            cur.strategy = "scores"
+    while True:
+        size = page_size if limit is None else min(page_size, limit - cur.served)
+        if size <= 0:
+            return
+        with activate(snap):
+            page = _take(cur, size, refine_stage2)
+        yield page
+        if page["done"]:
+            return
@@ -0,0 +1,295 @@
+"""
+Streaming pipeline Stage 1 → 2 → 3.
+
+Bản tuần tự (main.py, app_v2) chờ Stage 2 chấm + sort toàn bộ candidates rồi Stage 3 mới gửi
+batch LLM đầu tiên → time-to-first-result = tổng thời gian 3 stage. Ở đây:
+
+  • Stage 1 – trả candidates theo chunk (Retrieval.pagination.iter_pages), xen kẽ các sub-queries
+  • Stage 2 – chấm DP từng chunk ngay khi tới, giữ top-m bằng heap
+  • Stage 3 – gửi batch LLM cho các candidate đang nằm trong top-k_rerank ngay khi đủ 1 batch;
+              candidate bị đẩy ra khỏi top sau đó bị bỏ (đếm vào "llm_wasted")
+
+stream_search() là generator trả các event (dict) theo thời gian:
+    {"event": "stage1" | "stage2" | "stage3", "t": giây từ lúc bắt đầu, "results": [...], ...}
+    {"event": "done", "results": [...], "ttfr": ..., "total": ..., "first": {...}, "stats": {...}}
+
+ttfr = lúc kết quả xếp hạng đầu tiên của stage cuối cùng được bật có sẵn.
+Toàn bộ stream dùng 1 cache snapshot (chốt lúc bắt đầu).
+
+deadline_ms: _Deadline chia thời gian – Stage 1+2 nhận chunk mới / chấm thêm shots chỉ khi còn
+trong phần của mình, Stage 3 chỉ gửi batch nếu latency ước lượng còn kịp; hết giờ → trả kết quả
+tốt nhất đang có. Mỗi kết quả có "stages" (các stage đã chạy trên nó), event "done" có
+"stages_completed" (stage nào chạy hết toàn bộ candidates). Shots Stage 1 đã lấy nhưng chưa kịp
+chấm DP vẫn được trả (sau các shot đã chấm, theo thứ tự Stage 1, score None, stages=["stage1"]).
+"""
+
+from __future__ import annotations
+import heapq
+import itertools
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Union
+
+from Retrieval.config import (
+    DEADLINE_DP_STEP, DEADLINE_MARGIN_MS, DEADLINE_MS, DEADLINE_STAGE3_SHARE, MAX_WORKERS,
+    RERANK_BATCH_SIZE, STREAM_CHUNK_SIZE,
+)
+from Retrieval.pagination import iter_pages
+from Retrieval.snapshot import activate, current_snapshot
+from Retrieval.cache_loader import shot_cache
+from Retrieval.stage2_dp import encode_subqueries, score_shots, shot_item
+from Retrieval.stage3_rerank import _call_openai, merge_reranked
+from Retrieval.telemetry import observe
+
+
+def _path(item: Dict) -> str:
+    return item.get("shot_path") or item.get("frame_path")
+
+
+# ---------- 1. Running top-m ---------- #
+class _TopM:
+    """Min-heap giữ `capacity` items điểm cao nhất (theo item["score"])."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._heap: List = []
+        self._seq = itertools.count()   # tie-break, tránh so sánh dict
+
+    def push(self, item: Dict) -> None:
+        entry = (item["score"], next(self._seq), item)
+        if len(self._heap) < self.capacity:
+            heapq.heappush(self._heap, entry)
+        elif entry[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def ranked(self) -> List[Dict]:
+        return [item for _, _, item in sorted(self._heap, key=lambda e: (-e[0], e[1]))]
+
+
+def _interleave(pages: List[Iterator[Dict]]) -> Iterator[Dict]:
+    """Round-robin các iterator trang của từng sub-query."""
+    while pages:
+        for it in list(pages):
+            page = next(it, None)
+            if page is None:
+                pages.remove(it)
+            else:
+                yield page
+
+
+# ---------- 2. Deadline scheduler ---------- #
+class _Deadline:
+    """Ngân sách thời gian của 1 query (deadline_ms=None → không giới hạn)."""
+
+    def __init__(self, deadline_ms: Optional[float], stage3: bool):
+        self.t0 = time.time()
+        self.end = None
+        self.stage12_end = None
+        if deadline_ms is not None:
+            if deadline_ms <= 0:
+                raise ValueError(f"deadline_ms must be > 0, got {deadline_ms}")
+            margin = DEADLINE_MARGIN_MS
+            if deadline_ms <= 2 * margin:   # deadline ngắn: margin cố định sẽ ăn hết ngân sách
+                margin = deadline_ms / 2
+                print(f"[WARN] deadline_ms={deadline_ms:.0f} <= 2 × DEADLINE_MARGIN_MS – margin clamped to {margin:.0f}ms")
+            self.end = self.t0 + (deadline_ms - margin) / 1000
+            share = DEADLINE_STAGE3_SHARE if stage3 else 0.0
+            self.stage12_end = self.end - share * (self.end - self.t0)
+        self.llm_cost = 0.0          # latency 1 batch LLM, ước lượng từ các batch đã xong
+        self.llm_observed = False
+        self.hit = False
+
+    def remaining(self) -> Optional[float]:
+        return None if self.end is None else max(0.0, self.end - time.time())
+
+    def stage12_open(self) -> bool:
+        ok = self.stage12_end is None or time.time() < self.stage12_end
+        self.hit |= not ok
+        return ok
+
+    def can_dispatch(self) -> bool:
+        """Batch đầu tiên luôn được gửi (dò latency, hết giờ thì bỏ); sau đó chỉ gửi nếu còn kịp."""
+        if self.end is None:
+            return True
+        ok = time.time() + self.llm_cost < self.end
+        self.hit |= not ok
+        return ok
+
+    def observe_llm(self, seconds: float) -> None:
+        if not self.llm_observed:
+            self.llm_cost, self.llm_observed = seconds, True
+        self.llm_cost = max(seconds, 0.5 * self.llm_cost + 0.5 * seconds)   # ước lượng thận trọng
+
+
+# ---------- 3. Stream ---------- #
+def stream_search(queries: Union[str, List[str]],
+                  embedder,
+                  *,
+                  search_type: str = "frame",
+                  type_search: str = "clip",
+                  top_k: int = 50,
+                  filters: Optional[Dict] = None,
+                  refine_query: Optional[str] = None,
+                  top_m: int = 20,
+                  rerank_query: Optional[str] = None,
+                  top_k_rerank: int = 20,
+                  max_workers: int = MAX_WORKERS,
+                  chunk_size: int = STREAM_CHUNK_SIZE,
+                  deadline_ms: Optional[float] = DEADLINE_MS) -> Iterator[Dict]:
+    """
+    queries: query Stage 1 (hoặc list sub-queries, mỗi cái tối đa top_k candidates).
+    refine_query: bật Stage 2 (DP) với query này; None → xếp hạng theo score Stage 1.
+    rerank_query: bật Stage 3 (LLM) trên top_k_rerank candidates; None → tắt.
+    deadline_ms: trả kết quả tốt nhất có được trong thời hạn này (None → chạy hết).
+    """
+    queries = [queries] if isinstance(queries, str) else list(queries)
+    dl = _Deadline(deadline_ms, stage3=bool(rerank_query))
+    t0 = dl.t0
+    snap = current_snapshot()
+    refine = refine_query is not None
+    last = "stage3" if rerank_query else "stage2" if refine else "stage1"
+    first: Dict[str, float] = {}
+    stats = {"chunks": 0, "candidates": 0, "shots_scored": 0, "shots_skipped": 0,
+             "llm_batches": 0, "llm_wasted": 0}
+    stages_completed = {"stage1": False}   # chỉ các stage được bật
+    if refine:
+        stages_completed["stage2"] = False
+    if rerank_query:
+        stages_completed["stage3"] = False
+
+    top = _TopM(max(top_m, top_k_rerank if rerank_query else 0))
+    seen: set = set()
+    unscored: List[str] = []           # shots đã lấy ở Stage 1 nhưng không kịp chấm DP (thứ tự Stage 1)
+    sub_mat = encode_subqueries(refine_query, embedder) if refine else None
+    base_stages = ["stage1", "stage2"] if refine else ["stage1"]
+
+    reranked: Dict[str, Dict] = {}     # path → output LLM ({path, score, explanation})
+    dispatched: set = set()
+    futs: Dict = {}                    # future → thời điểm gửi
+    ex = ThreadPoolExecutor(max_workers=max_workers) if rerank_query else None
+
+    def event(name: str, **kw) -> Dict:
+        now = time.time() - t0
+        if name not in first:
+            first[name] = now
+        return {"event": name, "t": now, **kw}
+
+    def dispatch(flush: bool) -> None:
+        pending = [it for it in top.ranked()[:top_k_rerank] if _path(it) not in dispatched]
+        while (len(pending) >= RERANK_BATCH_SIZE or (flush and pending)) and dl.can_dispatch():
+            batch, pending = pending[:RERANK_BATCH_SIZE], pending[RERANK_BATCH_SIZE:]
+            dispatched.update(_path(it) for it in batch)
+            futs[ex.submit(_call_openai, rerank_query, batch, stats["llm_batches"], search_type)] = time.time()
+            stats["llm_batches"] += 1
+
+    def collect(done) -> None:
+        for fut in done:
+            dl.observe_llm(time.time() - futs.pop(fut))
+            for entry in fut.result():
+                reranked[entry["path"]] = entry
+
+    def stage3_results() -> List[Dict]:
+        current = top.ranked()[:top_k_rerank]
+        out = merge_reranked([reranked[_path(it)] for it in current if _path(it) in reranked], current)
+        return [{**it, "stages": base_stages + ["stage3"]} for it in out]
+
+    def ranked(n: int) -> List[Dict]:
+        return [{**it, "stages": base_stages} for it in top.ranked()[:n]]
+
+    def fill_unscored(results: List[Dict], n: int) -> List[Dict]:
+        """Bù các shot chưa chấm DP (hết giờ) sau kết quả đã xếp hạng, tới đủ n."""
+        with activate(snap):
+            extra = [{**shot_item(p, shot_cache[p]["frame_paths"], None), "stages": ["stage1"]}
+                     for p in unscored[:max(0, n - len(results))] if p in shot_cache]
+        return results + extra
+
+    try:
+        # ---------- a) Stage 1 chunks → Stage 2 → dispatch Stage 3 ---------- #
+        pages = [iter_pages(q, embedder, search_type, type_search, chunk_size, filters,
+                            limit=top_k, refine_stage2=refine, snapshot=snap) for q in queries]
+        stream = _interleave(pages)
+        while True:
+            if stats["chunks"] and not dl.stage12_open():
+                break
+            page = next(stream, None)
+            if page is None:
+                stages_completed["stage1"] = True
+                break
+            fresh = [c for c in page["results"] if (c if refine else _path(c)) not in seen]
+            seen.update(c if refine else _path(c) for c in fresh)
+            stats["chunks"] += 1
+            stats["candidates"] += len(page["results"])
+
+            if refine:
+                yield event("stage1", chunk=stats["chunks"], candidates=len(fresh))
+                step = DEADLINE_DP_STEP if dl.end else max(len(fresh), 1)
+                for i in range(0, len(fresh), step):
+                    if not dl.stage12_open():   # hết phần Stage 1+2 → các shot còn lại chỉ có Stage 1
+                        stats["shots_skipped"] += len(fresh) - i
+                        unscored.extend(fresh[i:])
+                        break
+                    with activate(snap):
+                        scored = score_shots(fresh[i : i + step], sub_mat)
+                    stats["shots_scored"] += len(scored)
+                    for item in scored:
+                        top.push(item)
+                yield event("stage2", results=ranked(top_m), scored=stats["shots_scored"])
+            else:
+                for item in fresh:
+                    top.push(item)
+                yield event("stage1", chunk=stats["chunks"], candidates=len(fresh), results=ranked(top_m))
+
+            if ex is not None:
+                dispatch(flush=False)
+                done = [f for f in futs if f.done()]
+                if done:
+                    collect(done)
+                    yield event("stage3", results=stage3_results(), pending=len(futs))
+        if refine:
+            stages_completed["stage2"] = stages_completed["stage1"] and not stats["shots_skipped"]
+
+        # ---------- b) Stage 3: gửi phần còn lại, trả kết quả theo từng batch xong ---------- #
+        if ex is not None:
+            dispatch(flush=True)
+            while futs:
+                done, _ = wait(list(futs), timeout=dl.remaining(), return_when=FIRST_COMPLETED)
+                if not done:   # hết giờ: bỏ các batch đang chạy
+                    dl.hit = True
+                    break
+                collect(done)
+                yield event("stage3", results=stage3_results(), pending=len(futs))
+            final = stage3_results()
+            window = {_path(it) for it in top.ranked()[:top_k_rerank]}
+            stats["llm_wasted"] = len(dispatched - window)
+            stages_completed["stage3"] = stages_completed.get("stage2", stages_completed["stage1"]) \
+                and window <= set(reranked)
+            if dl.end is not None:   # candidate chưa kịp rerank: xếp sau, theo score Stage 2
+                done_paths = {_path(it) for it in final}
+                final += [it for it in ranked(top_m) if _path(it) not in done_paths]
+        else:
+            final = ranked(top_m)
+        if unscored:
+            final = fill_unscored(final, max(top_m, top_k_rerank if rerank_query else 0))
+    finally:
+        if ex is not None:
+            ex.shutdown(wait=False, cancel_futures=True)   # consumer dừng sớm / hết giờ → huỷ batch chưa chạy
+
+    total = time.time() - t0
+    ttfr = first.get(last, total)
+    observe("pipeline.ttfr", ttfr)
+    observe("pipeline.total", total)
+    print(f"[⚡] Streaming pipeline: TTFR {ttfr:.4f}s | total {total:.4f}s | "
+          f"{stats['chunks']} chunks, {stats['llm_batches']} LLM batches ({stats['llm_wasted']} items wasted)")
+    if deadline_ms is not None:
+        print(f"[⏱️] Deadline {deadline_ms:.0f}ms {'hit' if dl.hit else 'met'} – stages completed: "
+              f"{[k for k, v in stages_completed.items() if v]}")
+    yield {"event": "done", "t": total, "results": final, "ttfr": ttfr, "total": total,
+           "first": first, "stats": stats, "stages_completed": stages_completed,
+           "deadline_ms": deadline_ms, "deadline_hit": dl.hit}
+
+
+def run_streaming(queries: Union[str, List[str]], embedder, **kwargs) -> Dict:
+    """Chạy hết stream_search, trả event "done"."""
+    for ev in stream_search(queries, embedder, **kwargs):
+        pass
+    return ev
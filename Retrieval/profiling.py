@@ -0,0 +1,194 @@
+"""
+Profiling hooks cho 1 lần chạy pipeline (main.py --profile, sidebar "Profile this run").
+
+    with profile_session("profiles/run1") as prof:
+        with profile_stage("stage1"):
+            ...
+    → profiles/run1/
+        stage1.pstats          cProfile (snakeviz / pstats)
+        stage1.folded          sampling profiler, collapsed stacks (flamegraph.pl, speedscope)
+        stage1.materialize.alloc.txt   tracemalloc – top allocations khi dựng result dicts
+        summary.txt            wall time + top-N hotspots mỗi stage
+
+Ngoài session, profile_stage / alloc_section là no-op (1 lần đọc ContextVar) nên có thể để
+sẵn trong code production. Session gắn với context hiện tại (mỗi script run Streamlit / request
+có context riêng) nên nhiều session chạy song song không ghi lẫn vào thư mục của nhau.
+cProfile chỉ thấy thread gọi stage; sampler lấy mẫu mọi thread (vd các lời gọi LLM của Stage 3
+trong ThreadPoolExecutor) – khi có session song song, flamegraph cũng chứa stack của chúng.
+"""
+
+from __future__ import annotations
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from Retrieval.config import PROFILE_SAMPLE_INTERVAL_S, PROFILE_TOP_N
+
+_session: ContextVar[Optional["ProfileSession"]] = ContextVar("profile_session", default=None)
+
+# tracemalloc là global của process → đếm số alloc_section đang mở (mọi session); chỉ stop
+# nếu chính module này đã start (không tắt tracing do caller bật, vd PYTHONTRACEMALLOC)
+_trace_lock = threading.Lock()
+_trace_users = 0
+_trace_started = False
+
+
+# ---------- 1. Sampling profiler ---------- #
+class _Sampler(threading.Thread):
+    """Lấy mẫu stack của mọi thread mỗi `interval` giây → Counter collapsed stacks."""
+
+    def __init__(self, interval: float):
+        super().__init__(daemon=True, name="profile-sampler")
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._halt = threading.Event()
+
+    def run(self) -> None:
+        names = {}
+        while not self._halt.wait(self.interval):
+            names.update({t.ident: t.name for t in threading.enumerate()})
+            for tid, frame in sys._current_frames().items():
+                if tid == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join([names.get(tid, str(tid)), *reversed(stack)])] += 1
+
+    def stop(self) -> Counter:
+        self._halt.set()
+        self.join()
+        return self.stacks
+
+
+# ---------- 2. Session ---------- #
+class ProfileSession:
+    def __init__(self, out_dir: str, top_n: int = PROFILE_TOP_N, interval: float = PROFILE_SAMPLE_INTERVAL_S):
+        self.out_dir = out_dir
+        self.top_n = top_n
+        self.interval = interval
+        self.sections: List[Dict] = []
+        self._lock = threading.Lock()
+        self._busy = threading.local()   # cProfile không lồng được trong cùng thread
+        self._seen: Counter = Counter()
+        os.makedirs(out_dir, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.out_dir, name)
+
+    def _unique(self, name: str) -> str:
+        """stage chạy nhiều lần (vd mỗi sub-query) → stage1, stage1.2, stage1.3, ..."""
+        with self._lock:
+            self._seen[name] += 1
+            n = self._seen[name]
+        return name if n == 1 else f"{name}.{n}"
+
+    @contextmanager
+    def stage(self, name: str):
+        if getattr(self._busy, "on", False):   # stage lồng trong stage khác → đã được đo ở ngoài
+            yield
+            return
+        self._busy.on = True
+        name = self._unique(name)
+        prof, sampler = cProfile.Profile(), _Sampler(self.interval)
+        sampler.start()
+        t0 = time.perf_counter()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            wall = time.perf_counter() - t0
+            stacks = sampler.stop()
+            self._busy.on = False
+            prof.dump_stats(self._path(f"{name}.pstats"))
+            with open(self._path(f"{name}.folded"), "w", encoding="utf-8") as f:
+                f.writelines(f"{s} {n}\n" for s, n in stacks.most_common())
+            out = io.StringIO()
+            pstats.Stats(prof, stream=out).sort_stats("tottime").print_stats(self.top_n)
+            with self._lock:
+                self.sections.append({"name": name, "kind": "stage", "wall": wall,
+                                      "samples": sum(stacks.values()), "hotspots": out.getvalue()})
+
+    @contextmanager
+    def alloc(self, name: str):
+        global _trace_users, _trace_started
+        name = self._unique(name)
+        with _trace_lock:
+            if _trace_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+                _trace_started = True
+            _trace_users += 1
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            with _trace_lock:
+                _trace_users -= 1
+                if _trace_users == 0 and _trace_started:
+                    tracemalloc.stop()
+                    _trace_started = False
+            diff = after.compare_to(before, "traceback")
+            lines = [f"peak traced: {peak / 2**20:.2f} MiB", ""]
+            for stat in diff[:self.top_n]:
+                lines.append(f"{stat.size_diff / 1024:+10.1f} KiB  {stat.count_diff:+8d} blocks")
+                lines += [f"    {l}" for l in stat.traceback.format()[-6:]]
+            report = "\n".join(lines)
+            with open(self._path(f"{name}.alloc.txt"), "w", encoding="utf-8") as f:
+                f.write(report + "\n")
+            with self._lock:
+                self.sections.append({"name": name, "kind": "alloc", "hotspots": report})
+
+    def write_summary(self) -> str:
+        parts = []
+        for sec in self.sections:
+            if sec["kind"] == "stage":
+                parts.append(f"=== {sec['name']}: {sec['wall']:.4f}s wall, {sec['samples']} samples ===")
+            else:
+                parts.append(f"=== {sec['name']}: allocations (tracemalloc) ===")
+            parts.append(sec["hotspots"].rstrip() + "\n")
+        text = "\n".join(parts)
+        with open(self._path("summary.txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+        return text
+
+
+@contextmanager
+def profile_session(out_dir: str, top_n: int = PROFILE_TOP_N, interval: float = PROFILE_SAMPLE_INTERVAL_S):
+    """Bật profiling cho mọi profile_stage / alloc_section trong block (1 session / context)."""
+    if _session.get() is not None:
+        raise RuntimeError("A profiling session is already active in this context")
+    sess = ProfileSession(out_dir, top_n, interval)
+    token = _session.set(sess)
+    try:
+        yield sess
+    finally:
+        _session.reset(token)
+        sess.write_summary()
+        print(f"[📄] Profile written to {sess.out_dir} (summary.txt, *.pstats, *.folded, *.alloc.txt)")
+
+
+# ---------- 3. Hooks (no-op ngoài session) ---------- #
+def profile_stage(name: str):
+    """cProfile + sampling cho 1 stage."""
+    sess = _session.get()
+    return nullcontext() if sess is None else sess.stage(name)
+
+
+def alloc_section(name: str):
+    """tracemalloc snapshot diff cho 1 đoạn code (vd dựng result dicts)."""
+    sess = _session.get()
+    return nullcontext() if sess is None else sess.alloc(name)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark: full frame search vs coarse-to-fine (shot → frame) search.
+
+    python -m Retrieval.scripts.bench_coarse_to_fine --queries queries.txt --coarse_k 300 --top_k 500
+"""
+
+import argparse
+import json
+import time
+import numpy as np
+
+from Retrieval.cache_loader import preload_faiss, preload_core_h5
+from Retrieval.embedder import CLIPEmbedder
+from Retrieval.search_utils import encode_query_for_search
+from Retrieval.stage1 import _vector_search, _coarse_to_fine_search
+
+
+def _timeit(fn, repeat: int):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--queries", required=True, help="file text, mỗi dòng 1 query")
+    p.add_argument("--type_search", default="clip", choices=["clip", "llm_caption", "blip_caption"])
+    p.add_argument("--top_k", default=500, type=int)
+    p.add_argument("--coarse_k", default=300, type=int)
+    p.add_argument("--repeat", default=3, type=int)
+    p.add_argument("--output", default=None, help="ghi kết quả JSON")
+    args = p.parse_args()
+
+    with open(args.queries, encoding="utf-8") as f:
+        queries = [l.strip() for l in f if l.strip()]
+
+    preload_faiss()
+    preload_core_h5()
+    embedder = CLIPEmbedder() if args.type_search == "clip" else None
+
+    rows = []
+    for q in queries:
+        vec = encode_query_for_search(q, type_search=args.type_search, embedder=embedder)
+        t_full, (_, I_full) = _timeit(
+            lambda: _vector_search(args.type_search, "frame", vec[None, :], args.top_k), args.repeat
+        )
+        t_c2f, (_, I_c2f) = _timeit(
+            lambda: _coarse_to_fine_search(vec, args.type_search, args.top_k, args.coarse_k), args.repeat
+        )
+        full = set(I_full[0].tolist())
+        recall = len(full & set(I_c2f[0].tolist())) / max(len(full), 1)
+        top1 = bool(len(I_c2f[0]) and I_c2f[0][0] == I_full[0][0])
+        rows.append({"query": q, "full_s": t_full, "c2f_s": t_c2f, "recall": recall, "top1_match": top1})
+        print(f"{t_full*1e3:8.2f}ms  {t_c2f*1e3:8.2f}ms  recall@{args.top_k}={recall:.3f}  top1={top1}  | {q[:50]}")
+
+    full_ms = np.array([r["full_s"] for r in rows]) * 1e3
+    c2f_ms  = np.array([r["c2f_s"] for r in rows]) * 1e3
+    summary = {
+        "queries": len(rows),
+        "top_k": args.top_k,
+        "coarse_k": args.coarse_k,
+        "full_ms_p50": float(np.median(full_ms)),
+        "c2f_ms_p50": float(np.median(c2f_ms)),
+        "speedup_p50": float(np.median(full_ms / np.maximum(c2f_ms, 1e-9))),
+        "recall_mean": float(np.mean([r["recall"] for r in rows])),
+        "top1_match_rate": float(np.mean([r["top1_match"] for r in rows])),
+    }
+    print("\n=== Summary ===")
+    print(json.dumps(summary, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "queries": rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
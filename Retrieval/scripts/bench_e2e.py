@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Benchmark end-to-end trên archive tổng hợp (scripts/make_synthetic_archive.py), ở nhiều kích thước.
+
+    python -m Retrieval.scripts.bench_e2e --root /tmp/synth --scales 10x50,50x50,200x50 --output bench.json
+
+Mỗi scale "VxS" (V videos × S shots × 8 frames) → <root>/v{V}_s{S} (sinh nếu chưa có), rồi 1 process
+con với DATA_ROOT=<archive> đo:
+    cold_start  import + preload_all_caches (startup report từng loader)
+    stage1      stage1_retrieve_shots theo từng type_search (clip, clip_exact, llm_caption, blip_caption, ocr)
+    stage2      refine_shots_with_dp trên shots của Stage 1 (clip)
+    stage3      rerank_with_openai_parallel với LLM giả (--llm_latency_ms, không gọi mạng)
+Embedder CLIP / OpenAI embeddings được thay bằng text_vector của generator (cùng không gian vector
+với archive) → không cần GPU / API key; số đo là overhead của pipeline, không phải của model.
+Output JSON có key cố định theo scale / stage → so sánh được giữa 2 commit.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import zlib
+
+import numpy as np
+
+from Retrieval.scripts.make_synthetic_archive import make_archive, text_vector
+
+TYPE_SEARCHES = ["clip", "clip_exact", "llm_caption", "blip_caption", "ocr"]
+
+
+# ---------- 1. Stubs (chỉ trong process benchmark) ---------- #
+class _Vec:
+    """Giả tensor torch: .cpu().numpy() như output của CLIPEmbedder."""
+
+    def __init__(self, a: np.ndarray):
+        self.a = a
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.a
+
+
+class StubEmbedder:
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def encode_text(self, text: str):
+        return _Vec(text_vector(text, self.dim))
+
+    def encode_texts(self, texts):
+        return _Vec(np.stack([text_vector(t, self.dim) for t in texts]))
+
+
+class StubOpenAI:
+    """embeddings.create → text_vector; chat.completions.create → JSON rerank (score theo crc32 path)."""
+
+    def __init__(self, text_dim: int, latency_s: float = 0.0):
+        self.text_dim = text_dim
+        self.latency_s = latency_s
+        self.embeddings = types.SimpleNamespace(create=self._embed)
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._chat))
+
+    def _embed(self, input, model=None, **_):
+        texts = [input] if isinstance(input, str) else list(input)
+        return types.SimpleNamespace(data=[types.SimpleNamespace(embedding=text_vector(t, self.text_dim).tolist())
+                                           for t in texts])
+
+    def _chat(self, messages, model=None, **_):
+        time.sleep(self.latency_s)
+        paths = re.findall(r'"path": "([^"]+)"', messages[-1]["content"])
+        content = json.dumps([{"path": p, "score": zlib.crc32(p.encode()) % 100, "explanation": "stub"}
+                              for p in paths])
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+
+
+def _install_stub_llm(text_dim: int, latency_s: float) -> None:
+    import openai
+    from Retrieval import stage3_rerank
+
+    client = StubOpenAI(text_dim, latency_s)
+    openai.OpenAI = lambda *a, **k: client       # search_utils tạo client lúc encode query
+    stage3_rerank.openai_client = client
+
+
+# ---------- 2. Worker (1 archive, DATA_ROOT đã trỏ vào archive) ---------- #
+def _summary(seconds) -> dict:
+    ms = np.asarray(seconds, dtype=np.float64) * 1e3
+    if not len(ms):
+        return {"n": 0}
+    return {"n": int(len(ms)), "mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)), "max_ms": float(ms.max())}
+
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return time.perf_counter() - t0, out
+
+
+def run_worker(args) -> dict:
+    archive = os.environ["DATA_ROOT"]
+    with open(os.path.join(archive, "synthetic.json")) as f:
+        manifest = json.load(f)
+    with open(os.path.join(archive, "queries.jsonl"), encoding="utf-8") as f:
+        queries = [json.loads(l) for l in f][:args.queries]
+
+    # === Cold start: import Retrieval.* (faiss / sklearn đã import qua generator) + preload
+    t0 = time.perf_counter()
+    from Retrieval.cache_loader import preload_all_caches
+    import_s = time.perf_counter() - t0
+    report = preload_all_caches(parallel=args.parallel)
+    cold = {"import_s": import_s, "preload_s": report["wall_s"], "total_s": time.perf_counter() - t0,
+            "peak_rss_bytes": report["peak_rss_bytes"],
+            "loaders": {r["name"]: r["wall_s"] for r in report["loaders"]}}
+
+    from Retrieval.stage1 import stage1_retrieve_shots
+    from Retrieval.stage2_dp import refine_shots_with_dp
+    from Retrieval.stage3_rerank import rerank_with_openai_parallel
+    _install_stub_llm(manifest["text_dim"], args.llm_latency_ms / 1e3)
+    embedder = StubEmbedder(manifest["dim"])
+
+    def _stage1(q, type_search, refine):
+        return stage1_retrieve_shots(q, embedder, args.search_type, args.top_k, type_search, refine_stage2=refine)
+
+    # === Stage 1 theo type_search (1 query warm-up, không tính); hit = shot ground truth có trong top_k
+    stage1 = {}
+    for type_search in args.type_search:
+        _stage1(queries[0]["query"], type_search, True)
+        lat, hits = [], 0
+        for q in queries:
+            dt, shots = _timed(_stage1, q["query"], type_search, True)
+            lat.append(dt)
+            hits += q["shot_path"] in shots
+        stage1[type_search] = {**_summary(lat), "hit_rate": hits / len(queries)}
+
+    # === Stage 2 + 3 trên candidates của Stage 1 (clip)
+    s2_lat, s3_lat, s3_calls = [], [], 0
+    for q in queries:
+        shots = _stage1(q["query"], "clip", True)
+        dt, refined = _timed(refine_shots_with_dp, shots[:args.top_m], q["query"], embedder)
+        s2_lat.append(dt)
+        dt, _ = _timed(rerank_with_openai_parallel, q["query"], refined, top_k_rerank=args.top_k_rerank,
+                       max_workers=args.max_workers, search_type="shot")
+        s3_lat.append(dt)
+        s3_calls += -(-min(args.top_k_rerank, len(refined)) // args.rerank_batch)
+
+    return {
+        "scale": manifest,
+        "cold_start": cold,
+        "stage1": stage1,
+        "stage2": {**_summary(s2_lat), "shots": args.top_m},
+        "stage3": {**_summary(s3_lat), "items": args.top_k_rerank, "llm_calls": s3_calls,
+                   "llm_latency_ms": args.llm_latency_ms},
+    }
+
+
+# ---------- 3. Driver ---------- #
+def _env() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import faiss
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "numpy": np.__version__, "faiss": getattr(faiss, "__version__", None)}
+
+
+def _parse_scales(spec: str):
+    return [tuple(int(x) for x in s.lower().split("x")) for s in spec.split(",") if s.strip()]
+
+
+def _ensure_archive(root: str, videos: int, shots: int, args) -> str:
+    out = os.path.join(root, f"v{videos}_s{shots}")
+    manifest = os.path.join(out, "synthetic.json")
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            m = json.load(f)
+        # worker lấy args.queries dòng đầu của queries.jsonl → archive cũ có ít query hơn thì sinh lại
+        if ((m["dim"], m["text_dim"], m["seed"]) == (args.dim, args.text_dim, args.seed)
+                and m.get("queries", 0) >= min(args.queries, m["frames"])):
+            print(f"[✅] Reusing archive {out}")
+            return out
+    make_archive(out, videos, shots, args.dim, args.text_dim, queries=args.queries, seed=args.seed)
+    return out
+
+
+def _worker_cmd(args, out_path: str):
+    cmd = [sys.executable, "-m", "Retrieval.scripts.bench_e2e", "--worker", out_path,
+           "--queries", str(args.queries), "--top_k", str(args.top_k), "--top_m", str(args.top_m),
+           "--top_k_rerank", str(args.top_k_rerank), "--max_workers", str(args.max_workers),
+           "--llm_latency_ms", str(args.llm_latency_ms), "--search_type", args.search_type,
+           "--type_search", *args.type_search]
+    return cmd + (["--parallel"] if args.parallel else [])
+
+
+def main():
+    from Retrieval.config import RERANK_BATCH_SIZE
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--root", default=os.path.join(tempfile.gettempdir(), "synthetic_archives"),
+                   help="thư mục chứa các archive tổng hợp (tái sử dụng giữa các lần chạy)")
+    p.add_argument("--scales", default="10x50,50x50", help="danh sách VIDEOSxSHOTS, vd 10x50,200x50")
+    p.add_argument("--dim", default=768, type=int)
+    p.add_argument("--text_dim", default=1536, type=int)
+    p.add_argument("--seed", default=0, type=int)
+    p.add_argument("--queries", default=50, type=int)
+    p.add_argument("--search_type", default="frame", choices=["frame", "shot"])
+    p.add_argument("--type_search", nargs="+", default=TYPE_SEARCHES, choices=TYPE_SEARCHES)
+    p.add_argument("--top_k", default=200, type=int)
+    p.add_argument("--top_m", default=100, type=int, help="số shots đưa vào Stage 2")
+    p.add_argument("--top_k_rerank", default=20, type=int)
+    p.add_argument("--max_workers", default=8, type=int)
+    p.add_argument("--llm_latency_ms", default=0.0, type=float, help="độ trễ giả / lời gọi LLM")
+    p.add_argument("--parallel", action="store_true", help="preload song song (PRELOAD_PARALLEL)")
+    p.add_argument("--output", default=None, help="ghi kết quả JSON")
+    p.add_argument("--worker", default=None, help=argparse.SUPPRESS)   # nội bộ: chạy 1 archive → file JSON
+    args = p.parse_args()
+    args.rerank_batch = RERANK_BATCH_SIZE
+
+    if args.worker:
+        with open(args.worker, "w", encoding="utf-8") as f:
+            json.dump(run_worker(args), f)
+        return
+
+    runs = []
+    for videos, shots in _parse_scales(args.scales):
+        archive = _ensure_archive(args.root, videos, shots, args)
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+            out_path = tmp.name
+        print(f"\n[🚀] Benchmark {videos}x{shots} ({archive})")
+        subprocess.run(_worker_cmd(args, out_path), check=True,
+                       env={**os.environ, "DATA_ROOT": archive, "TELEMETRY": os.getenv("TELEMETRY", "0")})
+        with open(out_path, encoding="utf-8") as f:
+            runs.append(json.load(f))
+        os.remove(out_path)
+
+    print("\n=== Summary (p50 ms) ===")
+    print(f"{'scale':>10} {'frames':>9} {'cold_s':>8} " + " ".join(f"{t:>12}" for t in args.type_search)
+          + f" {'stage2':>9} {'stage3':>9}")
+    for r in runs:
+        sc = r["scale"]
+        print(f"{str(sc['videos']) + 'x' + str(sc['shots_per_video']):>10} {sc['frames']:>9} {r['cold_start']['total_s']:8.2f} "
+              + " ".join(f"{r['stage1'][t]['p50_ms']:12.2f}" for t in args.type_search)
+              + f" {r['stage2']['p50_ms']:9.2f} {r['stage3']['p50_ms']:9.2f}")
+
+    if args.output:
+        config = {k: v for k, v in vars(args).items() if k not in ("worker", "output", "root")}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"env": _env(), "config": config, "runs": runs}, f, indent=2)
+        print(f"[📄] Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
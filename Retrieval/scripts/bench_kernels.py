@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark các kernel nóng + baseline lưu trong repo + regression gate.
+
+    python -m Retrieval.scripts.bench_kernels                          # chạy, in bảng
+    python -m Retrieval.scripts.bench_kernels --save                   # ghi lại baseline (kernel_baseline.json)
+    python -m Retrieval.scripts.bench_kernels --compare --tolerance 0.25   # exit 1 nếu kernel chậm hơn > 25%
+    python -m Retrieval.scripts.bench_kernels --compare --min_delta_us 50  # bỏ qua chênh lệch < 50µs / lần gọi
+    python -m Retrieval.scripts.bench_kernels --filter dp_align --repeat 10
+
+Kernels (mỗi kernel ở vài kích thước, dữ liệu sinh ngẫu nhiên với seed cố định):
+    dp_align       Stage 2 – DP recurrence (stage2_dp._dp_align) trên sims [M sub-queries, F frames]
+    ocr_scoring    Stage 1 OCR – cosine TF-IDF sparse + top-k (stage1_search type_search="ocr")
+    materialize    Stage 1 – (D, I) → result dicts (stage1_materialize, frame / shot)
+    h5_decode      core.h5 string column → list[str] (cache_loader._decode)
+    frame_merge    UI – gộp kết quả frame của các sub-query (stage1.merge_frame_results)
+
+Mỗi phép đo: tự chọn số vòng lặp để 1 round >= --min_time, lấy median / min thời gian 1 lần gọi
+qua --repeat rounds (kèm IQR giữa các round). Gate so sánh min (nhiễu máy chỉ làm chậm đi); kernel chỉ
+bị tính là regression khi vừa vượt tolerance vừa chậm hơn tuyệt đối > max(--min_delta_us, 3 × IQR) –
+kernel cỡ µs dao động ±40% giữa các lần chạy, nên các size nhỏ chỉ mang tính tham khảo và mỗi kernel
+có ít nhất 1 size đủ lớn để gate. Kernel vượt ngưỡng được đo lại 1 lần và chỉ fail khi vẫn vượt (lọc
+spike của VM / CPU frequency). Baseline phụ thuộc máy: ghi lại (--save) trên đúng máy chạy gate,
+compare cảnh báo khi env khác.
+"""
+
+import argparse
+import functools
+import gc
+import json
+import os
+import platform
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kernel_baseline.json")
+
+
+# ---------- 1. Kernels: setup(size) → hàm không tham số ---------- #
+def _dp_align(M: int, F: int) -> Callable:
+    from Retrieval.stage2_dp import _dp_align
+    sims = np.random.default_rng(0).random((M, F), dtype=np.float32)
+    return lambda: _dp_align(sims)
+
+
+@functools.lru_cache(maxsize=None)
+def _fake_core(n_frames: int, frames_per_shot: int = 8):
+    """Snapshot chứa core_cache / shot_cache giả với n_frames frames (8 frames / shot)."""
+    from Retrieval.cache_loader import core_cache, shot_cache
+    from Retrieval.snapshot import activate, new_snapshot
+
+    n_shots = n_frames // frames_per_shot
+    shots = [f"/data/Short_Video/L01/V{i // 100:03d}/Shot_{i:04d}.mp4" for i in range(n_shots)]
+    frames = [f"/data/Mid_Frames/L01/V{i // 800:03d}/{i:06d}.jpg" for i in range(n_frames)]
+    snap = new_snapshot("bench_kernels")
+    with activate(snap):
+        core_cache["frame_paths"] = frames
+        core_cache["frame_blip"] = [f"blip caption {i}" for i in range(n_frames)]
+        core_cache["frame_llm"] = [f"llm caption {i} " * 8 for i in range(n_frames)]
+        core_cache["frame_meta"] = {
+            "frame_number": np.arange(n_frames), "shot": [f"Shot_{i // frames_per_shot:04d}" for i in range(n_frames)],
+            "shot_idx": np.arange(n_frames) // frames_per_shot,
+            "source": [shots[i // frames_per_shot] for i in range(n_frames)],
+            "timestamp": np.arange(n_frames) / 25.0, "fps": np.full(n_frames, 25.0),
+            "tags": ["flood, interview"] * n_frames,
+        }
+        core_cache["shot_paths"] = shots
+        core_cache["shot_blip"] = [f"blip caption {i}" for i in range(n_shots)]
+        core_cache["shot_llm"] = [f"llm caption {i} " * 8 for i in range(n_shots)]
+        core_cache["shot_meta"] = {
+            "shot_id": np.arange(n_shots), "fps": np.full(n_shots, 25.0),
+            "start_time": np.arange(n_shots) * 3.2, "end_time": np.arange(n_shots) * 3.2 + 3.2,
+            "source": [f"/data/Videos/L01/V{i // 100:03d}.mp4" for i in range(n_shots)],
+            "tags": ["flood"] * n_shots,
+        }
+        for i, s in enumerate(shots):
+            shot_cache[s] = {"frame_paths": frames[i * frames_per_shot:(i + 1) * frames_per_shot]}
+    return snap
+
+
+def _ocr_scoring(n_docs: int, vocab: int = 20000, top_k: int = 200) -> Callable:
+    from Retrieval.cache_loader import ocr_cache
+    from Retrieval.snapshot import activate, new_snapshot
+    from Retrieval.stage1 import stage1_search
+
+    rng = np.random.default_rng(0)
+    snap = new_snapshot("bench_kernels")
+    with activate(snap):
+        nnz = 8   # ~ số token OCR khác nhau / frame
+        ocr_cache["matrix"] = sp.csr_matrix(
+            (rng.random(n_docs * nnz), rng.integers(0, vocab, n_docs * nnz), np.arange(0, n_docs * nnz + 1, nnz)),
+            shape=(n_docs, vocab),
+        )
+    q = np.zeros((1, vocab), dtype=np.float32)
+    q[0, rng.choice(vocab, 5, replace=False)] = 1.0
+
+    def run():
+        with activate(snap):
+            return stage1_search(q, "frame", top_k, "ocr")
+    return run
+
+
+def _materialize(level: str, k: int, n_frames: int = 100_000) -> Callable:
+    from Retrieval.snapshot import activate
+    from Retrieval.stage1 import stage1_materialize
+
+    snap = _fake_core(n_frames)
+    n = n_frames if level == "frame" else n_frames // 8
+    rng = np.random.default_rng(0)
+    I = rng.choice(n, k, replace=False).astype(np.int64)
+    D = np.sort(rng.random(k, dtype=np.float32))[::-1]
+
+    def run():
+        with activate(snap):
+            return stage1_materialize(D, I, level, refine_stage2=False)
+    return run
+
+
+def _h5_decode(n: int) -> Callable:
+    from Retrieval.cache_loader import _decode
+    col = np.array([f"/data/Mid_Frames/L01/V{i // 800:03d}/{i:06d}.jpg".encode() for i in range(n)])
+    return lambda: _decode(col)
+
+
+def _frame_merge(n: int, subqueries: int = 3) -> Callable:
+    from Retrieval.stage1 import merge_frame_results
+    rng = np.random.default_rng(0)
+    pool = max(n // 2, 1)   # ~ 1/2 số frame trùng giữa các sub-query
+    results = [{"frame_path": f"/f/{int(r)}.jpg", "score": float(s)}
+               for _ in range(subqueries)
+               for r, s in zip(rng.integers(0, pool, n // subqueries), rng.random(n // subqueries))]
+    return lambda: merge_frame_results(results)
+
+
+KERNELS: List[Tuple[str, Callable[[], Callable]]] = [
+    *[(f"dp_align[M={m},F={f}]", lambda m=m, f=f: _dp_align(m, f)) for m, f in ((2, 8), (4, 8), (8, 32), (16, 256))],
+    *[(f"ocr_scoring[N={n}]", lambda n=n: _ocr_scoring(n)) for n in (10_000, 100_000)],
+    *[(f"materialize[{lvl},k={k}]", lambda lvl=lvl, k=k: _materialize(lvl, k))
+      for lvl in ("frame", "shot") for k in (100, 1000)],
+    *[(f"h5_decode[n={n}]", lambda n=n: _h5_decode(n)) for n in (10_000, 100_000)],
+    *[(f"frame_merge[n={n}]", lambda n=n: _frame_merge(n)) for n in (300, 3000)],
+]
+
+
+# ---------- 2. Đo ---------- #
+def measure(fn: Callable, repeat: int, min_time: float) -> Dict:
+    fn()   # warm-up (lazy import, cache CPU)
+    gc_on = gc.isenabled()
+    gc.disable()   # như timeit: GC pause không thuộc về kernel
+    try:
+        return _rounds(fn, repeat, min_time)
+    finally:
+        if gc_on:
+            gc.enable()
+
+
+def _rounds(fn: Callable, repeat: int, min_time: float) -> Dict:
+    loops, elapsed = 1, 0.0
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed == 0 else max(2, int(min_time / elapsed * 1.2))
+    rounds = [elapsed / loops]
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        rounds.append((time.perf_counter() - t0) / loops)
+    q1, q3 = np.percentile(rounds, [25, 75])
+    return {"median_s": float(np.median(rounds)), "min_s": float(min(rounds)), "iqr_s": float(q3 - q1),
+            "loops": loops, "rounds": repeat}
+
+
+def _env() -> Dict:
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "machine": platform.machine(), "cpus": os.cpu_count(), "numpy": np.__version__}
+
+
+def _fmt(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit:<2}"
+    return f"{seconds / 1e-9:8.1f} ns"
+
+
+# ---------- 3. Compare gate ---------- #
+def compare(results: Dict, baseline: Dict, tolerance: float, min_delta: float) -> List[str]:
+    """
+    → danh sách kernel chậm hơn baseline quá tolerance (theo min_s) và quá ngưỡng nhiễu tuyệt đối
+    max(min_delta, 3 × IQR của baseline / lần đo hiện tại).
+    """
+    print(f"\n{'kernel':<28} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    failed = []
+    for name, cur in results.items():
+        base = baseline["kernels"].get(name)
+        if base is None:
+            print(f"{name:<28} {'—':>12} {_fmt(cur['min_s'])} {'new':>7}")
+            continue
+        ratio = cur["min_s"] / base["min_s"]
+        noise = max(min_delta, 3 * max(base.get("iqr_s", 0.0), cur.get("iqr_s", 0.0)))
+        slower = ratio > 1 + tolerance
+        flag = slower and cur["min_s"] - base["min_s"] > noise
+        failed += [name] if flag else []
+        note = "  ❌ REGRESSION" if flag else f"  (< {_fmt(noise).strip()} noise floor)" if slower else ""
+        print(f"{name:<28} {_fmt(base['min_s'])} {_fmt(cur['min_s'])} {ratio:6.2f}x{note}")
+    return failed
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--filter", default=None, help="chỉ chạy kernel có tên chứa chuỗi này")
+    p.add_argument("--repeat", default=7, type=int)
+    p.add_argument("--min_time", default=0.05, type=float, help="thời gian tối thiểu / round (giây)")
+    p.add_argument("--baseline", default=BASELINE)
+    p.add_argument("--save", action="store_true", help="ghi kết quả làm baseline mới")
+    p.add_argument("--compare", action="store_true", help="so sánh với baseline, exit 1 nếu regression")
+    p.add_argument("--tolerance", default=0.25, type=float, help="chậm hơn baseline tối đa (0.25 = +25%%)")
+    p.add_argument("--min_delta_us", default=50.0, type=float,
+                   help="chênh lệch tuyệt đối tối thiểu / lần gọi (µs) mới tính là regression")
+    p.add_argument("--output", default=None, help="ghi kết quả JSON")
+    args = p.parse_args()
+
+    from Retrieval.telemetry import enable
+    enable(False)   # đo kernel, không đo span / histogram
+
+    results, setups = {}, dict(KERNELS)
+    for name, setup in KERNELS:
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(setup(), args.repeat, args.min_time)
+        print(f"[⏱️] {name:<28}: {_fmt(results[name]['median_s'])} median "
+              f"({_fmt(results[name]['min_s'])} min, {results[name]['loops']} loops)")
+
+    report = {"env": _env(), "kernels": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save:
+        if os.path.exists(args.baseline) and args.filter:   # giữ các kernel không chạy lần này
+            with open(args.baseline, encoding="utf-8") as f:
+                report["kernels"] = {**json.load(f)["kernels"], **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"[📄] Baseline written to {args.baseline}")
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("env", {}) != _env():
+            print(f"[WARN] Baseline env differs: {baseline.get('env')} vs {_env()}")
+        min_delta = args.min_delta_us * 1e-6
+        failed = compare(results, baseline, args.tolerance, min_delta)
+        if failed:   # đo lại → chỉ giữ regression lặp lại được
+            print(f"\n[🔁] Re-measuring {len(failed)} kernel(s)")
+            for name in failed:
+                again = measure(setups[name](), args.repeat, args.min_time)
+                results[name]["min_s"] = min(results[name]["min_s"], again["min_s"])
+            failed = compare({n: results[n] for n in failed}, baseline, args.tolerance, min_delta)
+        if failed:
+            print(f"\n[❌] {len(failed)} kernel(s) regressed > {args.tolerance:.0%}: {', '.join(failed)}")
+            sys.exit(1)
+        print(f"\n[✅] No kernel regressed > {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
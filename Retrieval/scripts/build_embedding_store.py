@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+One-off: gộp mọi EMB_ROOT/Lxx/Vyyy.npz thành 1 embedding store mmap-able.
+
+    python -m Retrieval.scripts.build_embedding_store --dtype float16
+
+Output (EMB_STORE_DIR):
+    vectors.npy   [N, D]  float32 | float16 | int8
+    scales.npy    [N]     float32 (chỉ với int8)
+    paths.npy     [N]     bytes utf-8 (fixed width, không cần pickle)
+    videos.json   {"dtype": ..., "videos": {"Lxx/Vyyy": [start, end]}}
+"""
+
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+from Retrieval.cache_loader import quantize_vectors
+from Retrieval.config import EMB_ROOT, EMB_STORE_DIR
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--dtype", default="float16", choices=["float32", "float16", "int8"])
+    p.add_argument("--out", default=EMB_STORE_DIR)
+    args = p.parse_args()
+
+    npz_files = sorted(glob.glob(os.path.join(EMB_ROOT, "L*", "V*.npz")))
+    if not npz_files:
+        raise SystemExit(f"[❌] No embedding files found under {EMB_ROOT}/L*/V*.npz – nothing to build")
+    os.makedirs(args.out, exist_ok=True)
+
+    # === Pass 1: paths + kích thước (pickle chỉ cần ở bước convert này)
+    videos, all_paths, dim = {}, [], None
+    for npz_path in tqdm(npz_files, desc="Scan NPZ"):
+        key = f"{os.path.basename(os.path.dirname(npz_path))}/{os.path.splitext(os.path.basename(npz_path))[0]}"
+        with np.load(npz_path, allow_pickle=True) as data:
+            paths = [str(x) for x in data["paths"]]
+            if dim is None:
+                dim = data["embeddings"].shape[1]
+        videos[key] = [len(all_paths), len(all_paths) + len(paths)]
+        all_paths.extend(paths)
+
+    encoded = [x.encode("utf-8") for x in all_paths]
+    width = max((len(x) for x in encoded), default=1)
+    np.save(os.path.join(args.out, "paths.npy"), np.array(encoded, dtype=f"S{width}"))
+
+    # === Pass 2: vectors ghi thẳng vào .npy (open_memmap) → không giữ cả archive trong RAM
+    n = len(all_paths)
+    vectors = np.lib.format.open_memmap(
+        os.path.join(args.out, "vectors.npy"), mode="w+", dtype=np.dtype(args.dtype), shape=(n, dim)
+    )
+    scales = None
+    if args.dtype == "int8":
+        scales = np.lib.format.open_memmap(
+            os.path.join(args.out, "scales.npy"), mode="w+", dtype=np.float32, shape=(n,)
+        )
+    for npz_path in tqdm(npz_files, desc="Write vectors"):
+        key = f"{os.path.basename(os.path.dirname(npz_path))}/{os.path.splitext(os.path.basename(npz_path))[0]}"
+        start, end = videos[key]
+        with np.load(npz_path, allow_pickle=True) as data:
+            q, s = quantize_vectors(data["embeddings"], args.dtype)
+        vectors[start:end] = q
+        if scales is not None:
+            scales[start:end] = s
+    vectors.flush()
+    if scales is not None:
+        scales.flush()
+
+    with open(os.path.join(args.out, "videos.json"), "w", encoding="utf-8") as f:
+        json.dump({"dtype": args.dtype, "dim": int(dim), "videos": videos}, f)
+    print(f"[✅] Embedding store: {n} frames × {dim} ({args.dtype}) → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Build / thêm FAISS shards theo batch Lxx (xem Retrieval/shards.py).
+
+    # tách index nguyên khối hiện có thành shard theo batch
+    python -m Retrieval.scripts.build_shards --index clip_frame
+
+    # thêm batch mới từ clip.h5 mà không đụng tới các shard cũ
+    python -m Retrieval.scripts.build_shards --index clip_frame --batches L25 L26 --source h5
+"""
+
+import argparse
+import os
+import time
+
+import faiss
+import h5py
+import numpy as np
+
+from Retrieval.cache_loader import preload_core_h5, core_cache
+from Retrieval.config import FAISS_DIR, H5_DIR, SHARD_DIR
+from Retrieval.search_utils import flat_vectors
+from Retrieval.shards import upsert_manifest_entry
+
+# index_name prefix → file vectors trong H5_DIR
+_H5_FILES = {"clip": "clip.h5", "blip": "blip.h5", "llm": "llm.h5"}
+
+
+def _batch_rows(level: str) -> dict:
+    """Lxx → rows (sorted) của level 'frame' / 'shot' trong core.h5."""
+    batches = {}
+    for video, rows in core_cache[f"{level}_video_rows"].items():
+        batches.setdefault(video.split("/")[0], []).append(rows)
+    return {b: np.sort(np.concatenate(r)) for b, r in batches.items()}
+
+
+def _vector_source(index_name: str, source: str):
+    """Trả về (vectors[rows] getter, metric)."""
+    if source == "index":
+        index = faiss.read_index(os.path.join(FAISS_DIR, f"{index_name}.index"))
+        xb = flat_vectors(index)
+        if xb is None:
+            return (lambda rows: index.reconstruct_batch(rows)), index.metric_type
+        return (lambda rows: xb[rows]), index.metric_type
+
+    modality, level = index_name.split("_")
+    ds = h5py.File(os.path.join(H5_DIR, _H5_FILES[modality]), "r")[f"{level}/vectors"]
+    return (lambda rows: ds[np.sort(rows)].astype(np.float32)), faiss.METRIC_INNER_PRODUCT
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--index", required=True, help="vd clip_frame, clip_shot, blip_frame, ...")
+    p.add_argument("--batches", nargs="*", default=None, help="chỉ build các batch này (mặc định: tất cả)")
+    p.add_argument("--source", default="index", choices=["index", "h5"],
+                   help="lấy vectors từ index nguyên khối hay từ <modality>.h5")
+    args = p.parse_args()
+
+    level = args.index.split("_")[-1]
+    preload_core_h5()
+    batches = _batch_rows(level)
+    if args.batches:
+        batches = {b: r for b, r in batches.items() if b in args.batches}
+
+    get_vectors, metric = _vector_source(args.index, args.source)
+    out_dir = os.path.join(SHARD_DIR, args.index)
+    os.makedirs(out_dir, exist_ok=True)
+
+    for batch, rows in sorted(batches.items()):
+        t0 = time.time()
+        vecs = np.ascontiguousarray(get_vectors(rows), dtype=np.float32)
+        shard = faiss.IndexIDMap2(faiss.IndexFlat(vecs.shape[1], metric))
+        shard.add_with_ids(vecs, rows.astype(np.int64))
+
+        rel = f"{args.index}/{batch}.index"
+        tmp = os.path.join(SHARD_DIR, rel + ".tmp")
+        faiss.write_index(shard, tmp)
+        os.replace(tmp, os.path.join(SHARD_DIR, rel))
+        upsert_manifest_entry({
+            "index": args.index, "shard": batch, "file": rel,
+            "ntotal": int(shard.ntotal), "d": int(vecs.shape[1]),
+        })
+        print(f"[✅] {rel}: {shard.ntotal} vec ({time.time() - t0:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
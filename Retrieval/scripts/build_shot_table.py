@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+One-off: Short_Video_JSON_Size8/Lxx/Vyyy.json → bảng shot nhị phân (SHOT_TABLE_DIR).
+
+    python -m Retrieval.scripts.build_shot_table
+
+Hàng i của bảng ứng với shot row i trong core.h5 (core_cache["shot_paths"]).
+Cột (.npy, không pickle):
+    paths, source                         bytes utf-8
+    shot_id                               int32
+    start_time, end_time                  float64
+    fps                                   float32
+    frames                                int64 [S, 2]   (start_frame, end_frame)
+    frame_paths                           bytes utf-8 [F] – 8 frame/shot, nối liền
+    frame_offsets                         int64 [S + 1]  – frame_paths[o[i]:o[i+1]]
+Trường "embedding" (768 float / shot) bị bỏ.
+"""
+
+import argparse
+import glob
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from tqdm import tqdm
+
+from Retrieval.cache_loader import preload_core_h5, core_cache
+from Retrieval.config import JSON_ROOT, SHOT_TABLE_DIR, CORE_H5, MAX_WORKERS
+
+
+def _read(path: str) -> dict:
+    with open(path) as f:
+        data = json.load(f)
+    return {
+        shot["path"]: (shot["shot"], shot["time"][0], shot["time"][1], shot["fps"],
+                       shot["frames"], shot["source"], shot["source_frame"])
+        for shot in data
+    }
+
+
+def _bytes_array(values) -> np.ndarray:
+    encoded = [v.encode("utf-8") for v in values]
+    return np.array(encoded, dtype=f"S{max((len(v) for v in encoded), default=1)}")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--out", default=SHOT_TABLE_DIR)
+    args = p.parse_args()
+
+    preload_core_h5()
+    shot_paths = core_cache["shot_paths"]
+
+    json_files = glob.glob(os.path.join(JSON_ROOT, "L*", "V*.json"))
+    shots = {}
+    with ThreadPoolExecutor(MAX_WORKERS) as ex:
+        for part in tqdm(ex.map(_read, json_files), total=len(json_files), desc="Parse JSON"):
+            shots.update(part)
+
+    S = len(shot_paths)
+    shot_id    = np.full(S, -1, dtype=np.int32)
+    start_time = np.full(S, np.nan)
+    end_time   = np.full(S, np.nan)
+    fps        = np.full(S, np.nan, dtype=np.float32)
+    frames     = np.full((S, 2), -1, dtype=np.int64)
+    sources, frame_paths, offsets = [], [], [0]
+    missing = 0
+    for i, path in enumerate(shot_paths):
+        entry = shots.get(path)
+        if entry is None:
+            missing += 1
+            sources.append("")
+        else:
+            shot_id[i], start_time[i], end_time[i], fps[i], frames[i], src, frame_list = entry
+            sources.append(src)
+            frame_paths.extend(frame_list)
+        offsets.append(len(frame_paths))
+
+    os.makedirs(args.out, exist_ok=True)
+    columns = {
+        "paths": _bytes_array(shot_paths), "source": _bytes_array(sources),
+        "shot_id": shot_id, "start_time": start_time, "end_time": end_time, "fps": fps,
+        "frames": frames, "frame_paths": _bytes_array(frame_paths),
+        "frame_offsets": np.asarray(offsets, dtype=np.int64),
+    }
+    for name, arr in columns.items():
+        np.save(os.path.join(args.out, f"{name}.npy"), arr)
+
+    # meta.json ghi cuối → loader chỉ dùng bảng khi đã build xong
+    with open(os.path.join(args.out, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"rows": S, "core_h5": CORE_H5, "core_h5_mtime": os.path.getmtime(CORE_H5)}, f)
+
+    extra = len(set(shots) - set(shot_paths))
+    print(f"[✅] Shot table: {S} rows → {args.out} | {missing} shots thiếu JSON | {extra} JSON shots không có trong core.h5")
+
+
+if __name__ == "__main__":
+    main()
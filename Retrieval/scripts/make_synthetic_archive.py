@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Sinh 1 archive tổng hợp có cấu trúc giống hệt dữ liệu thật (để benchmark tái lập được).
+
+    python -m Retrieval.scripts.make_synthetic_archive --out /tmp/synth --videos 50 --shots 50
+
+Layout (tương đối với --out, dùng làm DATA_ROOT – xem config DATA_ROOT):
+    data_layout_h5/core.h5                     frame/*, shot/* (paths, captions, metadata)
+    data_layout_h5/clip.h5                     frame/vectors, shot/vectors (float16, contiguous → mmap)
+    data_layout_h5/{clip,llm,blip}_{frame,shot}.index   IndexFlatIP
+    Data/Short_Video_JSON_Size8/Lxx/Vyyy.json  shots (8 frames / shot, kèm "embedding")
+    Data/CLIP_L14_embedding/embeddings_with_paths/Lxx/Vyyy.npz
+    Data/ocr_index_hybrid_v2/{tfidf_matrix.npz, rel_paths.json, vectorizer.pkl}
+    queries.jsonl                              {"query", "shot_path", "frame_path"} – query lấy từ caption
+
+Vector = text_vector(caption) + nhiễu, với text_vector là tổng các word vector giả (seed theo từ)
+→ embedder giả trong scripts/bench_e2e.py encode query thành vector cùng không gian, nên kết quả
+search có nghĩa (query tìm lại được shot sinh ra nó) thay vì hoàn toàn ngẫu nhiên.
+"""
+
+import argparse
+import functools
+import json
+import os
+import time
+import zlib
+
+import faiss
+import h5py
+import joblib
+import numpy as np
+from scipy.sparse import save_npz
+from sklearn.feature_extraction.text import TfidfVectorizer
+from tqdm import tqdm
+
+FRAMES_PER_SHOT = 8
+FPS = 25.0
+TAGS = ["flood", "interview", "traffic", "sport", "weather", "economy", "fire", "festival"]
+_ONSETS = ["b", "c", "ch", "d", "g", "h", "k", "l", "m", "n", "ng", "nh", "ph", "s", "t", "th", "tr", "v", "x"]
+_RIMES = ["a", "an", "ang", "anh", "ao", "at", "e", "em", "en", "i", "inh", "o", "oa", "oi", "ong", "u", "ung", "uy"]
+
+
+# ---------- 1. Text → vector ---------- #
+@functools.lru_cache(maxsize=None)
+def _word_vec(word: str, dim: int) -> np.ndarray:
+    rng = np.random.default_rng(zlib.crc32(f"{dim}:{word}".encode()))
+    return rng.standard_normal(dim).astype(np.float32)
+
+
+def text_vector(text: str, dim: int) -> np.ndarray:
+    """Vector giả (đã normalize) của 1 câu: tổng word vectors → câu chung từ thì gần nhau."""
+    words = text.lower().split()
+    vec = np.sum([_word_vec(w, dim) for w in words], axis=0) if words else _word_vec("", dim)
+    return vec / max(float(np.linalg.norm(vec)), 1e-12)
+
+
+def _vocab(rng, size: int):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(_ONSETS) + rng.choice(_RIMES) for _ in range(rng.integers(1, 3))))
+    return sorted(words)
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def _s(strings):
+    return np.array([s.encode("utf-8") for s in strings])
+
+
+def _write_index(path: str, vecs: np.ndarray) -> None:
+    index = faiss.IndexFlatIP(vecs.shape[1])
+    index.add(np.ascontiguousarray(vecs, dtype=np.float32))
+    faiss.write_index(index, path)
+
+
+# ---------- 2. Generator ---------- #
+def make_archive(out: str, videos: int, shots: int, dim: int = 768, text_dim: int = 1536,
+                 videos_per_batch: int = 25, vocab: int = 3000, queries: int = 100, seed: int = 0) -> dict:
+    """Ghi archive videos × shots × 8 frames vào `out` → manifest (kích thước, thời gian sinh)."""
+    from Retrieval.search_utils import hybrid_tokenizer   # import muộn: bench_e2e đo cả import Retrieval.*
+
+    t0 = time.time()
+    rng = np.random.default_rng(seed)
+    words = _vocab(rng, vocab)
+    h5_dir = os.path.join(out, "data_layout_h5")
+    json_root = os.path.join(out, "Data", "Short_Video_JSON_Size8")
+    emb_root = os.path.join(out, "Data", "CLIP_L14_embedding", "embeddings_with_paths")
+    ocr_root = os.path.join(out, "Data", "ocr_index_hybrid_v2")
+    for d in (h5_dir, json_root, emb_root, ocr_root):
+        os.makedirs(d, exist_ok=True)
+
+    n_shots, n_frames = videos * shots, videos * shots * FRAMES_PER_SHOT
+    print(f"[🚀] Synthetic archive: {videos} videos × {shots} shots × {FRAMES_PER_SHOT} frames "
+          f"= {n_frames} frames → {out}")
+
+    shot_paths, shot_caps, shot_llm, shot_tags, shot_src = [], [], [], [], []
+    frame_paths, frame_blip, frame_llm, frame_tags, frame_src, ocr_texts = [], [], [], [], [], []
+    frame_number, shot_idx = [], []
+    clip_frame = np.empty((n_frames, dim), dtype=np.float32)
+
+    for v in tqdm(range(videos), desc="Videos"):
+        Lxx, Vyyy = f"L{v // videos_per_batch + 1:02d}", f"V{v % videos_per_batch + 1:03d}"
+        video_path = f"{out}/Data/Videos/{Lxx}/{Vyyy}.mp4"
+        video_shots, video_frames = [], []
+        for s in range(shots):
+            topic = list(rng.choice(words, 6, replace=False))
+            tag = ", ".join(rng.choice(TAGS, 2, replace=False))
+            shot_path = f"{out}/Data/Short_Video/{Lxx}/{Vyyy}/Shot_{s:04d}.mp4"
+            start = s * FRAMES_PER_SHOT * 10
+            row0 = len(frame_paths)
+            for j in range(FRAMES_PER_SHOT):
+                num = start + j * 10
+                detail = list(rng.choice(words, 3))
+                frame_paths.append(f"{out}/Data/Mid_Frames/{Lxx}/{Vyyy}/{num:06d}.jpg")
+                frame_blip.append(" ".join(topic[:4] + detail[:1]))
+                frame_llm.append(" ".join(topic + detail))
+                ocr_texts.append(" ".join(topic[:2] + detail))
+                frame_tags.append(tag)
+                frame_src.append(shot_path)
+                frame_number.append(num)
+                shot_idx.append(s)
+                clip_frame[row0 + j] = text_vector(" ".join(topic + detail), dim)
+            clip_frame[row0:row0 + FRAMES_PER_SHOT] += 0.05 * rng.standard_normal((FRAMES_PER_SHOT, dim))
+            shot_paths.append(shot_path)
+            shot_caps.append(" ".join(topic[:4]))
+            shot_llm.append(" ".join(topic))
+            shot_tags.append(tag)
+            shot_src.append(video_path)
+            video_shots.append({
+                "path": shot_path, "shot": s, "source_frame": frame_paths[row0:],
+                "time": [start / FPS, (start + FRAMES_PER_SHOT * 10) / FPS], "fps": FPS,
+                "frames": [start, start + FRAMES_PER_SHOT * 10 - 1], "source": video_path,
+            })
+            video_frames.append(row0)
+
+        clip_frame[video_frames[0]:] = _normalize(clip_frame[video_frames[0]:])
+        for shot, row0 in zip(video_shots, video_frames):
+            shot["embedding"] = clip_frame[row0:row0 + FRAMES_PER_SHOT].mean(0).round(6).tolist()
+        os.makedirs(os.path.join(json_root, Lxx), exist_ok=True)
+        with open(os.path.join(json_root, Lxx, f"{Vyyy}.json"), "w") as f:
+            json.dump(video_shots, f)
+        os.makedirs(os.path.join(emb_root, Lxx), exist_ok=True)
+        np.savez(os.path.join(emb_root, Lxx, f"{Vyyy}.npz"),
+                 embeddings=clip_frame[video_frames[0]:], paths=np.array(frame_paths[video_frames[0]:]))
+
+    clip_shot = _normalize(clip_frame.reshape(n_shots, FRAMES_PER_SHOT, dim).mean(1))
+
+    # === core.h5 (chuỗi = bytes "S" như file thật → _decode)
+    print("[📄] core.h5 / clip.h5")
+    timestamp = np.asarray(frame_number, dtype=np.float64) / FPS
+    with h5py.File(os.path.join(h5_dir, "core.h5"), "w") as f:
+        f["frame/paths"], f["frame/blip_caption"], f["frame/llm_caption"] = \
+            _s(frame_paths), _s(frame_blip), _s(frame_llm)
+        fm = f.create_group("frame/metadata")
+        fm["frame_number"] = np.asarray(frame_number, dtype=np.int64)
+        fm["shot"] = _s(f"Shot_{i:04d}" for i in shot_idx)
+        fm["shot_idx"] = np.asarray(shot_idx, dtype=np.int64)
+        fm["source"] = _s(frame_src)
+        fm["timestamp"] = timestamp
+        fm["fps"] = np.full(n_frames, FPS, dtype=np.float32)
+        fm["tags"] = _s(frame_tags)
+        f["shot/paths"], f["shot/blip_caption"], f["shot/llm_caption"] = \
+            _s(shot_paths), _s(shot_caps), _s(shot_llm)
+        sm = f.create_group("shot/metadata")
+        starts = timestamp[::FRAMES_PER_SHOT]
+        sm["shot_id"] = np.tile(np.arange(shots, dtype=np.int64), videos)
+        sm["fps"] = np.full(n_shots, FPS, dtype=np.float32)
+        sm["start_time"] = starts
+        sm["end_time"] = starts + FRAMES_PER_SHOT * 10 / FPS
+        sm["source"] = _s(shot_src)
+        sm["tags"] = _s(shot_tags)
+
+    with h5py.File(os.path.join(h5_dir, "clip.h5"), "w") as f:   # contiguous → exact_search mmap
+        f.create_dataset("frame/vectors", data=clip_frame.astype(np.float16))
+        f.create_dataset("shot/vectors", data=clip_shot.astype(np.float16))
+
+    # === FAISS (clip = CLIP space, llm/blip = caption text-embedding space)
+    print("[📄] FAISS indexes")
+    _write_index(os.path.join(h5_dir, "clip_frame.index"), clip_frame)
+    _write_index(os.path.join(h5_dir, "clip_shot.index"), clip_shot)
+    for name, frame_caps, shot_texts in (("llm", frame_llm, shot_llm), ("blip", frame_blip, shot_caps)):
+        _write_index(os.path.join(h5_dir, f"{name}_frame.index"),
+                     np.stack([text_vector(t, text_dim) for t in frame_caps]))
+        _write_index(os.path.join(h5_dir, f"{name}_shot.index"),
+                     np.stack([text_vector(t, text_dim) for t in shot_texts]))
+
+    # === OCR TF-IDF (cùng vectorizer / tokenizer với scripts/build_ocr_index.py; row = frame row)
+    print("[📄] OCR TF-IDF")
+    vectorizer = TfidfVectorizer(tokenizer=hybrid_tokenizer)
+    save_npz(os.path.join(ocr_root, "tfidf_matrix.npz"), vectorizer.fit_transform(ocr_texts).tocsr())
+    joblib.dump(vectorizer, os.path.join(ocr_root, "vectorizer.pkl"))
+    with open(os.path.join(ocr_root, "rel_paths.json"), "w", encoding="utf-8") as f:
+        json.dump(frame_paths, f)
+
+    # === Queries có ground truth (frame → shot sinh ra nó)
+    n_queries = min(queries, n_frames)
+    with open(os.path.join(out, "queries.jsonl"), "w", encoding="utf-8") as f:
+        for row in rng.choice(n_frames, n_queries, replace=False):
+            caption = frame_llm[row].split()
+            f.write(json.dumps({"query": " ".join(caption[:3]) + ". " + " ".join(caption[3:6]),
+                                "shot_path": frame_src[row], "frame_path": frame_paths[row]}) + "\n")
+
+    manifest = {
+        "videos": videos, "shots_per_video": shots, "frames_per_shot": FRAMES_PER_SHOT,
+        "shots": n_shots, "frames": n_frames, "dim": dim, "text_dim": text_dim, "seed": seed,
+        "queries": n_queries,
+        "bytes": sum(os.path.getsize(os.path.join(r, fn)) for r, _, fns in os.walk(out) for fn in fns),
+        "build_s": time.time() - t0,
+    }
+    with open(os.path.join(out, "synthetic.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"[✅] Archive ready: {n_frames} frames, {manifest['bytes'] / 2**20:.1f} MiB in {manifest['build_s']:.1f}s")
+    return manifest
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--out", required=True, help="thư mục archive (dùng làm DATA_ROOT)")
+    p.add_argument("--videos", default=20, type=int)
+    p.add_argument("--shots", default=50, type=int, help="số shot / video (8 frames / shot)")
+    p.add_argument("--dim", default=768, type=int, help="CLIP dim")
+    p.add_argument("--text_dim", default=1536, type=int, help="caption embedding dim (llm / blip index)")
+    p.add_argument("--videos_per_batch", default=25, type=int, help="số video / thư mục Lxx")
+    p.add_argument("--vocab", default=3000, type=int)
+    p.add_argument("--queries", default=100, type=int)
+    p.add_argument("--seed", default=0, type=int)
+    args = p.parse_args()
+    make_archive(args.out, args.videos, args.shots, args.dim, args.text_dim,
+                 args.videos_per_batch, args.vocab, args.queries, args.seed)
+
+
+if __name__ == "__main__":
+    main()
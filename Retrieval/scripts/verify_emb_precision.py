@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+So sánh Stage 2 (DP) score với embedding cache float16 / int8 so với float32.
+
+    python -m Retrieval.scripts.verify_emb_precision --queries queries.txt --shots 2000
+
+Báo cáo: RAM của vectors, max / mean |score drift|, top-m overlap và số shot
+đổi thứ hạng trong top-m cho từng chế độ.
+"""
+
+import argparse
+import json
+import random
+
+import numpy as np
+
+from Retrieval.cache_loader import (
+    preload_shot_json, preload_embeddings_npz, quantize_vectors, shot_cache, embedding_cache
+)
+from Retrieval.embedder import CLIPEmbedder
+from Retrieval.stage2_dp import _score_shot
+
+
+def _quantized_cache(dtype: str) -> dict:
+    out = {}
+    for key, entry in embedding_cache.items():
+        vectors, scales = quantize_vectors(entry["vectors"], dtype)
+        out[key] = {"paths": entry["paths"], "vectors": vectors, "scales": scales}
+    return out
+
+
+def _nbytes(cache: dict) -> int:
+    return sum(e["vectors"].nbytes + (0 if e["scales"] is None else e["scales"].nbytes) for e in cache.values())
+
+
+def _scores(shots, sub_mat, cache) -> np.ndarray:
+    return np.array([_score_shot(s, sub_mat, cache)[1] for s in shots])
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--queries", required=True, help="file text, mỗi dòng 1 query (sub-queries cách nhau bởi '.')")
+    p.add_argument("--modes", nargs="+", default=["float16", "int8"], choices=["float16", "int8"])
+    p.add_argument("--shots", default=2000, type=int, help="số shot lấy mẫu / query")
+    p.add_argument("--top_m", default=20, type=int)
+    p.add_argument("--seed", default=0, type=int)
+    p.add_argument("--output", default=None)
+    args = p.parse_args()
+
+    with open(args.queries, encoding="utf-8") as f:
+        queries = [l.strip() for l in f if l.strip()]
+
+    preload_shot_json()
+    preload_embeddings_npz(dtype="float32")
+    embedder = CLIPEmbedder()
+
+    rng = random.Random(args.seed)
+    all_shots = [s for s in shot_cache
+                 if "/".join(s.split("/")[-3:-1]) in embedding_cache]
+    shots = rng.sample(all_shots, min(args.shots, len(all_shots)))
+
+    caches = {m: _quantized_cache(m) for m in args.modes}
+    report = {"float32": {"vector_bytes": _nbytes(embedding_cache)}}
+    for m, cache in caches.items():
+        report[m] = {"vector_bytes": _nbytes(cache), "max_drift": 0.0, "mean_drift": [],
+                     "top_m_overlap": [], "top_m_rank_changes": []}
+
+    for q in queries:
+        subs = [s.strip() for s in q.split(".") if s.strip()]
+        sub_mat = np.stack([embedder.encode_text(s).cpu().numpy() for s in subs]).astype(np.float32)
+        ref = _scores(shots, sub_mat, embedding_cache)
+        ref_top = np.argsort(-ref, kind="stable")[:args.top_m]
+
+        for m, cache in caches.items():
+            got = _scores(shots, sub_mat, cache)
+            drift = np.abs(got - ref)
+            got_top = np.argsort(-got, kind="stable")[:args.top_m]
+            r = report[m]
+            r["max_drift"] = max(r["max_drift"], float(drift.max()))
+            r["mean_drift"].append(float(drift.mean()))
+            r["top_m_overlap"].append(len(set(ref_top) & set(got_top)) / len(ref_top))
+            r["top_m_rank_changes"].append(int(np.sum(ref_top != got_top)))
+
+    for m in caches:
+        r = report[m]
+        r["mean_drift"] = float(np.mean(r["mean_drift"]))
+        r["top_m_overlap"] = float(np.mean(r["top_m_overlap"]))
+        r["top_m_rank_changes"] = float(np.mean(r["top_m_rank_changes"]))
+        r["memory_ratio"] = r["vector_bytes"] / report["float32"]["vector_bytes"]
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 import re, numpy as np, os
+from typing import List, Optional
+import faiss
 from underthesea import word_tokenize
 from sklearn.metrics.pairwise import cosine_similarity
 
-from Retrieval.config import OCR_VECTORIZER
+from Retrieval.config import OCR_VECTORIZER, ADAPTIVE_MIN_KEEP, ADAPTIVE_GAP_RATIO
 from Retrieval.cache_loader import (
     faiss_index_cache, ocr_cache, core_cache
 )
@@ -15,6 +17,14 @@ def hybrid_tokenizer(text: str):
 
 
 # ---------- 2. get_index_path ---------- #
+def split_backend(type_search: str):
+    """'clip_exact' → ('clip', 'exact'); 'clip' → ('clip', 'faiss')."""
+    if type_search.endswith("_exact"):
+        return type_search[:-len("_exact")], "exact"
+    return type_search, "faiss"
+
+
+
 def get_index_path(type_search: str, search_type: str, index_dir: str):
     supported = {
         "clip": {"frame": "clip_frame.index", "shot": "clip_shot.index"},
@@ -51,3 +61,208 @@ def encode_query_for_search(query: str, type_search: str, embedder=None):
         return vectorizer.transform([query]).toarray().astype(np.float32)
 
     raise ValueError(f"Unsupported type_search: {type_search}")
+
+
+def encode_queries_for_search(queries: List[str], type_search: str, embedder=None) -> np.ndarray:
+    """Batch version của encode_query_for_search → ma trận [len(queries), d] float32."""
+    if type_search == "clip":
+        if embedder is None:
+            raise ValueError("embedder (CLIP) bắt buộc cho 'clip'")
+        return embedder.encode_texts(queries).cpu().numpy().astype(np.float32)
+
+    if type_search in ("llm_caption", "blip_caption"):
+        from openai import OpenAI
+        from Retrieval.config import OPENAI_API_KEY
+        res = OpenAI(api_key=OPENAI_API_KEY).embeddings.create(
+            input=list(queries),
+            model="text-embedding-3-small",
+        )
+        return np.array([d.embedding for d in res.data], dtype=np.float32)
+
+    if type_search == "ocr":
+        vectorizer = ocr_cache["vectorizer"]
+        return vectorizer.transform(list(queries)).toarray().astype(np.float32)
+
+    raise ValueError(f"Unsupported type_search: {type_search}")
+
+
+# ---------- 4. Restricted search (subset of rows) ---------- #
+def frame_rows_for_shots(shot_rows) -> np.ndarray:
+    """Gom frame rows của các shot rows (theo thứ tự shot) từ bảng CSR trong core_cache."""
+    offsets = core_cache["shot_frame_offsets"]
+    rows    = core_cache["shot_frame_rows"]
+    shot_rows = np.asarray(shot_rows, dtype=np.int64)
+    shot_rows = shot_rows[shot_rows >= 0]
+
+    starts  = offsets[shot_rows]
+    lengths = offsets[shot_rows + 1] - starts
+    total   = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    # start của từng đoạn, lặp lại theo độ dài + vị trí trong đoạn
+    seg_begin = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return rows[np.repeat(starts, lengths) + np.arange(total) - seg_begin]
+
+
+def flat_vectors(index):
+    """Zero-copy view [ntotal, d] của IndexFlat; None với loại index khác."""
+    index = faiss.downcast_index(index)
+    if not isinstance(index, faiss.IndexFlat):
+        return None
+    return faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+
+
+def topk_from_scores(scores: np.ndarray, k: int):
+    """Top-k (giảm dần) trên từng hàng của ma trận scores [nq, n] → (D, positions)."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((scores.shape[0], 0), np.float32), np.empty((scores.shape[0], 0), np.int64)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    pos = np.take_along_axis(part, order, axis=1)
+    return np.take_along_axis(scores, pos, axis=1).astype(np.float32), pos.astype(np.int64)
+
+
+def _merge_topk(D1, I1, D2, I2, k: int):
+    D, pos = topk_from_scores(np.hstack([D1, D2]), k)
+    return D, np.take_along_axis(np.hstack([I1, I2]), pos, axis=1)
+
+
+def chunked_topk(xb, query_vecs: np.ndarray, k: int, rows=None,
+                 inner_product: bool = True, chunk_rows: int = 16384,
+                 min_score: Optional[float] = None):
+    """
+    Exact top-k trên xb (hoặc chỉ xb[rows]) theo từng chunk, giữ running top-k.
+    Đoạn rows liên tiếp được đọc dưới dạng view (không copy); xb có thể là
+    float16/mmap – mỗi chunk được upcast sang float32 trước matmul.
+    min_score: chỉ giữ score >= min_score (L2: distance <= min_score) – chỗ trống có I = -1.
+    """
+    query_vecs = np.atleast_2d(query_vecs).astype(np.float32)
+    nq = len(query_vecs)
+    best_D = np.empty((nq, 0), np.float32)
+    best_I = np.empty((nq, 0), np.int64)
+    q_sq = (query_vecs ** 2).sum(1)[:, None]
+
+    n = len(xb) if rows is None else len(rows)
+    for a in range(0, n, chunk_rows):
+        b = min(a + chunk_rows, n)
+        if rows is None:
+            ids, block = np.arange(a, b, dtype=np.int64), xb[a:b]
+        else:
+            ids = rows[a:b]
+            contiguous = len(ids) == 1 or bool(np.all(np.diff(ids) == 1))
+            block = xb[ids[0]:ids[-1] + 1] if contiguous else xb[ids]
+        block = np.asarray(block, dtype=np.float32)
+
+        scores = query_vecs @ block.T
+        if not inner_product:  # L2 → điểm = -khoảng cách
+            scores = 2 * scores - (block ** 2).sum(1)[None, :] - q_sq
+        if min_score is not None:
+            scores[scores < (min_score if inner_product else -min_score)] = -np.inf
+        D, pos = topk_from_scores(scores, k)
+        best_D, best_I = _merge_topk(best_D, best_I, D, ids[pos], k)
+
+    if min_score is not None:
+        best_I[np.isneginf(best_D)] = -1
+    return (best_D if inner_product else -best_D), best_I
+
+
+def restricted_search(index, query_vecs: np.ndarray, rows: np.ndarray, top_k: int):
+    """
+    Search chỉ trên `rows` của index.
+    IndexFlat → chunked matmul trên stored vectors; loại khác → IDSelectorBatch.
+    Trả về (D, I) giống index.search, nhưng tối đa min(top_k, len(rows)) cột.
+    """
+    query_vecs = np.atleast_2d(query_vecs).astype(np.float32)
+    rows = np.asarray(rows, dtype=np.int64)
+    k = min(top_k, len(rows))
+    if k == 0:
+        return np.empty((len(query_vecs), 0), np.float32), np.empty((len(query_vecs), 0), np.int64)
+
+    xb = flat_vectors(index)
+    if xb is not None:
+        return chunked_topk(xb, query_vecs, k, rows=rows,
+                            inner_product=index.metric_type == faiss.METRIC_INNER_PRODUCT)
+
+    return index.search(query_vecs, k, params=selector_params(index, rows))
+
+
+def selector_params(index, rows: np.ndarray):
+    """SearchParameters giới hạn theo `rows`, đúng loại cho index (IVF / HNSW cần params riêng)."""
+    sel = faiss.IDSelectorBatch(np.asarray(rows, dtype=np.int64))
+    inner = faiss.downcast_index(index)
+    if isinstance(inner, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        inner = faiss.downcast_index(inner.index)
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=sel, nprobe=inner.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=inner.hnsw.efSearch)
+    return faiss.SearchParameters(sel=sel)
+
+
+# ---------- 5. Range search / adaptive cutoff ---------- #
+def _pad_ranges(lims: np.ndarray, D: np.ndarray, I: np.ndarray, cap: int, inner_product: bool):
+    """Kết quả range_search (lims, D, I) → (D, I) [nq, <=cap] đã sort, pad I = -1."""
+    nq = len(lims) - 1
+    width = min(cap, int(np.diff(lims).max(initial=0)))
+    D_out = np.full((nq, width), -np.inf if inner_product else np.inf, dtype=np.float32)
+    I_out = np.full((nq, width), -1, dtype=np.int64)
+    for q in range(nq):
+        d, i = D[lims[q]:lims[q + 1]], I[lims[q]:lims[q + 1]]
+        order = np.argsort(-d if inner_product else d, kind="stable")[:width]
+        D_out[q, :len(order)], I_out[q, :len(order)] = d[order], i[order]
+    return D_out, I_out
+
+
+def range_topk(index, query_vecs: np.ndarray, min_score: float, cap: int, rows: Optional[np.ndarray] = None):
+    """
+    Mọi vector có score >= min_score (L2: distance <= min_score), tối đa `cap` / query, sort giảm dần.
+    FAISS range_search (kèm IDSelector khi có `rows`); IndexFlat + rows → chunked brute-force;
+    index không hỗ trợ range_search → search(cap) rồi lọc. Trả về (D, I) pad I = -1.
+    """
+    query_vecs = np.atleast_2d(query_vecs).astype(np.float32)
+    inner_product = index.metric_type == faiss.METRIC_INNER_PRODUCT
+    if rows is not None:
+        rows = np.asarray(rows, dtype=np.int64)
+        xb = flat_vectors(index)
+        if xb is not None:
+            return chunked_topk(xb, query_vecs, min(cap, len(rows)), rows=rows,
+                                inner_product=inner_product, min_score=min_score)
+    params = None if rows is None else selector_params(index, rows)
+    try:
+        lims, D, I = index.range_search(query_vecs, min_score, params=params)
+        return _pad_ranges(lims, D, I, cap, inner_product)
+    except RuntimeError:
+        D, I = index.search(query_vecs, cap, params=params)
+        I = np.where((D >= min_score) if inner_product else (D <= min_score), I, -1)
+        return D, I
+
+
+def adaptive_cutoff(scores: np.ndarray, method: str = "knee", min_keep: int = ADAPTIVE_MIN_KEEP) -> int:
+    """
+    Số candidates nên giữ từ scores đã sort giảm dần, dựa trên phân phối score:
+      • "knee": điểm xa nhất bên dưới dây cung nối score đầu–cuối (elbow của đường cong)
+      • "gap" : ngay trước bước giảm lớn nhất, nếu nó > ADAPTIVE_GAP_RATIO × median các bước
+    Query "sắc" (vài kết quả vượt trội) → cắt sớm; phân phối phẳng → giữ nguyên.
+    """
+    n = len(scores)
+    if n <= min_keep:
+        return n
+    s = np.asarray(scores, dtype=np.float64)
+    span = s[0] - s[-1]
+    if span <= 0:
+        return n
+    if method == "knee":
+        x = np.arange(n) / (n - 1)
+        y = (s - s[-1]) / span
+        dist = (1.0 - x) - y
+        knee = int(np.argmax(dist))
+        if dist[knee] < 0.05:   # gần như tuyến tính / lõm → không có elbow rõ ràng
+            return n
+        return max(knee + 1, min_keep)
+    if method == "gap":
+        steps = s[:-1] - s[1:]
+        pos = min_keep - 1 + int(np.argmax(steps[min_keep - 1:]))
+        return pos + 1 if steps[pos] > ADAPTIVE_GAP_RATIO * max(np.median(steps), 1e-9) else n
+    raise ValueError(f"Unknown cutoff method: {method}")
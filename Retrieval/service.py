@@ -0,0 +1,267 @@
+"""
+HTTP search service – giữ caches + models trong 1 process dài hạn.
+
+    uvicorn Retrieval.service:app --host 0.0.0.0 --port 8000
+
+Endpoints:
+    GET  /healthz   – process còn sống
+    GET  /readyz    – 200 khi caches + CLIP đã load xong, 503 nếu chưa
+    GET  /metrics   – counters + latency histograms (Prometheus text, Retrieval.telemetry)
+    POST /stage1    – stage1_retrieve_shots (micro-batched)
+    POST /stage1/page, /stage1/page/next – Stage 1 theo trang (cursor, Retrieval.pagination)
+    POST /stage2    – refine_shots_with_dp
+    POST /stage3    – rerank_with_openai_parallel
+
+Stage 1 đi qua MicroBatcher: các request đến trong BATCH_WINDOW_MS được gom theo
+cấu hình (type_search, search_type, ...) → 1 CLIP forward pass + 1 FAISS search nhiều hàng.
+Client: Retrieval.client.SearchClient.
+
+Nhiều worker trên 1 máy: publish caches 1 lần (python -m Retrieval.shared_cache publish)
+rồi chạy với SHARED_CACHE_ATTACH=1 → các worker attach chung 1 bản trong /dev/shm.
+"""
+
+from __future__ import annotations
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from Retrieval.config import (
+    BATCH_WINDOW_MS, BATCH_MAX_SIZE, MAX_WORKERS, HOT_RELOAD, DEDUPE_THRESHOLD, DEDUPE_SCOPE, PAGE_SIZE,
+    RERANK_MIN_CONFIDENT, RERANK_CONFIDENT_SCORE, RERANK_MAX_CALLS, RERANK_BUDGET_S,
+)
+from Retrieval.snapshot import current_snapshot
+from Retrieval.telemetry import prometheus_text
+
+
+# ---------- 1. Micro-batching ---------- #
+class MicroBatcher:
+    """
+    Gom các lời gọi submit(key, payload) trong `window_ms` (tối đa `max_batch`),
+    nhóm theo key rồi gọi run_batch(key, payloads) → list kết quả cùng thứ tự.
+    """
+
+    def __init__(self, run_batch: Callable[[Any, List[Any]], List[Any]],
+                 window_ms: float = BATCH_WINDOW_MS, max_batch: int = BATCH_MAX_SIZE):
+        self._run_batch = run_batch
+        self._window = window_ms / 1000.0
+        self._max_batch = max_batch
+        self._queue: "queue.Queue[Tuple[Any, Any, Future]]" = queue.Queue()
+        self.batches = self.requests = 0
+        threading.Thread(target=self._loop, name="micro-batcher", daemon=True).start()
+
+    def submit(self, key, payload) -> Future:
+        fut: Future = Future()
+        self._queue.put((key, payload, fut))
+        return fut
+
+    def _collect(self) -> List[Tuple[Any, Any, Future]]:
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self._window
+        while len(items) < self._max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _loop(self):
+        while True:
+            groups: Dict[Any, List[Tuple[Any, Future]]] = {}
+            for key, payload, fut in self._collect():
+                groups.setdefault(key, []).append((payload, fut))
+
+            for key, members in groups.items():
+                self.batches += 1
+                self.requests += len(members)
+                try:
+                    results = self._run_batch(key, [p for p, _ in members])
+                    for (_, fut), res in zip(members, results):
+                        fut.set_result(res)
+                except Exception as e:
+                    for _, fut in members:
+                        fut.set_exception(e)
+
+
+# ---------- 2. Request models ---------- #
+class Stage1Request(BaseModel):
+    query: str
+    search_type: str = "frame"
+    top_k: int = 50
+    type_search: str = "clip"
+    refine_stage2: bool = False
+    coarse_k: int = 0
+    filters: Optional[Dict[str, Any]] = None
+    dedupe_threshold: Optional[float] = None   # None → config DEDUPE_THRESHOLD
+    dedupe_scope: Optional[str] = None
+    min_score: Optional[float] = None           # range mode (top_k = giới hạn trên)
+    cutoff: Optional[str] = None                # "knee" | "gap"
+
+
+class PageRequest(BaseModel):
+    query: str
+    search_type: str = "frame"
+    type_search: str = "clip"
+    page_size: int = PAGE_SIZE
+    filters: Optional[Dict[str, Any]] = None
+
+
+class NextPageRequest(BaseModel):
+    cursor: str
+    page_size: int = PAGE_SIZE
+
+
+class Stage2Request(BaseModel):
+    shot_paths: List[str]
+    query: str
+
+
+class Stage3Request(BaseModel):
+    query: str
+    items: List[Dict[str, Any]]
+    top_k_rerank: int = 50
+    max_workers: int = MAX_WORKERS
+    search_type: str = "frame"
+    min_confident: int = RERANK_MIN_CONFIDENT
+    confident_score: float = RERANK_CONFIDENT_SCORE
+    max_calls: Optional[int] = RERANK_MAX_CALLS
+    budget_s: Optional[float] = RERANK_BUDGET_S
+
+
+# ---------- 3. App state ---------- #
+app = FastAPI(title="News-Events Retrieval")
+_state: Dict[str, Any] = {"ready": False, "error": None, "embedder": None}
+
+
+def _stage1_batch(key, queries: List[Tuple[str, int]]):
+    """key = cấu hình chung của batch; top_k riêng từng request (stage1 cắt mỗi hàng trước post-processing)."""
+    from Retrieval.stage1 import stage1_retrieve_batch
+
+    (search_type, type_search, refine_stage2, coarse_k, filters_json,
+     dedupe_threshold, dedupe_scope, min_score, cutoff) = key
+    results = stage1_retrieve_batch(
+        [q for q, _ in queries],
+        embedder=_state["embedder"],
+        search_type=search_type,
+        top_k=[k for _, k in queries],
+        type_search=type_search,
+        refine_stage2=refine_stage2,
+        coarse_k=coarse_k,
+        filters=json.loads(filters_json),
+        dedupe_threshold=dedupe_threshold,
+        dedupe_scope=dedupe_scope,
+        min_score=min_score,
+        cutoff=cutoff,
+    )
+    return results
+
+
+_batcher = MicroBatcher(_stage1_batch)
+
+
+def _load_resources():
+    try:
+        from Retrieval.cache_loader import preload_all_caches, start_hot_reload
+        from Retrieval.embedder import CLIPEmbedder
+
+        preload_all_caches(parallel=True)
+        _state["embedder"] = CLIPEmbedder()
+        _state["ready"] = True
+        if HOT_RELOAD:
+            start_hot_reload()
+    except Exception as e:
+        _state["error"] = repr(e)
+        print(f"[ERR] Service preload failed: {e}")
+
+
+@app.on_event("startup")
+def _startup():
+    # load ở background → /healthz trả lời ngay, /readyz báo 503 tới khi xong
+    threading.Thread(target=_load_resources, name="preload", daemon=True).start()
+
+
+def _require_ready():
+    if not _state["ready"]:
+        raise HTTPException(status_code=503, detail=_state["error"] or "loading")
+
+
+# ---------- 4. Endpoints ---------- #
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    _require_ready()
+    return {"status": "ready", "snapshot": current_snapshot().version,
+            "batches": _batcher.batches, "requests": _batcher.requests}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Counters + latency histograms theo stage (Prometheus text format)."""
+    return prometheus_text()
+
+
+@app.post("/stage1")
+def stage1(req: Stage1Request):
+    _require_ready()
+    key = (req.search_type, req.type_search, req.refine_stage2, req.coarse_k,
+           json.dumps(req.filters, sort_keys=True),
+           DEDUPE_THRESHOLD if req.dedupe_threshold is None else req.dedupe_threshold,
+           req.dedupe_scope or DEDUPE_SCOPE, req.min_score, req.cutoff)
+    try:
+        return {"results": _batcher.submit(key, (req.query, req.top_k)).result()}
+    except (ValueError, AssertionError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/stage1/page")
+def stage1_page(req: PageRequest):
+    _require_ready()
+    from Retrieval.pagination import search_page
+    try:
+        return search_page(req.query, _state["embedder"], req.search_type, req.type_search,
+                           req.page_size, req.filters)
+    except (ValueError, AssertionError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/stage1/page/next")
+def stage1_next_page(req: NextPageRequest):
+    _require_ready()
+    from Retrieval.pagination import next_page
+    try:
+        return next_page(req.cursor, req.page_size)
+    except ValueError as e:   # cursor hết hạn / bị evict (hoặc thuộc worker khác)
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.post("/stage2")
+def stage2(req: Stage2Request):
+    _require_ready()
+    from Retrieval.stage2_dp import refine_shots_with_dp
+    return {"results": refine_shots_with_dp(req.shot_paths, req.query, _state["embedder"])}
+
+
+@app.post("/stage3")
+def stage3(req: Stage3Request):
+    _require_ready()
+    from Retrieval.stage3_rerank import rerank_with_openai_parallel
+    results, stats = rerank_with_openai_parallel(
+        req.query, req.items,
+        top_k_rerank=req.top_k_rerank, max_workers=req.max_workers, search_type=req.search_type,
+        min_confident=req.min_confident, confident_score=req.confident_score,
+        max_calls=req.max_calls, budget_s=req.budget_s, return_stats=True,
+    )
+    return {"results": results, "stats": stats}
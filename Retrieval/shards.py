@@ -0,0 +1,159 @@
+"""
+Sharded FAISS indexes (mặc định 1 shard / batch Lxx).
+
+Layout dưới SHARD_DIR:
+
+    manifest.json
+    clip_frame/L01.index, clip_frame/L02.index, ...
+    clip_shot/L01.index, ...
+
+Mỗi shard là IndexIDMap2 với id = row toàn cục trong core.h5, nên kết quả merge
+dùng trực tiếp được với core_cache. Shard load độc lập – thêm batch mới chỉ cần
+build shard đó (scripts/build_shards.py) và cập nhật manifest.
+"""
+
+from __future__ import annotations
+import heapq
+import json
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from Retrieval.config import SHARD_DIR, SHARD_MANIFEST, MAX_WORKERS
+from Retrieval.snapshot import CacheView
+
+# index_name ("clip_frame") → {shard_name ("L01") → faiss.Index}
+shard_cache: Dict[str, Dict[str, faiss.Index]] = CacheView("shard_cache")
+
+# FAISS nhả GIL trong search → thread pool dùng chung cho scatter-gather
+_pool = ThreadPoolExecutor(MAX_WORKERS, thread_name_prefix="shard-search")
+
+# shard index → global ids đã sort (weak: shard bị reload / bỏ thì entry tự mất)
+_shard_ids: "weakref.WeakKeyDictionary[faiss.Index, np.ndarray]" = weakref.WeakKeyDictionary()
+
+
+# ---------- 1. Manifest ---------- #
+def read_manifest(path: str = SHARD_MANIFEST) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["shards"]
+
+
+def write_manifest(entries: List[Dict], path: str = SHARD_MANIFEST) -> None:
+    """Ghi atomic (tmp + rename) để worker đang đọc không thấy file dở dang."""
+    entries = sorted(entries, key=lambda e: (e["index"], e["shard"]))
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "shards": entries}, f, indent=2)
+    os.replace(tmp, path)
+
+
+def upsert_manifest_entry(entry: Dict, path: str = SHARD_MANIFEST) -> None:
+    entries = [e for e in read_manifest(path)
+               if (e["index"], e["shard"]) != (entry["index"], entry["shard"])]
+    write_manifest(entries + [entry], path)
+
+
+def sharded_index_names(path: str = SHARD_MANIFEST) -> set:
+    return {e["index"] for e in read_manifest(path)}
+
+
+# ---------- 2. Loader ---------- #
+def preload_shards(shard_names: Optional[List[str]] = None, index_names: Optional[List[str]] = None) -> None:
+    """Load các shard trong manifest (lọc theo shard_names / index_names nếu có)."""
+    entries = [
+        e for e in read_manifest()
+        if (shard_names is None or e["shard"] in shard_names)
+        and (index_names is None or e["index"] in index_names)
+    ]
+    print(f"[📥] Preload FAISS shards ({len(entries)})")
+
+    def _load(e):
+        return e, faiss.read_index(os.path.join(SHARD_DIR, e["file"]))
+
+    with ThreadPoolExecutor(MAX_WORKERS) as ex:
+        for e, index in ex.map(_load, entries):
+            shard_cache.setdefault(e["index"], {})[e["shard"]] = index
+
+    for name, shards in sorted(shard_cache.items()):
+        print(f"   • {name}: {len(shards)} shards ({sum(ix.ntotal for ix in shards.values())} vec)")
+
+
+# ---------- 3. Scatter-gather search ---------- #
+def _merge(per_shard, top_k: int, higher_is_better: bool):
+    """Heap merge các danh sách (D, I) đã sort của từng shard → top_k toàn cục."""
+    runs = [
+        [(float(d), int(i)) for d, i in zip(D, I) if i >= 0]
+        for D, I in per_shard
+    ]
+    merged = list(islice(
+        heapq.merge(*runs, key=lambda x: x[0], reverse=higher_is_better), top_k
+    ))
+    D = np.array([d for d, _ in merged], dtype=np.float32)
+    I = np.array([i for _, i in merged], dtype=np.int64)
+    return D, I
+
+
+def _rows_in_shard(index, rows: np.ndarray) -> np.ndarray:
+    """Phần của `rows` (global) có trong shard; id của shard (IndexIDMap2) được sort 1 lần / index."""
+    ids = _shard_ids.get(index)
+    if ids is None:
+        if not hasattr(index, "id_map"):   # không phải IDMap → không biết id, giữ nguyên rows
+            return rows
+        ids = _shard_ids[index] = np.sort(faiss.vector_to_array(index.id_map))
+    pos = np.minimum(np.searchsorted(ids, rows), len(ids) - 1)
+    return rows[ids[pos] == rows]
+
+
+def sharded_search(index_name: str, query_vecs: np.ndarray, top_k: int, rows: Optional[np.ndarray] = None,
+                   min_score: Optional[float] = None):
+    """
+    Search song song trên mọi shard đã load của `index_name`, merge top-k.
+    `rows` (optional) giới hạn theo row toàn cục – chia theo shard rồi áp dụng IDSelectorBatch trên từng shard.
+    `min_score` (optional): range search trên từng shard, top_k là giới hạn trên.
+    Trả về (D, I) dạng [nq, <=top_k] như index.search ([nq, 0] nếu không còn shard nào).
+    """
+    from Retrieval.search_utils import restricted_search, range_topk
+
+    query_vecs = np.atleast_2d(query_vecs).astype(np.float32)
+    shards = [ix for ix in shard_cache[index_name].values() if ix.ntotal > 0]
+    if rows is None:
+        jobs = [(ix, None) for ix in shards]
+    else:   # mỗi shard chỉ nhận phần rows của nó; shard không còn row nào → bỏ qua
+        rows = np.asarray(rows, dtype=np.int64)
+        jobs = [(ix, r) for ix, r in ((ix, _rows_in_shard(ix, rows)) for ix in shards) if len(r)]
+    if not jobs:
+        empty = np.empty((len(query_vecs), 0))
+        return empty.astype(np.float32), empty.astype(np.int64)
+    higher_is_better = jobs[0][0].metric_type == faiss.METRIC_INNER_PRODUCT
+
+    def _one(job):
+        index, shard_rows = job
+        if min_score is not None:
+            return range_topk(index, query_vecs, min_score, top_k, shard_rows)
+        if shard_rows is None:
+            return index.search(query_vecs, min(top_k, index.ntotal))
+        return restricted_search(index, query_vecs, shard_rows, top_k)
+
+    results = list(_pool.map(_one, jobs))
+    merged = [
+        _merge([(D[q], I[q]) for D, I in results], top_k, higher_is_better)
+        for q in range(len(query_vecs))
+    ]
+    return stack_padded(merged, higher_is_better)
+
+
+def stack_padded(rows, higher_is_better: bool = True):
+    """List (D, I) độ dài khác nhau → (D, I) [nq, max_len], chỗ trống I = -1 (như FAISS)."""
+    k = max(len(D) for D, _ in rows)
+    D_out = np.full((len(rows), k), -np.inf if higher_is_better else np.inf, dtype=np.float32)
+    I_out = np.full((len(rows), k), -1, dtype=np.int64)
+    for q, (D, I) in enumerate(rows):
+        D_out[q, :len(D)], I_out[q, :len(I)] = D, I
+    return D_out, I_out
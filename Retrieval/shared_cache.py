@@ -0,0 +1,384 @@
+"""
+Shared-memory caches cho nhiều worker trên cùng 1 máy.
+
+1 process loader preload bình thường rồi publish mọi cache ra các file mmap-able
+dưới SHARED_CACHE_DIR (mặc định /dev/shm → tmpfs, tức là RAM dùng chung). Worker
+attach: np.load(mmap_mode="r") / faiss IO_FLAG_MMAP → view read-only, zero-copy,
+nên N worker chỉ tốn 1 bản vectors / FAISS / metadata.
+
+    python -m Retrieval.shared_cache publish          # 1 lần, process có thể thoát sau đó
+    SHARED_CACHE_ATTACH=1 uvicorn Retrieval.service:app --workers 4
+    python -m Retrieval.shared_cache clear
+
+Layout:
+    manifest.json          ghi cuối (publish xong mới attach được)
+    core/<name>.*.npy      cột core_cache (array / strings: blob + offsets / ragged dict)
+    faiss/, shards/        .index (đọc lại bằng mmap)
+    ocr/                   TF-IDF CSR (data, indices, indptr)
+    embeddings/            layout embedding store (preload_embedding_store)
+    shot_table/            layout shot table (preload_shot_table)
+
+Cache nào đã là mmap trên file (embedding store, vectors trong clip.h5 ...) thì chỉ
+ghi lại đường dẫn – page cache của file đó vốn đã dùng chung giữa các process.
+Các dict Python (shot_cache, shot_row, vectorizer) vẫn được dựng riêng ở mỗi worker
+nhưng từ dữ liệu compact, không parse lại JSON / core.h5.
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional
+
+import faiss
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from Retrieval.config import SHARED_CACHE_DIR, OCR_VECTORIZER
+
+
+# ---------- 1. String column ---------- #
+class StringColumn:
+    """list[str] read-only trên 1 blob utf-8 + offsets (cả hai mmap) – decode khi truy cập."""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = int(idx)
+        if idx < 0:
+            idx += len(self)
+        start, end = self._offsets[idx], self._offsets[idx + 1]
+        return self._blob[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def _save_strings(values, prefix: str) -> Dict:
+    encoded = [(v.decode() if isinstance(v, bytes) else str(v)).encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    np.save(f"{prefix}.blob.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(f"{prefix}.offsets.npy", offsets)
+    return {"kind": "strings", "file": os.path.basename(prefix)}
+
+
+def _load_strings(prefix: str) -> StringColumn:
+    return StringColumn(np.load(f"{prefix}.blob.npy", mmap_mode="r"),
+                        np.load(f"{prefix}.offsets.npy", mmap_mode="r"))
+
+
+# ---------- 2. Generic value codec ---------- #
+def _is_strings(value) -> bool:
+    return isinstance(value, (list, tuple, StringColumn)) and all(isinstance(v, (str, bytes)) for v in value)
+
+
+def _dump(value, prefix: str) -> Optional[Dict]:
+    """Ghi 1 giá trị của core_cache/ocr_cache → descriptor (None = không share được, worker tự dựng)."""
+    from Retrieval.caption_store import LazyColumn
+
+    name = os.path.basename(prefix)
+    if isinstance(value, np.memmap) and value.filename:
+        return {"kind": "mapped", "path": value.filename, "dtype": value.dtype.str,
+                "shape": list(value.shape), "offset": int(value.offset)}
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        np.save(f"{prefix}.npy", value)
+        return {"kind": "array", "file": name}
+    if isinstance(value, LazyColumn):
+        return {"kind": "lazy", "dataset": value.dataset}
+    if _is_strings(value):
+        return _save_strings(value, prefix)
+    if isinstance(value, dict) and value and all(isinstance(k, str) for k in value):
+        values = list(value.values())
+        # {video → rows}: 1 mảng nối + offsets thay vì hàng nghìn file nhỏ
+        if all(isinstance(v, np.ndarray) and v.ndim == 1 and v.dtype == values[0].dtype for v in values):
+            _save_strings(list(value), f"{prefix}.keys")
+            offsets = np.zeros(len(values) + 1, dtype=np.int64)
+            np.cumsum([len(v) for v in values], out=offsets[1:])
+            np.save(f"{prefix}.values.npy", np.concatenate(values))
+            np.save(f"{prefix}.offsets.npy", offsets)
+            return {"kind": "ragged", "file": name}
+        # {path → row}
+        if all(isinstance(v, (int, np.integer)) for v in values):
+            _save_strings(list(value), f"{prefix}.keys")
+            np.save(f"{prefix}.values.npy", np.asarray(values, dtype=np.int64))
+            return {"kind": "row_map", "file": name}
+        # {column → values} (frame_meta, shot_meta)
+        columns = {k: _dump(v, f"{prefix}.{k}") for k, v in value.items()}
+        return {"kind": "columns", "columns": {k: d for k, d in columns.items() if d is not None}}
+    return None
+
+
+def _load(desc: Dict, root: str, stores: Dict[str, Any]):
+    kind = desc["kind"]
+    prefix = os.path.join(root, desc.get("file", ""))
+    if kind == "mapped":
+        return np.memmap(desc["path"], dtype=np.dtype(desc["dtype"]), mode="r",
+                         offset=desc["offset"], shape=tuple(desc["shape"]))
+    if kind == "array":
+        return np.load(f"{prefix}.npy", mmap_mode="r")
+    if kind == "strings":
+        return _load_strings(prefix)
+    if kind == "lazy":
+        from Retrieval.caption_store import CaptionStore, LazyColumn
+        if "store" not in stores:
+            stores["store"] = CaptionStore()
+        return LazyColumn(stores["store"], desc["dataset"])
+    if kind == "ragged":
+        keys = _load_strings(f"{prefix}.keys")
+        values = np.load(f"{prefix}.values.npy", mmap_mode="r")
+        offsets = np.load(f"{prefix}.offsets.npy")
+        return {k: values[offsets[i]:offsets[i + 1]] for i, k in enumerate(keys)}
+    if kind == "row_map":
+        values = np.load(f"{prefix}.values.npy").tolist()
+        return dict(zip(_load_strings(f"{prefix}.keys"), values))
+    if kind == "columns":
+        return {k: _load(d, root, stores) for k, d in desc["columns"].items()}
+    raise ValueError(f"Unknown shared cache entry kind: {kind}")
+
+
+# ---------- 3. FAISS ---------- #
+def read_index_mmap(path: str) -> faiss.Index:
+    """
+    Đọc .index bằng mmap: IVF → inverted lists mmap (IO_FLAG_MMAP), flat / HNSW / IDMap
+    → codes mmap (IO_FLAG_MMAP_IFC, faiss >= 1.9). Phiên bản faiss cũ: đọc vào RAM.
+    """
+    with open(path, "rb") as f:
+        fourcc = f.read(4)
+    flag = faiss.IO_FLAG_MMAP if fourcc.startswith(b"Iw") else getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    if flag is None:
+        print(f"[WARN] faiss {faiss.__version__} cannot mmap {os.path.basename(path)} – reading into RAM")
+        return faiss.read_index(path)
+    return faiss.read_index(path, flag)
+
+
+def _publish_faiss(root: str) -> Dict:
+    from Retrieval.cache_loader import faiss_index_cache
+    from Retrieval.shards import shard_cache
+
+    os.makedirs(os.path.join(root, "faiss"), exist_ok=True)
+    out = {"faiss": {}, "shards": {}}
+    for key, index in faiss_index_cache.items():
+        fname = os.path.join("faiss", os.path.basename(key))
+        faiss.write_index(index, os.path.join(root, fname))
+        out["faiss"][key] = fname
+    for index_name, shards in shard_cache.items():
+        os.makedirs(os.path.join(root, "shards", index_name), exist_ok=True)
+        for shard, index in shards.items():
+            fname = os.path.join("shards", index_name, f"{shard}.index")
+            faiss.write_index(index, os.path.join(root, fname))
+            out["shards"].setdefault(index_name, {})[shard] = fname
+    return out
+
+
+# ---------- 4. Embeddings / shots ---------- #
+def _publish_embeddings(root: str) -> Optional[Dict]:
+    """embedding_cache → layout embedding store; nếu đã là store mmap thì chỉ ghi đường dẫn."""
+    from Retrieval.cache_loader import embedding_cache
+
+    if not embedding_cache:
+        return None
+    entries = list(embedding_cache.values())
+    files = {getattr(e["vectors"], "filename", None) for e in entries}
+    if len(files) == 1 and None not in files:
+        return {"dir": os.path.dirname(files.pop())}
+
+    out = os.path.join(root, "embeddings")
+    os.makedirs(out, exist_ok=True)
+    videos, start = {}, 0
+    for key, e in embedding_cache.items():
+        videos[key] = [start, start + len(e["vectors"])]
+        start += len(e["vectors"])
+    vectors = np.concatenate([e["vectors"] for e in entries])
+    paths = [str(p.decode() if isinstance(p, bytes) else p) for e in entries for p in e["paths"]]
+    encoded = [p.encode("utf-8") for p in paths]
+    np.save(os.path.join(out, "vectors.npy"), vectors)
+    np.save(os.path.join(out, "paths.npy"), np.array(encoded, dtype=f"S{max((len(p) for p in encoded), default=1)}"))
+    if entries[0]["scales"] is not None:
+        np.save(os.path.join(out, "scales.npy"), np.concatenate([e["scales"] for e in entries]))
+    with open(os.path.join(out, "videos.json"), "w", encoding="utf-8") as f:
+        json.dump({"dtype": vectors.dtype.name, "dim": int(vectors.shape[1]), "videos": videos}, f)
+    return {"dir": out}
+
+
+def _publish_shots(root: str) -> Optional[Dict]:
+    """shot_cache → các cột của shot table (xem scripts/build_shot_table.py)."""
+    from Retrieval.cache_loader import shot_cache
+
+    if not shot_cache:
+        return None
+    out = os.path.join(root, "shot_table")
+    os.makedirs(out, exist_ok=True)
+    paths = list(shot_cache)
+    shots = [shot_cache[p] for p in paths]
+    frame_paths = [f for s in shots for f in s["frame_paths"]]
+    offsets = np.zeros(len(shots) + 1, dtype=np.int64)
+    np.cumsum([len(s["frame_paths"]) for s in shots], out=offsets[1:])
+
+    def _bytes(values):
+        encoded = [v.encode("utf-8") for v in values]
+        return np.array(encoded, dtype=f"S{max((len(v) for v in encoded), default=1)}")
+
+    columns = {
+        "paths": _bytes(paths), "source": _bytes([s["source"] for s in shots]),
+        "shot_id": np.array([s["shot_id"] for s in shots], dtype=np.int32),
+        "start_time": np.array([s["start_time"] for s in shots], dtype=np.float64),
+        "end_time": np.array([s["end_time"] for s in shots], dtype=np.float64),
+        "fps": np.array([s["fps"] for s in shots], dtype=np.float32),
+        "frames": np.array([s["frames"] for s in shots], dtype=np.int64).reshape(len(shots), -1),
+        "frame_paths": _bytes(frame_paths), "frame_offsets": offsets,
+    }
+    for name, arr in columns.items():
+        np.save(os.path.join(out, f"{name}.npy"), arr)
+    return {"dir": out}
+
+
+# ---------- 5. Publish / attach ---------- #
+def publish_caches(root: str = SHARED_CACHE_DIR) -> Dict:
+    """
+    Ghi mọi cache đã preload trong process này ra `root`. Ghi vào thư mục tạm rồi
+    rename → worker không bao giờ thấy bản dở dang; worker đang attach bản cũ vẫn
+    giữ được mmap (Linux giữ file đã unlink tới khi unmap).
+    """
+    from Retrieval.cache_loader import core_cache, ocr_cache
+    from Retrieval.exact_search import vector_cache
+
+    t0 = time.perf_counter()
+    tmp = f"{root}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(os.path.join(tmp, "core"))
+    os.makedirs(os.path.join(tmp, "ocr"))
+    print(f"[📤] Publish shared caches → {root}")
+
+    manifest: Dict[str, Any] = {"version": 1, "created": time.time(), "pid": os.getpid()}
+    core, skipped = {}, []
+    for key, value in core_cache.items():
+        if key == "caption_store":   # worker mở CaptionStore riêng (handle h5py không share được)
+            continue
+        desc = _dump(value, os.path.join(tmp, "core", key))
+        if desc is None:
+            skipped.append(key)
+        else:
+            core[key] = desc
+    manifest["core"] = core
+    manifest["vectors"] = {k: _dump(v, os.path.join(tmp, "core", f"vectors_{k}")) for k, v in vector_cache.items()}
+
+    if "matrix" in ocr_cache:
+        m = ocr_cache["matrix"].tocsr()
+        for part in ("data", "indices", "indptr"):
+            np.save(os.path.join(tmp, "ocr", f"{part}.npy"), getattr(m, part))
+        manifest["ocr"] = {"shape": list(m.shape), "paths": _save_strings(ocr_cache["paths"], os.path.join(tmp, "ocr", "paths"))}
+
+    manifest.update(_publish_faiss(tmp))
+    emb = _publish_embeddings(tmp)
+    shots = _publish_shots(tmp)
+    # đường dẫn trong tmp → đường dẫn sau khi rename
+    manifest["embeddings"] = emb and {"dir": emb["dir"].replace(tmp, root, 1)}
+    manifest["shot_table"] = shots and {"dir": shots["dir"].replace(tmp, root, 1)}
+
+    with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    old = f"{root}.old-{os.getpid()}"
+    if os.path.exists(root):
+        os.replace(root, old)
+    os.replace(tmp, root)
+    shutil.rmtree(old, ignore_errors=True)
+
+    if skipped:
+        print(f"[WARN] Not shared (rebuilt per worker): {', '.join(skipped)}")
+    print(f"[✅] Shared caches: {_dir_bytes(root) / 2**20:.1f} MiB in {time.perf_counter() - t0:.1f}s")
+    return manifest
+
+
+def attach_caches(root: str = SHARED_CACHE_DIR) -> None:
+    """Điền các global cache từ bản đã publish – view read-only, không copy."""
+    from Retrieval.cache_loader import (
+        core_cache, faiss_index_cache, ocr_cache, preload_embedding_store, preload_shot_table
+    )
+    from Retrieval.exact_search import vector_cache
+    from Retrieval.shards import shard_cache
+
+    with open(os.path.join(root, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    print(f"[📎] Attach shared caches ← {root} (pid {manifest['pid']}, "
+          f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manifest['created']))})")
+
+    stores: Dict[str, Any] = {}
+    core_root = os.path.join(root, "core")
+    for key, desc in manifest["core"].items():
+        core_cache[key] = _load(desc, core_root, stores)
+    if "store" in stores:
+        core_cache["caption_store"] = stores["store"]
+    for key, desc in manifest["vectors"].items():
+        if desc is not None:
+            vector_cache[key] = _load(desc, core_root, stores)
+
+    if manifest.get("ocr"):
+        import joblib
+        ocr_root = os.path.join(root, "ocr")
+        parts = [np.load(os.path.join(ocr_root, f"{p}.npy"), mmap_mode="r") for p in ("data", "indices", "indptr")]
+        ocr_cache["matrix"] = csr_matrix(tuple(parts), shape=tuple(manifest["ocr"]["shape"]), copy=False)
+        ocr_cache["paths"] = _load(manifest["ocr"]["paths"], ocr_root, stores)
+        ocr_cache["vectorizer"] = joblib.load(OCR_VECTORIZER)
+
+    for key, fname in manifest["faiss"].items():
+        faiss_index_cache[key] = read_index_mmap(os.path.join(root, fname))
+    for index_name, shards in manifest["shards"].items():
+        for shard, fname in shards.items():
+            shard_cache.setdefault(index_name, {})[shard] = read_index_mmap(os.path.join(root, fname))
+
+    if manifest["embeddings"]:
+        preload_embedding_store(manifest["embeddings"]["dir"])
+    if manifest["shot_table"]:
+        preload_shot_table(manifest["shot_table"]["dir"])
+    print(f"[✅] Attached: {len(core_cache)} core entries | {len(faiss_index_cache)} indexes | "
+          f"{sum(len(s) for s in shard_cache.values())} shards")
+
+
+def shared_manifest_path(root: str = SHARED_CACHE_DIR) -> str:
+    return os.path.join(root, "manifest.json")
+
+
+def _dir_bytes(root: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+
+# ---------- 6. CLI ---------- #
+def main():
+    p = argparse.ArgumentParser(description="Publish / inspect / clear shared-memory caches")
+    p.add_argument("action", choices=["publish", "status", "clear"])
+    p.add_argument("--dir", default=SHARED_CACHE_DIR)
+    p.add_argument("--parallel", action="store_true", help="preload các cache song song trước khi publish")
+    args = p.parse_args()
+
+    if args.action == "publish":
+        from Retrieval.cache_loader import preload_all_caches
+        preload_all_caches(parallel=args.parallel, shared=False)
+        publish_caches(args.dir)
+    elif args.action == "status":
+        if not os.path.exists(shared_manifest_path(args.dir)):
+            print(f"[WARN] Nothing published at {args.dir}")
+            return
+        with open(shared_manifest_path(args.dir), encoding="utf-8") as f:
+            manifest = json.load(f)
+        age = time.time() - manifest["created"]
+        print(f"{args.dir}: {_dir_bytes(args.dir) / 2**20:.1f} MiB | {len(manifest['core'])} core entries | "
+              f"{len(manifest['faiss'])} indexes | published {age / 60:.1f} min ago by pid {manifest['pid']}")
+    else:
+        shutil.rmtree(args.dir, ignore_errors=True)
+        print(f"[🗑️] Removed {args.dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Versioned cache snapshots.
+
+Mọi cache (shot_cache, core_cache, faiss_index_cache, ...) thuộc về 1 CacheSnapshot.
+Các global dict cũ giờ là CacheView – proxy tới snapshot đang "active":
+
+    • trong `activate(snap)`  → snapshot đang build (loader ghi vào đây, off request path)
+    • trong hàm @pinned       → snapshot đã chốt lúc query bắt đầu
+    • còn lại                 → snapshot hiện hành (current_snapshot())
+
+publish_snapshot() thay snapshot hiện hành bằng 1 phép gán duy nhất; query đang
+chạy giữ snapshot cũ tới khi xong (GC dọn khi hết tham chiếu). Sau khi publish,
+snapshot không bị sửa nữa (ngoại trừ các bảng dẫn xuất lazy như `*_tag_rows`).
+"""
+
+from __future__ import annotations
+import contextvars
+import functools
+import hashlib
+import itertools
+import os
+import threading
+import time
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Optional
+
+
+@dataclass(frozen=True)
+class CacheSnapshot:
+    version: int = 0
+    fingerprint: str = ""
+    created: float = field(default_factory=time.time)
+    shot_cache: dict = field(default_factory=dict)
+    core_cache: dict = field(default_factory=dict)
+    faiss_index_cache: dict = field(default_factory=dict)
+    ocr_cache: dict = field(default_factory=dict)
+    embedding_cache: dict = field(default_factory=dict)
+    vector_cache: dict = field(default_factory=dict)
+    shard_cache: dict = field(default_factory=dict)
+
+
+_versions = itertools.count(1)
+_current = CacheSnapshot()
+_swap_lock = threading.Lock()
+_active: contextvars.ContextVar[Optional[CacheSnapshot]] = contextvars.ContextVar("cache_snapshot", default=None)
+_publish_hooks: List[Callable[[CacheSnapshot], None]] = []
+
+
+# ---------- 1. Current / active snapshot ---------- #
+def current_snapshot() -> CacheSnapshot:
+    return _current
+
+
+def active_snapshot() -> CacheSnapshot:
+    return _active.get() or _current
+
+
+def new_snapshot(fingerprint: str = "") -> CacheSnapshot:
+    return CacheSnapshot(version=next(_versions), fingerprint=fingerprint)
+
+
+def publish_snapshot(snap: CacheSnapshot) -> CacheSnapshot:
+    """Đổi snapshot hiện hành (atomic) – trả về snapshot cũ."""
+    global _current
+    with _swap_lock:
+        old, _current = _current, snap
+    for hook in _publish_hooks:
+        hook(old)
+    return old
+
+
+def on_publish(hook: Callable[[CacheSnapshot], None]) -> None:
+    """hook(old_snapshot) chạy sau mỗi publish_snapshot – để thả tham chiếu dài hạn tới snapshot cũ."""
+    _publish_hooks.append(hook)
+
+
+@contextmanager
+def activate(snap: CacheSnapshot):
+    """Trong block này (và thread con chạy bằng contextvars.copy_context), cache views trỏ tới `snap`."""
+    token = _active.set(snap)
+    try:
+        yield snap
+    finally:
+        _active.reset(token)
+
+
+def pinned(fn):
+    """Decorator cho entry point của 1 stage: chốt snapshot lúc bắt đầu, giữ nguyên tới khi return."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _active.get() is not None:   # đã pin ở lời gọi ngoài
+            return fn(*args, **kwargs)
+        with activate(_current):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+# ---------- 2. Dict proxy ---------- #
+class CacheView(MutableMapping):
+    """Dùng như dict cũ (`core_cache["frame_paths"]`), nhưng đọc/ghi vào snapshot đang active."""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def _dict(self) -> dict:
+        return getattr(_active.get() or _current, self._name)
+
+    def __getitem__(self, key):
+        return self._dict()[key]
+
+    def __setitem__(self, key, value):
+        self._dict()[key] = value
+
+    def __delitem__(self, key):
+        del self._dict()[key]
+
+    def __contains__(self, key):
+        return key in self._dict()
+
+    def __iter__(self):
+        return iter(self._dict())
+
+    def __len__(self):
+        return len(self._dict())
+
+    def __repr__(self):
+        return f"CacheView({self._name!r}, v{active_snapshot().version}, {len(self)} keys)"
+
+
+# ---------- 3. Change detection ---------- #
+def fingerprint(paths: Iterable[str]) -> str:
+    """Hash (relpath, size, mtime) của mọi file dưới các thư mục / file trong `paths`."""
+    h = hashlib.sha1()
+    for root in paths:
+        if os.path.isfile(root):
+            files = [root]
+        else:
+            files = sorted(os.path.join(d, f) for d, _, fs in os.walk(root) for f in fs)
+        for path in files:
+            try:
+                st = os.stat(path)
+            except OSError:   # file bị xoá giữa walk và stat
+                continue
+            h.update(f"{path}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
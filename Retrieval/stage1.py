@@ -1,6 +1,6 @@
 from __future__ import annotations
-import time
-from typing import List, Dict, Union
+import os
+from typing import List, Dict, Optional, Union
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 
@@ -12,114 +12,288 @@ from Retrieval.cache_loader import (
 )
 from Retrieval.search_utils import (
     get_index_path,
-    encode_query_for_search,
+    encode_queries_for_search,
+    frame_rows_for_shots,
+    topk_from_scores,
+    restricted_search,
+    split_backend,
+    range_topk,
+    adaptive_cutoff,
 )
-from Retrieval.config import FAISS_DIR
+from Retrieval.filters import compile_filters, compile_ocr_filters
+from Retrieval.shards import shard_cache, sharded_search, stack_padded
+from Retrieval.exact_search import exact_search
+from Retrieval.caption_store import prefetch_rows
+from Retrieval.telemetry import count, span, traced
+from Retrieval.profiling import alloc_section
+from Retrieval.config import (
+    FAISS_DIR, DEDUPE_THRESHOLD, DEDUPE_SCOPE, STAGE1_MIN_SCORE, STAGE1_CUTOFF
+)
+from Retrieval.dedupe import dedupe_candidates
+from Retrieval.snapshot import pinned
 
 
-def stage1_retrieve_shots(query: str,
-                           embedder,
-                           search_type: str,
-                           top_k: int,
-                           type_search: str = "clip",
-                           refine_stage2: bool = True
-                          ) -> Union[List[str], List[Dict]]:
-    assert search_type in ["frame", "shot"], "search_type must be 'frame' or 'shot'"
+def _cached_index(type_search: str, search_type: str):
+    index_path = get_index_path(type_search, search_type, FAISS_DIR)
+    if index_path not in faiss_index_cache:
+        raise RuntimeError(f" FAISS index not found in cache: {index_path}\nDid you forget to run preload_all_faiss_indexes()?")
+    return index_path, faiss_index_cache[index_path]
+
+
+def _vector_search(type_search: str, search_type: str, q: np.ndarray, top_k: int,
+                   rows: Optional[np.ndarray] = None, min_score: Optional[float] = None):
+    """
+    Vector search theo backend của type_search: exact (`*_exact`, brute-force trên mmap vectors),
+    FAISS shards (nếu đã load) hoặc index nguyên khối; `rows` giới hạn vector hợp lệ.
+    min_score: range mode – mọi vector có score >= min_score, tối đa top_k (chỗ trống I = -1).
+    """
+    base_type, backend = split_backend(type_search)
+    index_path = get_index_path(base_type, search_type, FAISS_DIR)
+    index_name = os.path.splitext(os.path.basename(index_path))[0]
+    if backend == "exact":
+        D, I, stats = exact_search(index_name, q, top_k, rows, min_score)
+        print(f"[⚡] Exact search {index_name}: {stats['rows']} vec | "
+              f"{stats['bytes'] / 1e9:.3f} GB @ {stats['gbps']:.2f} GB/s")
+        return D, I
+    if index_name in shard_cache:
+        print(f"[⚡] Using {len(shard_cache[index_name])} FAISS shards: {index_name}")
+        return sharded_search(index_name, q, top_k, rows, min_score)
+
+    index_path, index = _cached_index(type_search, search_type)
+    print(f"[⚡] Using preloaded FAISS index: {index_path}")
+    if min_score is not None:
+        return range_topk(index, q, min_score, top_k, rows)
+    if rows is None:
+        return index.search(q, top_k)
+    print(f"[🔎] Filter: {len(rows)}/{index.ntotal} eligible vectors")
+    return restricted_search(index, q, rows, top_k)
+
+
+def _coarse_to_fine_search(query_vec: np.ndarray, type_search: str, top_k: int, coarse_k: int,
+                           filters: Optional[Dict] = None, min_score: Optional[float] = None):
+    """Shot index lấy `coarse_k` shots → frame index chỉ search trên frames của các shots đó."""
+    q = np.expand_dims(query_vec, axis=0)
 
-    t_total = time.time()
-
-    # === 1. Encode query
-    start_time = time.time()
-    start_embed = time.time()
-    query_vec = encode_query_for_search(query, type_search=type_search, embedder=embedder)
-    embed_time = time.time() - start_embed
-    print(f"[⏱️] Embedding time: {embed_time:.4f}s")
-
-    # ---------- 2. Search (FAISS or OCR) ---------- #
-    if type_search != 'ocr':
-        index_path = get_index_path(type_search, search_type, FAISS_DIR)
-        # === Load FAISS index (with cache)
-        start_search = time.time()
-        if index_path not in faiss_index_cache:
-            raise RuntimeError(f" FAISS index not found in cache: {index_path}\nDid you forget to run preload_all_faiss_indexes()?")
-
-        index = faiss_index_cache[index_path]
-        print(f"[⚡] Using preloaded FAISS index: {index_path}")
-
-        D, I = index.search(np.expand_dims(query_vec, axis=0), top_k)
-        search_time = time.time() - start_search
-        print(f"[⏱️] FAISS search time: {search_time:.4f}s")
-    else:
-        start_search = time.time()
-        tfidf_matrix = ocr_cache["matrix"]
-        rel_paths    = ocr_cache["paths"]
-
-        sims = cosine_similarity(query_vec, tfidf_matrix, dense_output=False)[0]
-        top_k_idx = sims.argsort()[-top_k:][::-1]
-        D = sims[top_k_idx]
-        I = np.array(top_k_idx)
-        D = D[None, :]
-        I = I[None, :]
-
-        print(f"[⏱️] Sparse TF-IDF search time: {time.time() - start_search:.4f}s")
-
-    # ---------- 3. Load metadata ---------- #
-    start_load = time.time()
+    _, S = _vector_search(type_search, "shot", q, coarse_k, compile_filters(filters, "shot"))
+    rows = frame_rows_for_shots(S[0])
+
+    frame_rows = compile_filters(filters, "frame")
+    if frame_rows is not None:
+        rows = rows[np.isin(rows, frame_rows, assume_unique=True)]
+    print(f"[🎯] Coarse-to-fine: {coarse_k} shots → {len(rows)} candidate frames")
+    return _vector_search(type_search, "frame", q, top_k, rows, min_score)
+
+
+def stage1_search(query_vecs: np.ndarray,
+                  search_type: str,
+                  top_k: int,
+                  type_search: str = "clip",
+                  coarse_k: int = 0,
+                  filters: Optional[Dict] = None,
+                  min_score: Optional[float] = None):
+    """
+    Search cho 1 hoặc nhiều query vectors (mỗi hàng 1 query) → (D, I) dạng [nq, <=top_k].
+    min_score: range mode – mọi candidate có score >= min_score, top_k là giới hạn trên (pad I = -1).
+    """
+    with span("stage1.search", queries=len(query_vecs), top_k=top_k, backend=type_search):
+        if type_search != 'ocr':
+            if search_type == "frame" and coarse_k > 0:
+                # === Two-level: shot index → frames của các shot đã chọn (rows khác nhau theo query)
+                pairs = [_coarse_to_fine_search(q, type_search, top_k, coarse_k, filters, min_score)
+                         for q in query_vecs]
+                D, I = stack_padded([(D[0], I[0]) for D, I in pairs])
+            else:
+                # === FAISS index (preloaded, nguyên khối hoặc sharded) – 1 lần search cho cả batch
+                D, I = _vector_search(type_search, search_type, query_vecs, top_k,
+                                      compile_filters(filters, search_type), min_score)
+        else:
+            tfidf_matrix = ocr_cache["matrix"]
+
+            rows = compile_ocr_filters(filters)
+            if rows is not None:
+                tfidf_matrix = tfidf_matrix[rows]
+
+            sims = cosine_similarity(query_vecs, tfidf_matrix, dense_output=True)
+            if min_score is not None:
+                sims[sims < min_score] = -np.inf
+            D, top_k_idx = topk_from_scores(sims, top_k)
+            I = top_k_idx if rows is None else rows[top_k_idx]
+            if min_score is not None:
+                I = np.where(np.isneginf(D), -1, I)
+    return D, I
+
+
+@traced("stage1.materialize")
+def stage1_materialize(D_row: np.ndarray, I_row: np.ndarray, search_type: str,
+                       refine_stage2: bool) -> Union[List[str], List[Dict]]:
+    """1 hàng (D, I) → shot paths (refine_stage2) hoặc result dicts kèm metadata."""
+    keep = I_row >= 0   # FAISS trả -1 khi không đủ top_k vectors
+    D_row, I_row = D_row[keep], I_row[keep]
     if search_type == "frame":
         frame2shot = core_cache["frame_meta"]["source"]
-        load_time = time.time() - start_load
-        print(f"[⏱️] Loading paths from cache (frame) time: {load_time:.4f}s")
 
         if refine_stage2:
-            shot_paths = [frame2shot[idx] for idx in I[0]]
-            unique_shot_paths = list(dict.fromkeys(shot_paths))
-            print(f"[✅] Stage 1 total time: {time.time() - start_time:.4f}s")
-            return unique_shot_paths
-        else:
-            results = []
-            for idx, dist in zip(I[0], D[0]):
-                results.append({
-                    "frame_path": core_cache["frame_paths"][idx],
-                    "score": float(dist),
-                    "frame_number": int(core_cache["frame_meta"]["frame_number"][idx]),
-                    "shot_name": core_cache["frame_meta"]["shot"][idx],
-                    "shot_idx": int(core_cache["frame_meta"]["shot_idx"][idx]),
-                    "source": core_cache["frame_meta"]["source"][idx],
-                    "timestamp": float(core_cache["frame_meta"]["timestamp"][idx]),
-                    "fps": float(core_cache["frame_meta"]["fps"][idx]),
-                    "blip_caption": core_cache["frame_blip"][idx],
-                    "llm_caption": core_cache["frame_llm"][idx],
-                    "tags": core_cache["frame_meta"]["tags"][idx]
-                })
-            print(f"[✅] Stage 1 total time: {time.time() - start_time:.4f}s")
-            return results
-
-    else:  # shot
-        paths = core_cache["shot_paths"]
-        load_time = time.time() - start_load
-        print(f"[⏱️] Loading paths from cache (shot) time: {load_time:.4f}s")
+            shot_paths = [frame2shot[idx] for idx in I_row]
+            return list(dict.fromkeys(shot_paths))
 
-        if refine_stage2:
-            shot_paths = [paths[idx] for idx in I[0]]
-            print(f"[✅] Stage 1 total time: {time.time() - start_time:.4f}s")
-            return shot_paths
-        else:
-            results = []
-            for idx in I[0]:
-                shot_path = paths[idx]
-                results.append({
-                    "shot_path": paths[idx],
-                    "score": float(D[0][list(I[0]).index(idx)]),
-                    "shot_id": int(core_cache["shot_meta"]["shot_id"][idx]),
-                    "fps": float(core_cache["shot_meta"]["fps"][idx]),
-                    "start_time": float(core_cache["shot_meta"]["start_time"][idx]),
-                    "end_time": float(core_cache["shot_meta"]["end_time"][idx]),
-                    "blip_caption": core_cache["shot_blip"][idx],
-                    "llm_caption": core_cache["shot_llm"][idx],
-                    "source": core_cache["shot_meta"]["source"][idx],
-                    "frame_paths": shot_cache[shot_path]["frame_paths"],
-                    "tags": core_cache["shot_meta"]["tags"][idx]
-                })
-                
-            print(f"[✅] Stage 1 total time: {time.time() - start_time:.4f}s")
-            return results
+        prefetch_rows([core_cache["frame_blip"], core_cache["frame_llm"]], I_row)
+        results = []
+        for idx, dist in zip(I_row, D_row):
+            results.append({
+                "frame_path": core_cache["frame_paths"][idx],
+                "score": float(dist),
+                "frame_number": int(core_cache["frame_meta"]["frame_number"][idx]),
+                "shot_name": core_cache["frame_meta"]["shot"][idx],
+                "shot_idx": int(core_cache["frame_meta"]["shot_idx"][idx]),
+                "source": core_cache["frame_meta"]["source"][idx],
+                "timestamp": float(core_cache["frame_meta"]["timestamp"][idx]),
+                "fps": float(core_cache["frame_meta"]["fps"][idx]),
+                "blip_caption": core_cache["frame_blip"][idx],
+                "llm_caption": core_cache["frame_llm"][idx],
+                "tags": core_cache["frame_meta"]["tags"][idx]
+            })
+        return results
+
+    # shot
+    paths = core_cache["shot_paths"]
+
+    if refine_stage2:
+        return [paths[idx] for idx in I_row]
+
+    prefetch_rows([core_cache["shot_blip"], core_cache["shot_llm"]], I_row)
+    results = []
+    for idx, dist in zip(I_row, D_row):
+        shot_path = paths[idx]
+        results.append({
+            "shot_path": paths[idx],
+            "score": float(dist),
+            "shot_id": int(core_cache["shot_meta"]["shot_id"][idx]),
+            "fps": float(core_cache["shot_meta"]["fps"][idx]),
+            "start_time": float(core_cache["shot_meta"]["start_time"][idx]),
+            "end_time": float(core_cache["shot_meta"]["end_time"][idx]),
+            "blip_caption": core_cache["shot_blip"][idx],
+            "llm_caption": core_cache["shot_llm"][idx],
+            "source": core_cache["shot_meta"]["source"][idx],
+            "frame_paths": shot_cache[shot_path]["frame_paths"],
+            "tags": core_cache["shot_meta"]["tags"][idx]
+        })
+    return results
+
+
+def merge_frame_results(results: List[Dict]) -> List[Dict]:
+    """Gộp kết quả frame của nhiều sub-query: mỗi frame_path giữ item có score cao nhất, sort giảm dần."""
+    best: Dict[str, Dict] = {}
+    for item in results:
+        fp = item["frame_path"]
+        if fp not in best or item["score"] > best[fp]["score"]:
+            best[fp] = item
+    return sorted(best.values(), key=lambda x: x["score"], reverse=True)
+
+
+def _cutoff(rows, method: str):
+    out = []
+    for D_row, I_row in rows:
+        n = adaptive_cutoff(D_row, method)
+        out.append((D_row[:n], I_row[:n]))
+    print(f"[✂️] Adaptive cutoff ({method}): {sum(len(I) for _, I in rows)} → "
+          f"{sum(len(I) for _, I in out)} candidates")
+    return out
+
+
+@traced("stage1.dedupe")
+def _dedupe(rows, search_type: str, threshold: float, scope: str):
+    out, total = [], {}
+    for D_row, I_row in rows:
+        D_row, I_row, stats = dedupe_candidates(D_row, I_row, search_type, threshold, scope)
+        out.append((D_row, I_row))
+        for k, v in stats.items():
+            total[k] = total.get(k, 0) + v
+    msg = (f"[🧹] Dedupe (cos > {threshold}, {scope}): {total['candidates']} → {total['kept']} candidates "
+           f"| Stage 3 slots saved: {total['suppressed']}")
+    if "shots_before" in total:
+        msg += f" | Stage 2 shots: {total['shots_before']} → {total['shots_after']}"
+    print(msg)
+    count("stage1.dedupe_suppressed", total["suppressed"])
+    return out
+
+
+@pinned
+def stage1_retrieve_batch(queries: List[str],
+                          embedder,
+                          search_type: str,
+                          top_k: Union[int, List[int]],
+                          type_search: str = "clip",
+                          refine_stage2: bool = True,
+                          coarse_k: int = 0,
+                          filters: Optional[Dict] = None,
+                          dedupe_threshold: float = DEDUPE_THRESHOLD,
+                          dedupe_scope: str = DEDUPE_SCOPE,
+                          min_score: Optional[float] = STAGE1_MIN_SCORE,
+                          cutoff: Optional[str] = STAGE1_CUTOFF
+                         ) -> List[Union[List[str], List[Dict]]]:
+    """
+    Stage 1 cho nhiều queries cùng cấu hình: 1 lần encode theo batch + 1 lần search nhiều hàng.
+    Trả về list kết quả theo thứ tự queries (mỗi phần tử như stage1_retrieve_shots).
+
+    top_k: int chung hoặc list (1 giá trị / query) – search 1 lần với top_k lớn nhất, mỗi hàng được
+    cắt về top_k của nó trước cutoff / dedupe / materialize, nên kết quả không phụ thuộc batch.
+
+    filters (optional, xem Retrieval.filters): {"videos": [...], "time_range": (t0, t1), "tags": [...]}
+    – được compile thành rows hợp lệ và áp dụng ngay trong lúc search, nên luôn trả đủ top_k
+    nếu có đủ vector thỏa điều kiện.
+
+    dedupe_threshold > 0: bỏ các candidate có cosine (CLIP) > threshold với 1 candidate xếp trên,
+    trong cùng video (dedupe_scope="video") hoặc toàn cục ("global") – xem Retrieval.dedupe.
+
+    min_score: trả mọi candidate có score >= min_score thay vì đúng top_k (top_k thành giới hạn trên).
+    cutoff ("knee" | "gap"): cắt mỗi danh sách tại elbow / khoảng trống lớn nhất của phân phối score
+    – query cụ thể giữ ít candidates hơn nên Stage 2/3 nhẹ hơn.
+    """
+    assert search_type in ["frame", "shot"], "search_type must be 'frame' or 'shot'"
+
+    with span("stage1", queries=len(queries), search_type=search_type, type_search=type_search) as sp:
+        # === 1. Encode queries
+        with span("stage1.embed", queries=len(queries)):
+            query_vecs = encode_queries_for_search(queries, type_search=split_backend(type_search)[0],
+                                                   embedder=embedder)
+
+        # ---------- 2. Search (FAISS or OCR) ---------- #
+        top_ks = list(top_k) if isinstance(top_k, (list, tuple)) else [top_k] * len(queries)
+        D, I = stage1_search(query_vecs, search_type, max(top_ks), type_search, coarse_k, filters, min_score)
+
+        rows = []
+        for q, k in enumerate(top_ks):
+            valid = I[q] >= 0
+            rows.append((D[q][valid][:k], I[q][valid][:k]))
+        if min_score is not None:
+            print(f"[📏] Range search (score >= {min_score}, cap {max(top_ks)}): "
+                  f"{[len(I_row) for _, I_row in rows]} candidates")
+        if cutoff:
+            rows = _cutoff(rows, cutoff)
+        if dedupe_threshold > 0:
+            rows = _dedupe(rows, search_type, dedupe_threshold, dedupe_scope)
+
+        # ---------- 3. Load metadata ---------- #
+        with alloc_section("stage1.materialize"):
+            out = [stage1_materialize(D_row, I_row, search_type, refine_stage2) for D_row, I_row in rows]
+        sp.set(candidates=sum(len(r) for r in out))
+    count("stage1.queries", len(queries))
+    return out
+
+
+def stage1_retrieve_shots(query: str,
+                           embedder,
+                           search_type: str,
+                           top_k: int,
+                           type_search: str = "clip",
+                           refine_stage2: bool = True,
+                           coarse_k: int = 0,
+                           filters: Optional[Dict] = None,
+                           dedupe_threshold: float = DEDUPE_THRESHOLD,
+                           dedupe_scope: str = DEDUPE_SCOPE,
+                           min_score: Optional[float] = STAGE1_MIN_SCORE,
+                           cutoff: Optional[str] = STAGE1_CUTOFF
+                          ) -> Union[List[str], List[Dict]]:
+    return stage1_retrieve_batch([query], embedder, search_type, top_k, type_search,
+                                 refine_stage2, coarse_k, filters, dedupe_threshold, dedupe_scope,
+                                 min_score, cutoff)[0]
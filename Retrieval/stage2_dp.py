@@ -1,97 +1,130 @@
 from __future__ import annotations
 import time
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 import numpy as np
 from tqdm import tqdm
 
 from Retrieval.cache_loader import shot_cache, embedding_cache, core_cache
 from Retrieval.embedder import CLIPEmbedder
+from Retrieval.caption_store import prefetch_rows
+from Retrieval.snapshot import pinned
+from Retrieval.telemetry import count, enabled, observe, span
+from Retrieval.profiling import alloc_section
+
+def _frame_vectors(entry: Dict, idxs: List[int]) -> np.ndarray:
+    """Gom frame vectors của entry, upcast float32 (int8 → nhân lại scale per-vector)."""
+    vecs = entry["vectors"][idxs].astype(np.float32)
+    scales = entry.get("scales")
+    if scales is not None:
+        vecs *= scales[idxs, None]
+    return vecs
+
+
+def _path_index(entry: Dict) -> Dict[str, int]:
+    """frame path → row trong entry; dựng 1 lần / video (paths là list str hoặc mảng bytes của store)."""
+    path_to_idx = entry.get("path_to_idx")
+    if path_to_idx is None:
+        path_to_idx = {
+            (p.decode() if isinstance(p, bytes) else p): i for i, p in enumerate(entry["paths"])
+        }
+        entry["path_to_idx"] = path_to_idx
+    return path_to_idx
+
+
+def _dp_align(sims: np.ndarray) -> float:
+    """DP alignment theo thứ tự thời gian trên ma trận sims (M sub-queries, F frames)."""
+    M, F = sims.shape
+    dp = np.full((M, F), -np.inf, dtype=float)
+    dp[0, :] = sims[0, :]
+    for i in range(1, M):
+        prefix_max = np.maximum.accumulate(dp[i - 1, :])
+        for j in range(1, F):
+            dp[i, j] = sims[i, j] + prefix_max[j - 1]
+    return np.max(dp[-1, :]) / M
+
+
+def _score_shot(shot_path: str, sub_mat: np.ndarray, cache: Dict = embedding_cache):
+    """(frame_paths, DP score) của 1 shot với ma trận sub-query embeddings (M, D)."""
+    # === a) Parse Lxx, Vyyy
+    parts = shot_path.split('/')
+    Lxx, Vyyy = parts[-3], parts[-2]
+
+    # === b) Load frame_paths from shot_cache
+    frame_paths = shot_cache[shot_path]["frame_paths"]
+
+    # === c) Frame vectors từ embedding cache
+    npz_entry = cache[f"{Lxx}/{Vyyy}"]
+    path_to_idx = _path_index(npz_entry)
+    frame_embs = _frame_vectors(npz_entry, [path_to_idx[p] for p in frame_paths])
+
+    # === d) Similarity matrix (M, F) – 1 matmul float32 + DP
+    return frame_paths, _dp_align(sub_mat @ frame_embs.T)
+
+
+def encode_subqueries(query: str, embedder: CLIPEmbedder) -> np.ndarray:
+    """Tách query theo dấu '.' → ma trận sub-query embeddings (M, D) float32."""
+    sub_queries = [s.strip() for s in query.split('.') if s.strip()]
+    return np.stack([embedder.encode_text(sq).cpu().numpy() for sq in sub_queries]).astype(np.float32)
+
+
+def shot_item(shot_path: str, frame_paths: List[str], score: Optional[float]) -> Dict:
+    """Result dict của 1 shot: metadata + captions từ core_cache (score None = chưa chấm DP)."""
+    idx = core_cache["shot_row"][shot_path]
+    meta = core_cache["shot_meta"]
+    return {
+        "shot_path": shot_path,
+        "frame_paths": frame_paths,
+        "score": None if score is None else float(score),
+        "shot_id": int(meta["shot_id"][idx]),
+        "fps": float(meta["fps"][idx]),
+        "start_time": float(meta["start_time"][idx]),
+        "source": meta["source"][idx],
+        "end_time": float(meta["end_time"][idx]),
+        "blip_caption": core_cache["shot_blip"][idx],
+        "llm_caption": core_cache["shot_llm"][idx],
+        "tags": meta["tags"][idx]
+    }
+
+
+def score_shots(shot_paths: List[str], sub_mat: np.ndarray, progress: bool = False) -> List[Dict]:
+    """DP score + metadata của từng shot (chưa sort); shot lỗi bị bỏ qua kèm WARN."""
+    results: List[Dict] = []
+    shot_row = core_cache["shot_row"]
+    prefetch_rows([core_cache["shot_blip"], core_cache["shot_llm"]],
+                  [shot_row[p] for p in shot_paths if p in shot_row])
 
-def _print_timing(label: str, t0: float) -> None:
-    """In nhãn + thời gian, format gọn đẹp."""
-    dt = time.time() - t0
-    print(f"[⏱️] {label:<32}: {dt:7.4f}s")
+    timed = enabled()
+    for shot_path in (tqdm(shot_paths, desc="DP refinement") if progress else shot_paths):
+        try:
+            t0 = time.perf_counter() if timed else 0.0
+            frame_paths, final_score = _score_shot(shot_path, sub_mat)
+            if timed:   # histogram per shot thay cho print per shot
+                observe("stage2.dp_shot", time.perf_counter() - t0)
 
+            # === Get metadata and captions from core_cache
+            results.append(shot_item(shot_path, frame_paths, final_score))
+
+        except Exception as e:
+            count("stage2.failed_shots")
+            print(f"[WARN] Failed to process shot: {shot_path} — {e}")
+    return results
+
+
+@pinned
 def refine_shots_with_dp(
     shot_paths: List[str],
     query: str,
     embedder: CLIPEmbedder,
 ) -> List[Dict]:
 
-    # ---------- 1. Embed các sub-query ---------- #
-    start_total = time.time()
-    t_embed = time.time()
-    sub_queries = [s.strip() for s in query.split('.') if s.strip()]
-    sub_embs = [embedder.encode_text(sq).cpu().numpy() for sq in sub_queries]
-    M = len(sub_embs)
-    print(f"[⏱️] Embed subqueries ({M} parts): {time.time() - t_embed:.4f}s")
+    with span("stage2", shots=len(shot_paths)):
+        # ---------- 1. Embed các sub-query ---------- #
+        with span("stage2.embed") as sp:
+            sub_mat = encode_subqueries(query, embedder)
+            sp.set(subqueries=len(sub_mat))
 
-    results: List[Dict] = []
-    t_stage = time.time()
-
-    # ---------- 2. Lặp qua từng shot ---------- #
-    for shot_path in tqdm(shot_paths, desc="DP refinement"):
-        try:
-            t0 = time.time()
-
-            # === a) Parse Lxx, Vyyy, shot_id
-            parts = shot_path.split('/')
-            Lxx, Vyyy = parts[-3], parts[-2]
-            shot_id = int(parts[-1].replace("Shot_", "").replace(".mp4", ""))
-
-            # === b) Load frame_paths from shot_cache
-            t_json = time.time()
-            frame_paths = shot_cache[shot_path]["frame_paths"]
-            # print(f"[⏱ JSON ] {shot_path}: {time.time()-t_json:.4f}s")
-
-            # === c) Load NPZ vectors
-            t_npz = time.time()
-            key = f"{Lxx}/{Vyyy}"
-            npz_entry = embedding_cache[key]
-            path_to_idx = {p: i for i, p in enumerate(npz_entry["paths"])}
-            vectors = npz_entry["vectors"]
-            frame_embs = np.stack([vectors[path_to_idx[p]] for p in frame_paths])
-            # print(f"[⏱ NPZ  ] {shot_path}: {time.time()-t_npz:.4f}s")
-
-            # === d) Compute similarity matrix (M, F)
-            t_sim = time.time()
-            sims = np.vstack([frame_embs.dot(q_emb) for q_emb in sub_embs])
-            # print(f"[⏱ SIM  ] {shot_path}: {time.time()-t_sim:.4f}s")
-
-            # === e) DP alignment
-            t_dp = time.time()
-            M, F = sims.shape
-            dp = np.full((M, F), -np.inf, dtype=float)
-            dp[0, :] = sims[0, :]
-            for i in range(1, M):
-                prefix_max = np.maximum.accumulate(dp[i - 1, :])
-                for j in range(1, F):
-                    dp[i, j] = sims[i, j] + prefix_max[j - 1]
-            final_score = np.max(dp[-1, :]) / M
-            # print(f"[⏱ DP   ] {shot_path}: {time.time()-t_dp:.4f}s")
-
-            # === f) Get metadata and captions from core_cache
-            idx = core_cache["shot_paths"].index(shot_path)
-            meta = core_cache["shot_meta"]
-
-            results.append({
-                "shot_path": shot_path,
-                "frame_paths": frame_paths,
-                "score": float(final_score),
-                "shot_id": int(meta["shot_id"][idx]),
-                "fps": float(meta["fps"][idx]),
-                "start_time": float(meta["start_time"][idx]),
-                "source": meta["source"][idx],
-                "end_time": float(meta["end_time"][idx]),
-                "blip_caption": core_cache["shot_blip"][idx],
-                "llm_caption": core_cache["shot_llm"][idx],
-                "tags": core_cache["shot_meta"]["tags"][idx]
-            })
-
-        except Exception as e:
-            print(f"[WARN] Failed to process shot: {shot_path} — {e}")
-
-    print(f"[✅] Stage 2 total refinement time: {time.time() - start_total:.2f}s")
+        # ---------- 2. Lặp qua từng shot ---------- #
+        with span("stage2.dp", shots=len(shot_paths)), alloc_section("stage2.dp"):
+            results = score_shots(shot_paths, sub_mat, progress=True)
     return sorted(results, key=lambda x: x["score"], reverse=True)
-
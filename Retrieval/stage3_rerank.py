@@ -1,17 +1,16 @@
 from __future__ import annotations
 import json, time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict
-import streamlit as st
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from typing import List, Dict, Optional, Tuple, Union
 from openai import OpenAI
-from Retrieval.config import OPENAI_API_KEY, RE_RANK_PROMPT
+from Retrieval.config import (
+    OPENAI_API_KEY, RE_RANK_PROMPT, RERANK_BATCH_SIZE, RERANK_BUDGET_S, RERANK_CASCADE_WIDTH,
+    RERANK_CONFIDENT_SCORE, RERANK_MAX_CALLS, RERANK_MIN_CONFIDENT,
+)
+from Retrieval.telemetry import count, in_span, span
 
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
-def _print_timing(label: str, t0: float) -> None:
-    dt = time.time() - t0
-    print(f"[⏱️] {label:<32}: {dt:7.4f}s")
-
 
 # ---------- helper ---------- #
 def _format_batch(batch: List[Dict]) -> str:
@@ -39,66 +38,164 @@ def _build_prompt(query: str, items_json: str, search_type: str) -> str:
 
 def _call_openai(query: str, batch: List[Dict], bid: int, search_type: str) -> List[Dict]:
     prompt = _build_prompt(query, _format_batch(batch), search_type)
+    count("stage3.llm_calls")
     try:
-        t0 = time.time()
-        resp = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-        )
-        _print_timing(f"Batch {bid} – OpenAI call", t0)
+        with span("stage3.llm_call", batch=bid, items=len(batch)):
+            resp = openai_client.chat.completions.create(
+                model="gpt-4o",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0,
+            )
 
         content = resp.choices[0].message.content.strip()
         # print(f"Response: {content}")
         if not content.startswith("["):
             print(f"[] Batch {bid}: Unexpected output, skip.")
+            count("stage3.llm_failures")
             return []
         return json.loads(content)
     except Exception as e:
         print(f" Batch {bid} failed: {e}")
+        count("stage3.llm_failures")
         return []
 
 
+def merge_reranked(merged: List[Dict], items: List[Dict]) -> List[Dict]:
+    """Output LLM ({path, score, explanation}) → items gốc kèm bge_score / bge_explanation, đã sort."""
+    path2orig = {it.get("shot_path") or it.get("frame_path"): it for it in items}
+    final: List[Dict] = []
+    for entry in sorted(merged, key=lambda x: x["score"], reverse=True):
+        orig = path2orig.get(entry["path"])
+        if orig:
+            enriched = orig.copy()
+            enriched["bge_score"] = entry["score"]
+            enriched["bge_explanation"] = entry.get("explanation", "")
+            final.append(enriched)
+    return final
+
+
 def rerank_with_openai_parallel(
     query: str,
     items: List[Dict],
     *,
     top_k_rerank: int,
     max_workers: int,
-    search_type: str
-) -> List[Dict]:
+    search_type: str,
+    min_confident: int = RERANK_MIN_CONFIDENT,
+    confident_score: float = RERANK_CONFIDENT_SCORE,
+    max_calls: Optional[int] = RERANK_MAX_CALLS,
+    budget_s: Optional[float] = RERANK_BUDGET_S,
+    return_stats: bool = False,
+) -> Union[List[Dict], Tuple[List[Dict], Dict]]:
+    """
+    Rerank top_k_rerank items bằng LLM (batch RERANK_BATCH_SIZE, song song).
+    min_confident / max_calls / budget_s → chuyển sang cascade (rerank_with_openai_cascade).
+    return_stats=True → (kết quả, stats) – stats như của cascade (calls / avoided / stop ...).
+    """
+    if min_confident or max_calls is not None or budget_s is not None:
+        final, stats = rerank_with_openai_cascade(
+            query, items, top_k_rerank=top_k_rerank, max_workers=max_workers, search_type=search_type,
+            min_confident=min_confident, confident_score=confident_score,
+            max_calls=max_calls, budget_s=budget_s,
+        )
+        return (final, stats) if return_stats else final
 
     t_total = time.time()
-
     candidates = items[:top_k_rerank]
-    batches = [candidates[i : i + 5] for i in range(0, len(candidates), 5)]
+    batches = [candidates[i : i + RERANK_BATCH_SIZE] for i in range(0, len(candidates), RERANK_BATCH_SIZE)]
     print(f"[🚀] Rerank {len(candidates)} items → {len(batches)} batches")
 
-    merged: List[Dict] = []
-    t_api = time.time()
-    with ThreadPoolExecutor(max_workers=max_workers) as ex:
-        futs = {}
+    with span("stage3", items=len(candidates), batches=len(batches)):
+        merged: List[Dict] = []
+        with span("stage3.llm_all"), ThreadPoolExecutor(max_workers=max_workers) as ex:
+            futs = {}
 
-        for i, batch in enumerate(batches):
-            future = ex.submit(_call_openai, query, batch, i, search_type)
-            futs[future] = i
+            for i, batch in enumerate(batches):
+                future = ex.submit(in_span(_call_openai), query, batch, i, search_type)
+                futs[future] = i
 
-        for fut in as_completed(futs):
-            merged.extend(fut.result())
-    _print_timing("All OpenAI API calls (total)", t_api)
+            for fut in as_completed(futs):
+                merged.extend(fut.result())
 
-    path2orig = {it.get("shot_path") or it.get("frame_path"): it for it in items}
+        with span("stage3.merge"):
+            final = merge_reranked(merged, items)
+    if not return_stats:
+        return final
+    return final, {"batches": len(batches), "calls": len(batches), "avoided": 0, "abandoned": 0,
+                   "confident": None, "stop": "exhausted", "elapsed": time.time() - t_total}
 
-    t_merge = time.time()
-    final: List[Dict] = []
-    for entry in sorted(merged, key=lambda x: x["score"], reverse=True):
-        orig = path2orig.get(entry["path"])
-        if orig:
-            enriched = orig.copy()
-            enriched["bge_score"] = entry["score"]
-            enriched["bge_explanation"] = entry.get("explanation", "")
-            final.append(enriched)
-    _print_timing("Merge & sort results", t_merge)
 
-    _print_timing("Stage 3 – TOTAL", t_total)
-    return final
+def rerank_with_openai_cascade(
+    query: str,
+    items: List[Dict],
+    *,
+    top_k_rerank: int,
+    max_workers: int,
+    search_type: str,
+    min_confident: int = RERANK_MIN_CONFIDENT,
+    confident_score: float = RERANK_CONFIDENT_SCORE,
+    max_calls: Optional[int] = RERANK_MAX_CALLS,
+    budget_s: Optional[float] = RERANK_BUDGET_S,
+    width: int = RERANK_CASCADE_WIDTH,
+) -> Tuple[List[Dict], Dict]:
+    """
+    Cascade: gửi batch theo thứ tự score upstream giảm dần, tối đa `width` batch cùng lúc khi dừng
+    theo min_confident (ít batch "đoán trước" bị bỏ); chỉ có max_calls / budget_s → max_workers batch.
+    Dừng (huỷ các batch chưa gửi, bỏ các batch đang chạy) khi:
+      • đã có `min_confident` kết quả có score >= confident_score   (stop = "confident")
+      • đã gửi `max_calls` batch                                    (stop = "max_calls")
+      • hết `budget_s` giây                                         (stop = "budget")
+    → (kết quả đã merge + sort, stats {batches, calls, avoided, abandoned, confident, stop, elapsed}).
+    """
+    with span("stage3.cascade", items=min(len(items), top_k_rerank)) as sp:
+        t_total = time.time()
+        candidates = sorted(items[:top_k_rerank], key=lambda x: x.get("score", 0.0), reverse=True)
+        batches = [candidates[i : i + RERANK_BATCH_SIZE] for i in range(0, len(candidates), RERANK_BATCH_SIZE)]
+        limit = len(batches) if max_calls is None else min(max_calls, len(batches))
+        deadline = None if budget_s is None else t_total + budget_s
+
+        merged: List[Dict] = []
+        confident, sent, stop = 0, 0, "exhausted"
+        running: Dict = {}
+        workers = max(1, min(width, max_workers) if min_confident else max_workers)
+        ex = ThreadPoolExecutor(max_workers=workers)
+        try:
+            while True:
+                while sent < limit and len(running) < workers:
+                    running[ex.submit(in_span(_call_openai), query, batches[sent], sent, search_type)] = sent
+                    sent += 1
+                if not running:
+                    if sent < len(batches):
+                        stop = "max_calls"
+                    break
+                timeout = None if deadline is None else max(0.0, deadline - time.time())
+                done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    running.pop(fut)
+                    out = fut.result()
+                    merged.extend(out)
+                    confident += sum(1 for e in out if e.get("score", 0) >= confident_score)
+                if min_confident and confident >= min_confident:
+                    stop = "confident"
+                    break
+                if deadline is not None and time.time() >= deadline:
+                    stop = "budget"
+                    break
+        finally:
+            ex.shutdown(wait=False, cancel_futures=True)   # batch đang chạy: kết quả bị bỏ qua
+
+        stats = {
+            "batches": len(batches),
+            "calls": sent,
+            "avoided": len(batches) - sent,
+            "abandoned": len(running),
+            "confident": confident,
+            "stop": stop,
+            "elapsed": time.time() - t_total,
+        }
+        print(f"[✂️] Cascade rerank: {sent}/{len(batches)} LLM calls ({stats['avoided']} avoided, "
+              f"{stats['abandoned']} abandoned) – stop: {stop}, {confident} confident")
+        final = merge_reranked(merged, items)
+        sp.set(**{k: v for k, v in stats.items() if k != "elapsed"})
+    count("stage3.llm_avoided", stats["avoided"])
+    return final, stats
@@ -0,0 +1,168 @@
+"""
+Chạy các cache loader (tuần tự hoặc song song) và đo thời gian khởi động.
+
+Mỗi loader:
+    input_bytes           tổng kích thước các file đầu vào – KHÔNG phải số byte đọc: loader mmap,
+                          caption lazy, bỏ qua shard hay IO_FLAG_MMAP đọc ít hơn nhiều
+    rchar / read_bytes    I/O thật của thread chạy loader (/proc/thread-self/io): rchar = byte qua
+                          read() (kể cả page cache), read_bytes = byte lấy từ storage (kể cả page
+                          fault của mmap; 0 khi file đã nằm trong page cache)
+    peak_rss_delta_bytes  RSS lớn nhất lấy mẫu trong lúc loader chạy − RSS lúc bắt đầu
+Tổng: wall time, I/O của process (/proc/self/io), peak RSS và loader chậm nhất – các
+loader độc lập nhau nên đó là giới hạn dưới của cold start song song.
+
+Lưu ý: ở chế độ song song, peak RSS delta của các loader chạy chồng nhau gồm cả bộ nhớ
+của loader khác nên chỉ mang tính tham khảo; I/O theo thread thì không bị ảnh hưởng (trừ
+I/O do thread phụ mà loader tự tạo).
+"""
+
+from __future__ import annotations
+import contextvars
+import json
+import os
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+
+@dataclass
+class Loader:
+    name: str
+    fn: Callable[[], None]
+    inputs: Callable[[], List[str]] = lambda: []
+
+
+# ---------- 1. Process counters ---------- #
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+def _peak_rss_bytes() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux: KiB
+
+
+def _proc_io(path: str = "/proc/self/io") -> Dict[str, int]:
+    try:
+        with open(path) as f:
+            return {k: int(v) for k, v in (line.split(":") for line in f)}
+    except OSError:
+        return {}
+
+
+def _input_bytes(paths: List[str]) -> int:
+    return sum(os.path.getsize(p) for p in paths if os.path.isfile(p))
+
+
+# ---------- 2. Peak RSS sampler ---------- #
+class _RssSampler:
+    """Thread lấy mẫu RSS mỗi `interval_s`; ghi nhận RSS lớn nhất cho mọi loader đang chạy."""
+
+    def __init__(self, interval_s: float = 0.01):
+        self.interval_s = interval_s
+        self._peaks: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="rss-sampler", daemon=True)
+
+    def _sample(self) -> int:
+        rss = _rss_bytes()
+        with self._lock:
+            for name, peak in self._peaks.items():
+                self._peaks[name] = max(peak, rss)
+        return rss
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            self._sample()
+
+    def begin(self, name: str) -> int:
+        rss = _rss_bytes()
+        with self._lock:
+            self._peaks[name] = rss
+        return rss
+
+    def end(self, name: str) -> int:
+        self._sample()
+        with self._lock:
+            return self._peaks.pop(name)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+# ---------- 3. Runner ---------- #
+def run_loaders(loaders: List[Loader], parallel: bool = False) -> Dict:
+    t0 = time.perf_counter()
+    io0 = _proc_io()
+    lock = threading.Lock()
+    records: List[Dict] = []
+
+    def _run(ld: Loader, sampler: _RssSampler):
+        rss0, start = sampler.begin(ld.name), time.perf_counter()
+        tio0 = _proc_io("/proc/thread-self/io")   # loader chạy trọn trên thread này
+        try:
+            ld.fn()
+        finally:
+            peak = sampler.end(ld.name)
+        end = time.perf_counter()
+        tio1 = _proc_io("/proc/thread-self/io")
+        rec = {
+            "name": ld.name,
+            "start_s": start - t0,
+            "wall_s": end - start,
+            "input_bytes": _input_bytes(ld.inputs()),
+            **{k: tio1[k] - tio0.get(k, 0) for k in ("rchar", "read_bytes") if k in tio1},
+            "rss_delta_bytes": _rss_bytes() - rss0,
+            "peak_rss_delta_bytes": peak - rss0,
+        }
+        with lock:
+            records.append(rec)
+
+    with _RssSampler() as sampler:
+        if parallel:
+            # thread: loader ghi vào cache dict của process; FAISS / numpy / file I/O nhả GIL
+            with ThreadPoolExecutor(len(loaders) or 1, thread_name_prefix="preload") as ex:
+                # copy_context: loader ghi vào snapshot đang build (Retrieval.snapshot.activate)
+                for fut in [ex.submit(contextvars.copy_context().run, _run, ld, sampler) for ld in loaders]:
+                    fut.result()
+        else:
+            for ld in loaders:
+                _run(ld, sampler)
+
+    io1 = _proc_io()
+    records.sort(key=lambda r: r["start_s"])
+    slowest = max(records, key=lambda r: r["wall_s"], default=None)
+    return {
+        "mode": "parallel" if parallel else "sequential",
+        "wall_s": time.perf_counter() - t0,
+        "slowest_loader": {"name": slowest["name"], "seconds": slowest["wall_s"]} if slowest else None,
+        "loaders": records,
+        "io": {k: io1[k] - io0.get(k, 0) for k in ("rchar", "read_bytes") if k in io1},
+        "peak_rss_bytes": _peak_rss_bytes(),
+    }
+
+
+def print_report(report: Dict, path: Optional[str] = None) -> None:
+    print(f"\n=== Startup ({report['mode']}) : {report['wall_s']:.2f}s ===")
+    for r in report["loaders"]:
+        print(f"   • {r['name']:<14} start {r['start_s']:7.2f}s  wall {r['wall_s']:7.2f}s  "
+              f"files {r['input_bytes'] / 2**20:9.1f} MiB  read() {r.get('rchar', 0) / 2**20:9.1f} MiB  "
+              f"disk {r.get('read_bytes', 0) / 2**20:9.1f} MiB  peak ΔRSS {r['peak_rss_delta_bytes'] / 2**20:9.1f} MiB")
+    slowest = report["slowest_loader"]
+    print(f"[⏱️] Slowest loader: {slowest['name'] if slowest else '-'} "
+          f"({slowest['seconds'] if slowest else 0.0:.2f}s) | peak RSS {report['peak_rss_bytes'] / 2**30:.2f} GiB")
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
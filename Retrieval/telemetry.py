@@ -0,0 +1,223 @@
+"""
+Tracing + metrics nhẹ cho pipeline (thay cho các print "[⏱️] ..." rải rác).
+
+    with span("stage1.search", queries=3) as sp:     # span lồng nhau (theo contextvar)
+        ...
+        sp.set(candidates=120)
+
+    @traced("stage2")                                 # decorator
+    count("stage3.llm_calls")                         # counter
+    observe("stage2.dp_shot", seconds)                # histogram (không tạo span – dùng cho vòng lặp nóng)
+
+Mỗi span khi kết thúc được ghi vào histogram cùng tên; span có độ sâu < TELEMETRY_PRINT_DEPTH
+được in ra như trước ("[⏱️] name : 0.1234s"). Span gốc kết thúc → cả cây được ghi 1 dòng JSON
+vào TELEMETRY_JSONL (nếu đặt). prometheus_text() → text format cho /metrics.
+
+Tắt (TELEMETRY=0 hoặc enable(False)): span() trả về 1 object no-op dùng chung, count/observe
+return ngay – chi phí chỉ là 1 lời gọi hàm + 1 phép kiểm tra bool.
+"""
+
+from __future__ import annotations
+import bisect
+import contextvars
+import functools
+import itertools
+import json
+import threading
+import time
+from typing import Dict, List, Optional
+
+from Retrieval.config import TELEMETRY, TELEMETRY_JSONL, TELEMETRY_PRINT_DEPTH
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_enabled = TELEMETRY
+_jsonl_path: Optional[str] = TELEMETRY_JSONL
+_print_depth = TELEMETRY_PRINT_DEPTH
+_current: contextvars.ContextVar[Optional["_Span"]] = contextvars.ContextVar("telemetry_span", default=None)
+_trace_ids = itertools.count(1)
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_histograms: Dict[str, "_Histogram"] = {}
+
+
+# ---------- 1. Config ---------- #
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(on: bool = True, jsonl_path: Optional[str] = None, print_depth: Optional[int] = None) -> None:
+    """Bật / tắt lúc runtime; jsonl_path / print_depth thay giá trị trong config."""
+    global _enabled, _jsonl_path, _print_depth
+    _enabled = on
+    if jsonl_path is not None:
+        _jsonl_path = jsonl_path
+    if print_depth is not None:
+        _print_depth = print_depth
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+# ---------- 2. Metrics ---------- #
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # bucket cuối = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def count(name: str, n: float = 1) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def observe(name: str, seconds: float) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = _Histogram()
+        hist.add(seconds)
+
+
+def metrics() -> Dict:
+    """{"counters": {name: value}, "histograms": {name: {count, sum, mean, buckets}}}."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "histograms": {
+                name: {"count": h.count, "sum": h.sum, "mean": h.sum / h.count if h.count else 0.0,
+                       "buckets": dict(zip([*map(str, BUCKETS), "+Inf"], itertools.accumulate(h.counts)))}
+                for name, h in _histograms.items()
+            },
+        }
+
+
+# ---------- 3. Spans ---------- #
+class _Span:
+    __slots__ = ("name", "attrs", "parent", "children", "depth", "trace", "start", "duration", "_token")
+
+    def __init__(self, name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+        self.parent = _current.get()
+        self.children: List[_Span] = []
+        self.depth = 0 if self.parent is None else self.parent.depth + 1
+        self.trace = next(_trace_ids) if self.parent is None else self.parent.trace
+        self.duration = 0.0
+
+    def set(self, **attrs) -> "_Span":
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self) -> "_Span":
+        self._token = _current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.duration = time.perf_counter() - self.start
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        observe(self.name, self.duration)
+        if self.depth < _print_depth:
+            print(f"[⏱️] {'  ' * self.depth}{self.name:<32}: {self.duration:7.4f}s")
+        if self.parent is not None:
+            self.parent.children.append(self)
+        elif _jsonl_path:
+            _write_trace(self)
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "duration": self.duration, "attrs": self.attrs,
+                "children": [c.to_dict() for c in self.children]}
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs) -> "_NoopSpan":
+        return self
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """Context manager đo 1 bước; lồng vào span đang mở (cùng thread / context)."""
+    if not _enabled:
+        return _NOOP
+    return _Span(name, attrs)
+
+
+def traced(name: str):
+    """Decorator: cả hàm là 1 span."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def in_span(fn):
+    """fn gắn với context hiện tại (span đang mở làm cha) – gọi lúc submit: ex.submit(in_span(fn), ...)."""
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+# ---------- 4. Export ---------- #
+def _write_trace(root: _Span) -> None:
+    line = json.dumps({"trace": root.trace, "ts": time.time(), **root.to_dict()},
+                      ensure_ascii=False, default=str)
+    with _lock, open(_jsonl_path, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+def _metric_name(name: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus_text(prefix: str = "retrieval") -> str:
+    """Counters + histograms ở Prometheus text exposition format."""
+    snap = metrics()
+    lines: List[str] = []
+    for name, value in sorted(snap["counters"].items()):
+        metric = f"{prefix}_{_metric_name(name)}_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    if snap["histograms"]:
+        metric = f"{prefix}_span_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for name, h in sorted(snap["histograms"].items()):
+            for le, n in h["buckets"].items():
+                lines.append(f'{metric}_bucket{{span="{name}",le="{le}"}} {n}')
+            lines.append(f'{metric}_sum{{span="{name}"}} {h["sum"]}')
+            lines.append(f'{metric}_count{{span="{name}"}} {h["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
@@ -1,9 +1,15 @@
+import os
+import time
+import uuid
+from contextlib import nullcontext
 import streamlit as st
-from Retrieval.cache_loader import preload_all_caches
-from Retrieval.embedder import CLIPEmbedder
 from Retrieval.auto_mode import agentic 
-from Retrieval.stage1 import stage1_retrieve_shots
-from Retrieval.stage2_dp import refine_shots_with_dp
+from frontend.backend import (
+    remote, client, stage1_retrieve_shots, refine_shots_with_dp, search_page, next_page, stream_search
+)
+from Retrieval.config import DEDUPE_THRESHOLD, PROFILE_DIR
+from Retrieval.profiling import profile_session, profile_stage
+from Retrieval.stage1 import merge_frame_results
 from frontend.stage1_ui import render_stage1_block
 from frontend.stage2_ui import render_stage2_block
 from frontend.stage3_ui import render_stage3_block
@@ -12,6 +18,7 @@ from frontend.stage3_ui import render_stage3_block
 auto_agent_enabled = True  
 if auto_agent_enabled:
     try:
+        from Retrieval.auto_mode import agentic  # noqa: F811
     except Exception as e:
         auto_agent_enabled = False
         st.warning(
@@ -20,11 +27,103 @@ if auto_agent_enabled:
 
 @st.cache_resource
 def init_resources():
-    """Load FAISS, TF‑IDF, HDF5 and return a shared CLIP embedder."""
+    """Load FAISS, TF‑IDF, HDF5 and return a shared CLIP embedder (None khi dùng search service)."""
+    if remote:
+        client.wait_ready()
+        return None
+
+    from Retrieval.cache_loader import preload_all_caches, start_hot_reload
+    from Retrieval.config import HOT_RELOAD
+    from Retrieval.embedder import CLIPEmbedder
     preload_all_caches()
+    if HOT_RELOAD:
+        start_hot_reload()
     return CLIPEmbedder()
 
 
+# Helper – Stage 1 pagination (cursor giữ ở server / process, xem Retrieval.pagination)
+def _stage1_paged(sub_queries, search_type: str, search_method: str, page_size: int, embedder):
+    key = (tuple(sub_queries), search_type, search_method, page_size)
+    pages = st.session_state.get("stage1_pages")
+    if pages is None or pages["key"] != key:
+        cursors, results = [], []
+        for q in sub_queries:
+            page = search_page(q, embedder, search_type=search_type, type_search=search_method,
+                               page_size=page_size)
+            cursors.append(page["cursor"])
+            results.extend(page["results"])
+        pages = st.session_state.stage1_pages = {"key": key, "cursors": cursors, "results": results}
+    return pages["results"]
+
+
+def _stage1_load_more(page_size: int):
+    pages = st.session_state.stage1_pages
+    for i, cursor in enumerate(pages["cursors"]):
+        if cursor is None:
+            continue
+        try:
+            page = next_page(cursor, page_size=page_size)
+        except Exception as e:   # cursor hết hạn → search lại từ đầu ở lần chạy sau
+            st.warning(f"Cursor expired: {e}")
+            st.session_state.pop("stage1_pages", None)
+            return
+        pages["cursors"][i] = page["cursor"]
+        pages["results"].extend(page["results"])
+
+
+# Helper – streaming Stage 1 → 2 → 3 (Retrieval.pipeline): hiện top hiện tại trong lúc chạy
+def _execute_streaming(*, query_description, sub_queries, full_query, top_k1, search_method,
+                       top_m2, enable_s3, top_k3, embedder, deadline_ms=None):
+    key = ("stream", tuple(sub_queries), full_query, query_description if enable_s3 else None,
+           top_k1, search_method, top_m2, top_k3, deadline_ms)
+    done = st.session_state.get("stream_done")
+    if done is None or done["key"] != key:
+        status, live = st.empty(), st.empty()
+        stage2_results = []
+        for ev in stream_search(
+            sub_queries, embedder,
+            search_type="frame",
+            type_search=search_method,
+            top_k=top_k1,
+            refine_query=full_query,
+            top_m=top_m2,
+            rerank_query=query_description if enable_s3 else None,
+            top_k_rerank=top_k3,
+            max_workers=16,
+            deadline_ms=deadline_ms,
+        ):
+            if ev["event"] == "done":
+                break
+            if ev["event"] == "stage2":
+                stage2_results = ev["results"]
+            if "results" in ev:
+                status.text(f"[{ev['t']:.2f}s] {ev['event']} – {len(ev['results'])} ranked")
+                live.dataframe(
+                    [{"shot": r["shot_path"], "score": r["score"], "bge_score": r.get("bge_score")}
+                     for r in ev["results"]],
+                    use_container_width=True,
+                )
+        status.empty()
+        live.empty()
+        # không có Stage 3: kết quả cuối (gồm cả shot chưa kịp chấm khi hết deadline) là view Stage 2
+        done = st.session_state.stream_done = {"key": key, "event": ev,
+                                               "stage2": stage2_results if enable_s3 else ev["results"]}
+
+    ev = done["event"]
+    c1, c2 = st.columns(2)
+    c1.metric("Time to first result", f"{ev['ttfr']:.2f}s")
+    c2.metric("Total latency", f"{ev['total']:.2f}s")
+    if ev["deadline_hit"]:
+        skipped = [k for k, v in ev["stages_completed"].items() if not v]
+        st.warning(f"Deadline {deadline_ms:.0f}ms reached – partial results for: {', '.join(skipped) or 'none'}")
+    st.header("Stage 2 – DP Refinement")
+    render_stage2_block(results=done["stage2"], query=full_query, embedder=embedder, top_m=top_m2)
+    if enable_s3:
+        st.header("Stage 3 – LLM Re‑rank")
+        render_stage3_block(items=done["stage2"], query=query_description, top_k_rerank=top_k3,
+                            max_workers=16, search_type="frame", results=ev["results"])
+
+
 # Helper – run the three‑stage pipeline 
 
 def _execute_search(
@@ -40,29 +139,61 @@ def _execute_search(
     enable_s3: bool,
     top_k3: int,
     embedder,
+    dedupe_threshold: float = DEDUPE_THRESHOLD,
+    min_score=None,
+    cutoff=None,
+    stream: bool = False,
+    min_confident: int = 0,
+    deadline_ms=None,
 ):
 
     if search_type == "shot" and search_method == "ocr":
         st.error(" OCR chưa được hỗ trợ ở cấp độ shot. Vui lòng chọn 'frame' hoặc phương pháp tìm kiếm khác.")
         return
 
+    # deadline chỉ được streaming pipeline áp dụng → các trường hợp khác phải báo rõ là bị bỏ qua
+    not_streamable = [reason for reason, blocked in (
+        ("remote search service", stream_search is None),
+        ("Stage 2 off", not enable_s2),
+        ("shot-level search", search_type != "frame"),
+        ("near-duplicate threshold", bool(dedupe_threshold)),
+        ("min score", bool(min_score)),
+        ("adaptive cutoff", bool(cutoff)),
+    ) if blocked]
+    if deadline_ms and not_streamable:
+        st.warning(f"Deadline {deadline_ms:.0f}ms ignored – only the streaming pipeline enforces it, "
+                   f"which is not used with: {', '.join(not_streamable)}")
+
     if enable_s2:
         if search_type == "frame":
             sub_queries = [s.strip() for s in query.split(".") if s.strip()]
+            if (stream or deadline_ms) and not not_streamable:
+                with profile_stage("pipeline"):
+                    _execute_streaming(
+                        query_description=query_description, sub_queries=sub_queries, full_query=full_query,
+                        top_k1=top_k1, search_method=search_method, top_m2=top_m2,
+                        enable_s3=enable_s3, top_k3=top_k3, embedder=embedder, deadline_ms=deadline_ms,
+                    )
+                return
             full_shot_paths = []
-            for q in sub_queries:
-                result = stage1_retrieve_shots(
-                    query=q,
-                    embedder=embedder,
-                    search_type=search_type,
-                    top_k=top_k1,
-                    type_search=search_method,
-                    refine_stage2=True,
-                )
-                full_shot_paths.extend(result)
+            with profile_stage("stage1"):
+                for q in sub_queries:
+                    result = stage1_retrieve_shots(
+                        query=q,
+                        embedder=embedder,
+                        search_type=search_type,
+                        top_k=top_k1,
+                        type_search=search_method,
+                        refine_stage2=True,
+                        dedupe_threshold=dedupe_threshold,
+                        min_score=min_score,
+                        cutoff=cutoff,
+                    )
+                    full_shot_paths.extend(result)
             shot_paths = list(dict.fromkeys(full_shot_paths))  # order‑preserving unique
             st.header("Stage 2 – DP Refinement")
-            stage2_results = refine_shots_with_dp(shot_paths, full_query, embedder)
+            with profile_stage("stage2"):
+                stage2_results = refine_shots_with_dp(shot_paths, full_query, embedder)
             render_stage2_block(
                 results=stage2_results,
                 query=full_query,
@@ -76,66 +207,57 @@ def _execute_search(
     else:
         # ------------------------ Stage‑1 UI (frame OR shot) -----------------
         st.header("Stage 1 – Retrieval")
-        if search_type == "frame":
-            sub_queries = [s.strip() for s in query.split(".") if s.strip()]
-            results = []
-            for q in sub_queries:
-                result = stage1_retrieve_shots(
-                    query=q,
-                    embedder=embedder,
-                    search_type=search_type,
-                    top_k=top_k1,
-                    type_search=search_method,
-                    refine_stage2=False,
-                )
-                results.extend(result)
-
-            frame_dict = {}
-            for item in results:
-                fp = item["frame_path"]
-                if fp not in frame_dict or item["score"] > frame_dict[fp]["score"]:
-                    frame_dict[fp] = item
-            stage1_results = sorted(frame_dict.values(), key=lambda x: x["score"], reverse=True)
-            render_stage1_block(
-                query=query,
-                top_k=top_k1,
-                search_type=search_type,
-                type_search=search_method,
-                embedder=embedder,
-                refine_stage2=False,
-                results=stage1_results,
-            )
-            items_for_stage3 = stage1_results
-        else:  
-            stage1_results = stage1_retrieve_shots(
-                query=query,
-                embedder=embedder,
-                search_type=search_type,
-                top_k=top_k1,
-                type_search=search_method,
-                refine_stage2=False,
-            )
-            render_stage1_block(
-                query=query,
-                top_k=top_k1,
-                search_type=search_type,
-                type_search=search_method,
-                embedder=embedder,
-                refine_stage2=False,
-                results=stage1_results,
-            )
-            items_for_stage3 = stage1_results
+        sub_queries = (
+            [s.strip() for s in query.split(".") if s.strip()] if search_type == "frame" else [query]
+        )
+        paged = not (dedupe_threshold or min_score or cutoff)
+        with profile_stage("stage1"):
+            if paged:
+                # cursor pagination: rerun / "Load more" dùng lại kết quả + cursor trong session
+                results = _stage1_paged(sub_queries, search_type, search_method, top_k1, embedder)
+            else:
+                results = []
+                for q in sub_queries:
+                    results.extend(stage1_retrieve_shots(
+                        query=q,
+                        embedder=embedder,
+                        search_type=search_type,
+                        top_k=top_k1,
+                        type_search=search_method,
+                        refine_stage2=False,
+                        dedupe_threshold=dedupe_threshold,
+                        min_score=min_score,
+                        cutoff=cutoff,
+                    ))
+
+        stage1_results = merge_frame_results(results) if search_type == "frame" else results
+        render_stage1_block(
+            query=query,
+            top_k=top_k1,
+            search_type=search_type,
+            type_search=search_method,
+            embedder=embedder,
+            refine_stage2=False,
+            results=stage1_results,
+        )
+        if paged and any(st.session_state.stage1_pages["cursors"]):
+            if st.button("⬇️ Load more", use_container_width=True):
+                _stage1_load_more(top_k1)
+                st.rerun()
+        items_for_stage3 = stage1_results
 
     # ------------------------------ Stage‑3 ---------------------------------
     if enable_s3:
         st.header("Stage 3 – LLM Re‑rank")
-        render_stage3_block(
-            items=items_for_stage3,
-            query=query_description,
-            top_k_rerank=top_k3,
-            max_workers=16,
-            search_type=search_type,
-        )
+        with profile_stage("stage3"):
+            render_stage3_block(
+                items=items_for_stage3,
+                query=query_description,
+                top_k_rerank=top_k3,
+                max_workers=16,
+                search_type=search_type,
+                min_confident=min_confident,
+            )
 
 # interaction mode
 def _render_interactive(embedder):
@@ -154,13 +276,34 @@ def _render_interactive(embedder):
         query = st.text_input("Query")
         top_k1 = st.number_input("Top‑k (Stage 1)", min_value=1, value=50, step=1)
         search_type = st.selectbox("Search Level", ["frame", "shot"])
-        search_method = st.selectbox("Search Method", ["clip", "llm_caption", "blip_caption", "ocr"])
+        search_method = st.selectbox(
+            "Search Method",
+            ["clip", "llm_caption", "blip_caption", "ocr", "clip_exact", "llm_caption_exact", "blip_caption_exact"],
+        )
 
         st.header("Stage Controls")
         enable_s2 = st.checkbox("Enable Stage 2 (DP Refinement)", value=False)
         top_m2 = st.number_input("Top‑m (Stage 2)", min_value=1, value=20, step=1)
         enable_s3 = st.checkbox("Enable Stage 3 (LLM Re‑rank)", value=False)
         top_k3 = st.number_input("Top‑k (Stage 3)", min_value=1, value=20, step=1)
+        min_confident = st.number_input(
+            "Stage 3 early stop: confident results (0 = rerank all)", min_value=0, value=0, step=1,
+        )
+        dedupe_threshold = st.number_input(
+            "Near-duplicate threshold (0 = off)", min_value=0.0, max_value=1.0,
+            value=float(DEDUPE_THRESHOLD), step=0.01,
+        )
+        min_score = st.number_input("Min score – range mode (0 = off)", value=0.0, step=0.01)
+        cutoff = st.selectbox("Adaptive cutoff", ["off", "knee", "gap"])
+        stream = st.checkbox(
+            "Streaming pipeline (Stage 2/3 start on early Stage 1 chunks)", value=False,
+            disabled=stream_search is None,
+        )
+        deadline_ms = st.number_input(
+            "Deadline ms (0 = off, streaming pipeline only)", min_value=0, value=0, step=500,
+            disabled=stream_search is None,
+        )
+        profile = st.checkbox("Profile this run (cProfile + flamegraph + tracemalloc)", value=False)
 
         run_interactive = st.form_submit_button("Run Search")
         if run_interactive:
@@ -174,19 +317,36 @@ def _render_interactive(embedder):
         st.info("🚀 Nhấn **Run Search** để bắt đầu.")
         return False
 
-    _execute_search(
-        query_description = query_description,
-        query=query,
-        full_query=full_query,
-        top_k1=top_k1,
-        search_type=search_type,
-        search_method=search_method,
-        enable_s2=enable_s2,
-        top_m2=top_m2,
-        enable_s3=enable_s3,
-        top_k3=top_k3,
-        embedder=embedder,
-    )
+    # chỉ profile lần bấm Run Search (không profile các rerun do widget / Load more)
+    profile = profile and run_interactive
+    if profile:
+        st.session_state.profile_dir = os.path.join(
+            PROFILE_DIR, time.strftime("%Y%m%d-%H%M%S") + f"-{uuid.uuid4().hex[:6]}")
+    with profile_session(st.session_state.profile_dir) if profile else nullcontext():
+        _execute_search(
+            query_description = query_description,
+            query=query,
+            full_query=full_query,
+            top_k1=top_k1,
+            search_type=search_type,
+            search_method=search_method,
+            enable_s2=enable_s2,
+            top_m2=top_m2,
+            enable_s3=enable_s3,
+            top_k3=top_k3,
+            embedder=embedder,
+            dedupe_threshold=dedupe_threshold,
+            min_score=min_score or None,
+            cutoff=None if cutoff == "off" else cutoff,
+            stream=stream,
+            min_confident=int(min_confident),
+            deadline_ms=float(deadline_ms) or None,
+        )
+    profile_dir = st.session_state.get("profile_dir")
+    if profile_dir:
+        with st.expander(f"🔬 Profile – {profile_dir}", expanded=profile):
+            st.text(open(os.path.join(profile_dir, "summary.txt"), encoding="utf-8").read())
+
     return True
 
 
@@ -232,6 +392,8 @@ def _render_automatic(embedder):
         enable_s3=bool(params.get("enable_s3", False)),
         top_k3=int(params.get("top_k3", 50)),
         embedder=embedder,
+        min_score=params.get("min_score"),
+        cutoff=params.get("cutoff"),
     )
     return True
 
@@ -0,0 +1,26 @@
+"""
+Chọn backend cho UI: gọi Retrieval.service (SEARCH_SERVICE_URL) hoặc chạy local.
+Các hàm export có cùng chữ ký trong cả hai trường hợp.
+"""
+
+from Retrieval.config import SEARCH_SERVICE_URL
+
+remote = bool(SEARCH_SERVICE_URL)
+
+if remote:
+    from Retrieval.client import SearchClient
+
+    client = SearchClient(SEARCH_SERVICE_URL)
+    stage1_retrieve_shots = client.stage1_retrieve_shots
+    refine_shots_with_dp = client.refine_shots_with_dp
+    rerank_with_openai_parallel = client.rerank_with_openai_parallel
+    search_page = client.search_page
+    next_page = client.next_page
+    stream_search = None   # streaming pipeline cần caches trong process
+else:
+    client = None
+    from Retrieval.stage1 import stage1_retrieve_shots
+    from Retrieval.stage2_dp import refine_shots_with_dp
+    from Retrieval.stage3_rerank import rerank_with_openai_parallel
+    from Retrieval.pagination import search_page, next_page
+    from Retrieval.pipeline import stream_search
@@ -8,6 +8,7 @@ from frontend.utils import (
     _print_timing,
     _load_image_from_path,
     _get_display_path,
+    _fmt_score,
 )
 
 def render_stage2_block(
@@ -30,7 +31,7 @@ def render_stage2_block(
 
     idx = 0
     for i, result in enumerate(results, start=1):
-        st.markdown(f"#### 🎬 Refined Shot #{i} — Score: {result['score']:.4f}")
+        st.markdown(f"#### 🎬 Refined Shot #{i} — Score: {_fmt_score(result['score'])}")
         paths = result["frame_paths"]
         n = len(paths)
         shot_images = images[idx : idx + n]
@@ -44,7 +45,7 @@ def render_stage2_block(
 
         st.markdown(
             f"<div style='text-align:center; margin:8px 0;'>"
-            f"<b>Score:</b> {result['score']:.4f} | "
+            f"<b>Score:</b> {_fmt_score(result['score'])} | "
             f"<b>Shot Path:</b> {result['shot_path']}"
             f"</div>",
             unsafe_allow_html=True,
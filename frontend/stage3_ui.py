@@ -3,12 +3,14 @@
 import streamlit as st
 import time
 from PIL import Image
-from Retrieval.stage3_rerank import rerank_with_openai_parallel
+from frontend.backend import rerank_with_openai_parallel
 from frontend.utils import (
     _load_images_batch,
     _print_timing,
+    _print_duration,
     _load_image_from_path,
     _get_display_path,
+    _fmt_score,
 )
 
 def render_stage3_block(
@@ -17,31 +19,45 @@ def render_stage3_block(
     top_k_rerank: int,
     max_workers: int,
     search_type: str,
+    results: list[dict] | None = None,
+    min_confident: int = 0,
 ):
     st.markdown("### 🔄 Stage 3 – GPT-4o-mini Re-rank")
 
-    cache_key = f"stage3::{query}::{top_k_rerank}"
+    cache_key = f"stage3::{query}::{top_k_rerank}::{min_confident}"
     time_key = f"{cache_key}::time"
-    if cache_key not in st.session_state:
+    stats_key = f"{cache_key}::stats"
+    if results is not None:   # đã rerank sẵn (streaming pipeline)
+        reranked, elapsed, stats = results, None, None
+    elif cache_key not in st.session_state:
         t0 = time.time()
         with st.spinner("🚀 Re-ranking with GPT-4o-mini..."):
-            reranked = rerank_with_openai_parallel(
+            reranked, stats = rerank_with_openai_parallel(
                 query=query,
                 items=items,
                 top_k_rerank=top_k_rerank,
                 max_workers=max_workers,
-                search_type = search_type
+                search_type = search_type,
+                min_confident=min_confident,
+                return_stats=True,
             )
+        elapsed = time.time() - t0
         st.session_state[cache_key] = reranked
-        st.session_state[time_key] = time.time() - t0
+        st.session_state[time_key] = elapsed
+        st.session_state[stats_key] = stats
+        _print_duration("Stage 3 total time", elapsed)
     else:
         reranked = st.session_state[cache_key]
-        t0 = st.session_state.get(time_key)
+        elapsed = st.session_state.get(time_key)   # thời lượng đã đo, không phải thời điểm bắt đầu
+        stats = st.session_state.get(stats_key)
+        if elapsed is not None:
+            _print_duration("Stage 3 total time", elapsed, record=False)
 
-    if t0 is not None:
-        _print_timing("Stage 3 total time", t0)
-    else:
+    if elapsed is None:
         st.text("[✅] Using cached Stage 3 results")
+    if stats:
+        st.caption(f"LLM calls: {stats['calls']}/{stats['batches']} batches "
+                   f"({stats['avoided']} avoided, {stats['abandoned']} abandoned) – stop: {stats['stop']}")
 
     if not reranked:
         st.warning("No items returned from re-ranking.")
@@ -61,7 +77,7 @@ def render_stage3_block(
 
         idx = 0
         for i, item in enumerate(reranked, start=1):
-            st.markdown(f"#### 🎬 Re-ranked Shot #{i} — Score: {item['bge_score']:.2f}")
+            st.markdown(f"#### 🎬 Re-ranked Shot #{i} — Score: {_fmt_score(item.get('bge_score'), 2)}")
             frames = item["frame_paths"]
             n = len(frames)
             shot_images = images[idx: idx + n]
@@ -92,7 +108,7 @@ def render_stage3_block(
                 st.write("**Start Time:**", f"{item.get('start_time', '–')} s")
                 st.write("**End Time:**",   f"{item.get('end_time',   '–')} s")
                 st.write("**Source:**",     item.get("source", "–"))
-                st.write("**Stage-3 Score:**", item["bge_score"])
+                st.write("**Stage-3 Score:**", item.get("bge_score", "–"))
                 st.markdown("---")
                 st.write("**BLIP Caption:**"); st.info(item["blip_caption"])
                 st.write("**LLM Caption:**");  st.success(item["llm_caption"])
@@ -130,7 +146,7 @@ def render_stage3_block(
                     short = _get_display_path(item["frame_path"])
                     st.caption(
                         f"#{idx_item} | {short}<br>"
-                        f"Score: {item['bge_score']:.2f}<br>"
+                        f"Score: {_fmt_score(item.get('bge_score'), 2)}<br>"
                         f"Time: {item.get('timestamp', 0):.2f}s",
                         unsafe_allow_html=True,
                     )
@@ -148,7 +164,7 @@ def render_stage3_block(
                         st.write("**Timestamp:**",    f"{item.get('timestamp',0)} s")
                         st.write("**FPS:**",          item.get("fps", "–"))
                         st.write("**Stage-1 Score:**", item.get("score", "–"))
-                        st.write("**Stage-3 Score:**", item["bge_score"])
+                        st.write("**Stage-3 Score:**", item.get("bge_score", "–"))
                         st.markdown("---")
                         st.write("**BLIP Caption:**"); st.info(item["blip_caption"])
                         st.write("**LLM Caption:**");  st.success(item["llm_caption"])
@@ -3,14 +3,24 @@ import os
 import time
 from PIL import Image
 from concurrent.futures import ThreadPoolExecutor
+from Retrieval.telemetry import observe
 
 def _load_images_batch(paths, max_workers=16):
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         return list(executor.map(Image.open, paths))
 
 def _print_timing(label: str, t0: float) -> None:
-    dt = time.time() - t0
-    st.text(f"[⏱️] {label:<25}: {dt:7.4f}s")
+    _print_duration(label, time.time() - t0)
+
+def _print_duration(label: str, dt: float, record: bool = True) -> None:
+    """record=False: thời gian đo từ lần chạy trước (kết quả cache) – chỉ in, không ghi lại histogram."""
+    if record:
+        observe(f"ui.{label}", dt)
+    st.text(f"[⏱️] {label:<25}: {dt:7.4f}s" + ("" if record else " (cached)"))
+
+def _fmt_score(score, digits: int = 4) -> str:
+    """Score → text; None (stage chưa chạy trên item, vd hết deadline) → "–"."""
+    return "–" if score is None else f"{score:.{digits}f}"
 
 def _load_image_from_path(path: str):
     return Image.open(path)
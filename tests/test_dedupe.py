@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("h5py")
+
+from Retrieval.config import FAISS_DIR
+from Retrieval.dedupe import candidate_vectors, dedupe_candidates
+from Retrieval.snapshot import activate, new_snapshot
+
+
+def _vectors(n=64, d=16, seed=0):
+    x = np.random.default_rng(seed).standard_normal((n, d)).astype(np.float32)
+    x[1] = x[0] + 1e-3   # near-duplicate của row 0
+    return x
+
+
+def _snapshot_with(index):
+    """Snapshot chỉ có index clip_frame, không có vector_cache (clip.h5) → phải dùng index."""
+    snap = new_snapshot()
+    snap.faiss_index_cache[os.path.join(FAISS_DIR, "clip_frame.index")] = index
+    snap.core_cache["frame_meta"] = {"source": [f"L01/V001/Shot_{i // 4:04d}.mp4" for i in range(index.ntotal)]}
+    return snap
+
+
+def test_candidate_vectors_reconstruct_fallback():
+    x = _vectors()
+    index = faiss.IndexHNSWFlat(x.shape[1], 8, faiss.METRIC_INNER_PRODUCT)   # không phải IndexFlat
+    index.add(x)
+    rows = np.array([5, 0, 17], dtype=np.int64)
+
+    with activate(_snapshot_with(index)):
+        vecs = candidate_vectors(rows, "frame")
+
+    expected = x[rows] / np.linalg.norm(x[rows], axis=1, keepdims=True)
+    np.testing.assert_allclose(vecs, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_candidate_vectors_without_reconstruct_returns_none():
+    x = _vectors()
+    ivf = faiss.IndexIVFFlat(faiss.IndexFlatIP(x.shape[1]), x.shape[1], 4, faiss.METRIC_INNER_PRODUCT)
+    ivf.train(x)
+    ivf.add(x)   # chưa make_direct_map → reconstruct_batch lỗi
+
+    with activate(_snapshot_with(ivf)):
+        assert candidate_vectors(np.array([0, 1], dtype=np.int64), "frame") is None
+
+
+def test_dedupe_candidates_from_index():
+    x = _vectors()
+    index = faiss.IndexFlatIP(x.shape[1])
+    index.add(x)
+    D = np.array([0.9, 0.8, 0.7], dtype=np.float32)
+    I = np.array([0, 1, 2], dtype=np.int64)
+
+    with activate(_snapshot_with(index)):
+        D_out, I_out, stats = dedupe_candidates(D, I, "frame", threshold=0.99, scope="global")
+
+    assert I_out.tolist() == [0, 2]
+    assert stats["suppressed"] == 1
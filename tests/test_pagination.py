@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("h5py")
+
+from Retrieval import pagination
+from Retrieval.pagination import _Cursor, _evict, _get, _grow, _store, cursor_stats
+from Retrieval.snapshot import current_snapshot, new_snapshot, publish_snapshot
+
+
+@pytest.fixture(autouse=True)
+def _clean_cursors():
+    pagination._cursors.clear()
+    snap = current_snapshot()
+    yield
+    if current_snapshot() is not snap:
+        publish_snapshot(snap)
+    pagination._cursors.clear()
+
+
+def _cursor(snapshot=None, **kw):
+    return _Cursor(snapshot=snapshot or current_snapshot(), query_vec=np.zeros((1, 4), np.float32),
+                   search_type="frame", type_search="clip", filters=None, **kw)
+
+
+# ---------- _grow ---------- #
+def _fake_search(rankings):
+    """stage1_search giả: k → ranking (index xấp xỉ đổi thứ tự khi k tăng), pad -1 tới k."""
+    calls = []
+
+    def search(q, search_type, k, type_search, filters=None):
+        calls.append(k)
+        ids = rankings[k]
+        I = np.full((1, k), -1, np.int64)
+        I[0, :len(ids)] = ids
+        D = np.where(I >= 0, 1.0 - 0.01 * np.arange(k), -np.inf).astype(np.float32)
+        return D, I
+    return search, calls
+
+
+def test_grow_frontier_keeps_served_and_skips_duplicates(monkeypatch):
+    search, calls = _fake_search({2: [5, 3], 4: [3, 7, 5, 1], 8: [1, 3, 9, 5, 7]})
+    monkeypatch.setattr(pagination, "stage1_search", search)
+    cur = _cursor()
+
+    _grow(cur, 2)
+    cur.served = 2
+    _grow(cur, 4)
+    assert cur.I.tolist() == [5, 3, 7, 1]      # trang 1 giữ nguyên, chỉ nối id mới
+    assert not cur.exhausted
+    cur.served = 4
+    _grow(cur, 6)                              # frontier gấp đôi: 8
+    assert calls == [2, 4, 8]
+    assert cur.I.tolist() == [5, 3, 7, 1, 9]   # -1 padding bị bỏ, không trùng
+    assert cur.exhausted and cur.frontier == 8
+
+
+def test_grow_frontier_drops_reordered_served_ids(monkeypatch):
+    # id đã trả bị đẩy ra ngoài top-k mới → không xuất hiện lại ở trang sau
+    search, _ = _fake_search({2: [5, 3], 4: [8, 7, 6, 3]})
+    monkeypatch.setattr(pagination, "stage1_search", search)
+    cur = _cursor()
+    _grow(cur, 2)
+    cur.served = 2
+    _grow(cur, 4)
+    assert cur.I.tolist() == [5, 3, 8, 7, 6]
+    assert len(set(cur.I.tolist())) == len(cur.I)
+
+
+@pytest.mark.parametrize("ids", [None, np.array([10, 20, 30, 40, 50], np.int64)])
+def test_grow_scores_maps_rows_and_exhausts(ids):
+    cur = _cursor(strategy="scores", ids=ids, scores=np.array([0.1, 0.9, 0.5, 0.7, 0.3], np.float32))
+    _grow(cur, 2)
+    rows = [1, 3] if ids is None else [20, 40]
+    assert cur.I.tolist() == rows and not cur.exhausted
+    _grow(cur, 3)                               # k = max(3, 4)
+    _grow(cur, 10)                              # k bị chặn ở N
+    assert cur.D.tolist() == pytest.approx([0.9, 0.7, 0.5, 0.3, 0.1])
+    assert cur.exhausted and cur.frontier == 5
+
+
+# ---------- _evict ---------- #
+def test_evict_ttl(monkeypatch):
+    monkeypatch.setattr(pagination, "PAGE_CURSOR_TTL_S", 60)
+    old, fresh = _store(_cursor()), _store(_cursor())
+    pagination._cursors[old].last_used -= 120
+    with pagination._lock:
+        _evict()
+    assert list(pagination._cursors) == [fresh]
+
+
+def test_evict_max_cursors_is_lru(monkeypatch):
+    monkeypatch.setattr(pagination, "PAGE_CACHE_MAX_CURSORS", 2)
+    a, b = _store(_cursor()), _store(_cursor())
+    _get(a)                                     # a mới dùng → b là LRU
+    c = _store(_cursor())
+    assert list(pagination._cursors) == [a, c]
+    with pytest.raises(ValueError):
+        _get(b)
+
+
+def test_evict_max_bytes(monkeypatch):
+    big = lambda: _cursor(strategy="scores", scores=np.zeros(1000, np.float32))   # ~4 KB / cursor
+    monkeypatch.setattr(pagination, "PAGE_CACHE_MAX_BYTES", 10_000)
+    tokens = [_store(big()) for _ in range(4)]
+    assert list(pagination._cursors) == tokens[-2:]
+    assert cursor_stats()["bytes"] <= 10_000
+
+
+def test_publish_drops_cursors_of_old_snapshot():
+    token = _store(_cursor())
+    publish_snapshot(new_snapshot("reloaded"))
+    assert cursor_stats()["cursors"] == 0
+    with pytest.raises(ValueError, match="expired"):
+        _get(token)
+    kept = _store(_cursor())                    # cursor của snapshot mới vẫn dùng được
+    assert _get(kept).snapshot is current_snapshot()
+
+
+def test_store_after_publish_drops_stale_cursor():
+    stale = _cursor()                           # search bắt đầu trước hot reload
+    publish_snapshot(new_snapshot("reloaded"))
+    token = _store(stale)
+    with pytest.raises(ValueError):
+        _get(token)
@@ -0,0 +1,179 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("h5py")
+
+from Retrieval import pipeline
+from Retrieval.pipeline import _Deadline, _interleave, _TopM, run_streaming
+
+
+# ---------- Fakes ---------- #
+def _frames(scores, prefix="f"):
+    return [{"frame_path": f"{prefix}{i}.jpg", "score": s} for i, s in enumerate(scores)]
+
+
+def _fake_pages(pages_by_query):
+    """iter_pages giả: mỗi query → list các chunk (đã định sẵn)."""
+    def iter_pages(query, embedder, search_type, type_search, page_size, filters, limit=None,
+                   refine_stage2=False, snapshot=None):
+        for chunk in pages_by_query[query]:
+            yield {"results": chunk}
+    return iter_pages
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """_call_openai giả (batch 2 items): ghi lại các batch, batch gửi trước được điểm LLM cao hơn."""
+    state = SimpleNamespace(calls=[], delay=0.0)
+
+    def call(query, batch, bid, search_type):
+        state.calls.append([pipeline._path(it) for it in batch])
+        n = len(state.calls)
+        time.sleep(state.delay)
+        return [{"path": pipeline._path(it), "score": 10.0 - 0.1 * n - 0.01 * j, "explanation": ""}
+                for j, it in enumerate(batch)]
+    monkeypatch.setattr(pipeline, "_call_openai", call)
+    monkeypatch.setattr(pipeline, "RERANK_BATCH_SIZE", 2)
+    return state
+
+
+@pytest.fixture
+def dp(monkeypatch):
+    """Stage 2 giả: score của shot = số trong tên (s7 → 7), chậm `delay` giây / shot."""
+    state = SimpleNamespace(delay=0.0)
+
+    def score_shots(paths, sub_mat):
+        time.sleep(state.delay * len(paths))
+        return [{"shot_path": p, "frame_paths": [], "score": float(p[1:])} for p in paths]
+    monkeypatch.setattr(pipeline, "encode_subqueries", lambda q, embedder: None)
+    monkeypatch.setattr(pipeline, "score_shots", score_shots)
+    monkeypatch.setattr(pipeline, "shot_item", lambda p, frames, score: {"shot_path": p, "frame_paths": frames,
+                                                                           "score": score})
+    monkeypatch.setattr(pipeline, "shot_cache", {f"s{i}": {"frame_paths": []} for i in range(100)})
+    return state
+
+
+# ---------- _TopM / _interleave ---------- #
+def test_topm_keeps_best_and_orders_ties_by_arrival():
+    top = _TopM(3)
+    for i, s in enumerate([0.5, 0.9, 0.1, 0.9, 0.7, 0.2]):
+        top.push({"id": i, "score": s})
+    assert [it["id"] for it in top.ranked()] == [1, 3, 4]
+
+
+def test_interleave_round_robin_uneven():
+    pages = [iter([1, 2, 3]), iter(["a"]), iter([10, 20])]
+    assert list(_interleave(pages)) == [1, "a", 10, 2, 20, 3]
+
+
+# ---------- Stream ordering ---------- #
+def test_stage1_only_ranks_across_chunks_and_subqueries(monkeypatch):
+    monkeypatch.setattr(pipeline, "iter_pages", _fake_pages({
+        "q1": [_frames([0.3, 0.2], "a"), _frames([0.9], "b")],
+        "q2": [_frames([0.5, 0.3], "a")],        # a0 trùng với q1 → bỏ
+    }))
+    events = list(pipeline.stream_search(["q1", "q2"], None, top_m=3, deadline_ms=None))
+    assert [e["event"] for e in events] == ["stage1", "stage1", "stage1", "done"]
+    done = events[-1]
+    assert [it["frame_path"] for it in done["results"]] == ["b0.jpg", "a0.jpg", "a1.jpg"]
+    assert done["stats"]["candidates"] == 5 and done["stages_completed"] == {"stage1": True}
+    assert all(it["stages"] == ["stage1"] for it in done["results"])
+
+
+def test_rerank_order_and_wasted_accounting(monkeypatch, llm):
+    # chunk 1 đủ 1 batch → gửi ngay; chunk 2 có điểm cao hơn đẩy 2 item đã gửi ra khỏi top-2
+    monkeypatch.setattr(pipeline, "iter_pages", _fake_pages({
+        "q": [_frames([0.2, 0.1], "a"), _frames([0.9, 0.8], "b")],
+    }))
+    done = run_streaming("q", None, top_m=2, rerank_query="rq", top_k_rerank=2, deadline_ms=None)
+
+    assert llm.calls == [["a0.jpg", "a1.jpg"], ["b0.jpg", "b1.jpg"]]
+    assert done["stats"]["llm_batches"] == 2
+    assert done["stats"]["llm_wasted"] == 2
+    # kết quả cuối chỉ gồm top_k_rerank hiện tại, theo điểm LLM
+    assert [it["frame_path"] for it in done["results"]] == ["b0.jpg", "b1.jpg"]
+    assert [it["bge_score"] for it in done["results"]] == sorted((it["bge_score"] for it in done["results"]),
+                                                                  reverse=True)
+    assert done["stages_completed"] == {"stage1": True, "stage3": True}
+    assert all(it["stages"] == ["stage1", "stage3"] for it in done["results"])
+
+
+def test_no_waste_when_top_is_stable(monkeypatch, llm):
+    monkeypatch.setattr(pipeline, "iter_pages", _fake_pages({
+        "q": [_frames([0.9, 0.8], "a"), _frames([0.2, 0.1], "b")],
+    }))
+    done = run_streaming("q", None, top_m=2, rerank_query="rq", top_k_rerank=2, deadline_ms=None)
+    assert llm.calls == [["a0.jpg", "a1.jpg"]]
+    assert done["stats"]["llm_wasted"] == 0
+
+
+# ---------- Deadline ---------- #
+def test_deadline_hit_keeps_unscored_shots(monkeypatch, dp):
+    dp.delay = 0.02   # 20ms / shot
+    monkeypatch.setattr(pipeline, "DEADLINE_DP_STEP", 2)
+    monkeypatch.setattr(pipeline, "DEADLINE_MARGIN_MS", 10.0)
+    monkeypatch.setattr(pipeline, "iter_pages", _fake_pages({
+        "q": [[f"s{i}" for i in range(10)], ["s10", "s11"]],
+    }))
+    done = run_streaming("q", None, refine_query="rq", top_m=12, deadline_ms=100)
+
+    assert done["deadline_hit"]
+    # chunk 2 chưa được lấy → Stage 1 cũng không chạy hết
+    assert done["stages_completed"] == {"stage1": False, "stage2": False}
+    assert done["stats"]["chunks"] == 1
+    scored = [it for it in done["results"] if it["stages"] == ["stage1", "stage2"]]
+    rest = [it for it in done["results"] if it["stages"] == ["stage1"]]
+    assert scored and rest and len(scored) + len(rest) == 10
+    assert done["results"][:len(scored)] == scored                     # đã chấm xếp trước
+    assert [it["score"] for it in scored] == sorted((it["score"] for it in scored), reverse=True)
+    assert all(it["score"] is None for it in rest)
+    assert [it["shot_path"] for it in rest] == [f"s{i}" for i in range(len(scored), 10)]   # thứ tự Stage 1
+    assert done["stats"]["shots_skipped"] == len(rest)
+
+
+def test_deadline_met_completes_all_stages(monkeypatch, dp, llm):
+    monkeypatch.setattr(pipeline, "iter_pages", _fake_pages({"q": [["s1", "s2"], ["s3"]]}))
+    done = run_streaming("q", None, refine_query="rq", top_m=3, rerank_query="rq", top_k_rerank=3,
+                         deadline_ms=5000)
+    assert not done["deadline_hit"]
+    assert done["stages_completed"] == {"stage1": True, "stage2": True, "stage3": True}
+
+
+def test_deadline_drops_slow_llm_batches(monkeypatch, llm):
+    llm.delay = 0.5
+    monkeypatch.setattr(pipeline, "DEADLINE_MARGIN_MS", 10.0)
+    monkeypatch.setattr(pipeline, "iter_pages", _fake_pages({"q": [_frames([0.9, 0.8, 0.7, 0.6], "a")]}))
+    t0 = time.time()
+    done = run_streaming("q", None, top_m=4, rerank_query="rq", top_k_rerank=4, deadline_ms=150)
+    assert time.time() - t0 < 0.4                                       # không chờ batch LLM chậm
+    assert done["deadline_hit"] and not done["stages_completed"]["stage3"]
+    assert [it["frame_path"] for it in done["results"]] == ["a0.jpg", "a1.jpg", "a2.jpg", "a3.jpg"]
+    assert all(it["stages"] == ["stage1"] for it in done["results"])
+
+
+@pytest.mark.parametrize("deadline_ms,stage3,budget_s,stage12_s", [
+    (1000, False, 0.9, 0.9),     # margin 100ms, không có Stage 3 → Stage 1+2 dùng hết
+    (1000, True, 0.9, 0.45),     # DEADLINE_STAGE3_SHARE = 0.5
+    (150, False, 0.075, 0.075),  # <= 2 × margin → margin clamp còn deadline / 2
+    (20, True, 0.01, 0.005),
+])
+def test_deadline_budget_and_clamp(monkeypatch, deadline_ms, stage3, budget_s, stage12_s):
+    monkeypatch.setattr(pipeline, "DEADLINE_MARGIN_MS", 100.0)
+    monkeypatch.setattr(pipeline, "DEADLINE_STAGE3_SHARE", 0.5)
+    dl = _Deadline(deadline_ms, stage3)
+    assert dl.end - dl.t0 == pytest.approx(budget_s, abs=1e-6)
+    assert dl.stage12_end - dl.t0 == pytest.approx(stage12_s, abs=1e-6)
+
+
+@pytest.mark.parametrize("deadline_ms", [0, -5])
+def test_deadline_rejects_non_positive(deadline_ms):
+    with pytest.raises(ValueError):
+        _Deadline(deadline_ms, stage3=False)
+
+
+def test_no_deadline_is_unbounded():
+    dl = _Deadline(None, stage3=True)
+    assert dl.remaining() is None and dl.stage12_open() and dl.can_dispatch() and not dl.hit
@@ -0,0 +1,52 @@
+import os
+import threading
+import tracemalloc
+
+from Retrieval.profiling import alloc_section, profile_session, profile_stage
+
+
+def test_alloc_section_keeps_caller_tracemalloc(tmp_path):
+    tracemalloc.start()
+    try:
+        with profile_session(str(tmp_path / "run")):
+            with alloc_section("build"):
+                [0] * 1000
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_alloc_section_stops_tracemalloc_it_started(tmp_path):
+    assert not tracemalloc.is_tracing()
+    with profile_session(str(tmp_path / "run")):
+        with alloc_section("build"):
+            assert tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
+
+
+def test_concurrent_sessions_are_isolated(tmp_path):
+    barrier = threading.Barrier(2)
+
+    def run(i):
+        with profile_session(str(tmp_path / f"s{i}")):
+            barrier.wait()
+            with profile_stage(f"stage_{i}"):
+                sum(range(10_000))
+            with alloc_section(f"alloc_{i}"):
+                barrier.wait()   # cả 2 section mở cùng lúc
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for i in range(2):
+        assert sorted(os.listdir(tmp_path / f"s{i}")) == [
+            f"alloc_{i}.alloc.txt", f"stage_{i}.folded", f"stage_{i}.pstats", "summary.txt"]
+    assert not tracemalloc.is_tracing()
+
+
+def test_hooks_are_noops_outside_session(tmp_path):
+    with profile_stage("stage1"), alloc_section("x"):
+        pass
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("h5py")
+
+from Retrieval.search_utils import adaptive_cutoff, chunked_topk, range_topk
+
+
+def _data(n=200, d=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((n, d)).astype(np.float32), rng.standard_normal((2, d)).astype(np.float32)
+
+
+def _brute(xb, q, min_score, inner_product, rows=None):
+    """Kết quả mong đợi: {row: score} mọi row thỏa ngưỡng (L2: squared distance <= min_score)."""
+    ids = np.arange(len(xb)) if rows is None else rows
+    if inner_product:
+        s = q @ xb[ids].T
+        return [{int(i): float(v) for i, v in zip(ids, row) if v >= min_score} for row in s]
+    s = ((q[:, None, :] - xb[ids][None]) ** 2).sum(-1)
+    return [{int(i): float(v) for i, v in zip(ids, row) if v <= min_score} for row in s]
+
+
+def _check(D, I, expected, inner_product, cap):
+    for q, exp in enumerate(expected):
+        hit = I[q] >= 0
+        assert hit.sum() == min(len(exp), cap)
+        if (~hit).any():
+            assert (I[q][~hit] == -1).all() and not hit[np.argmin(hit):].any()   # pad -1 chỉ ở cuối
+        for i, v in zip(I[q][hit], D[q][hit]):
+            assert v == pytest.approx(exp[int(i)], abs=1e-4)
+        d = D[q][hit]
+        assert (np.diff(d) <= 1e-6).all() if inner_product else (np.diff(d) >= -1e-6).all()
+
+
+# ---------- chunked_topk(min_score) ---------- #
+@pytest.mark.parametrize("inner_product,min_score,k,chunk_rows", [
+    (True, 1.0, 50, 16384),     # ít hit hơn k → pad -1
+    (True, 1.0, 3, 7),          # cap < số hit, running top-k qua nhiều chunk
+    (True, 1e9, 10, 16384),     # không hit nào → toàn -1
+    (False, 8.0, 50, 16384),    # L2: ngưỡng là distance <= min_score, D dương tăng dần
+    (False, 8.0, 4, 16),
+    (False, -1.0, 10, 16384),   # L2 distance luôn >= 0 → không hit nào
+])
+def test_chunked_topk_min_score(inner_product, min_score, k, chunk_rows):
+    xb, q = _data()
+    D, I = chunked_topk(xb, q, k, inner_product=inner_product, chunk_rows=chunk_rows, min_score=min_score)
+    assert D.shape == I.shape == (2, k)
+    _check(D, I, _brute(xb, q, min_score, inner_product), inner_product, k)
+
+
+def test_chunked_topk_rows_subset():
+    xb, q = _data()
+    rows = np.array([3, 4, 5, 90, 150, 151], dtype=np.int64)
+    D, I = chunked_topk(xb, q, 4, rows=rows, min_score=-1e9, chunk_rows=2)
+    assert set(I.ravel()) <= set(rows.tolist())
+    _check(D, I, _brute(xb, q, -1e9, True, rows), True, 4)
+
+
+# ---------- range_topk ---------- #
+def _ivf(xb, metric):
+    quant = faiss.IndexFlatIP(xb.shape[1]) if metric == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(xb.shape[1])
+    index = faiss.IndexIVFFlat(quant, xb.shape[1], 4, metric)
+    index.train(xb)
+    index.nprobe = 4   # quét mọi list → kết quả exact
+    return index
+
+
+def _hnsw(xb, metric):
+    index = faiss.IndexHNSWFlat(xb.shape[1], 32, metric)
+    index.hnsw.efSearch = 256
+    return index
+
+
+@pytest.mark.parametrize("make", [
+    lambda xb, m: faiss.IndexFlatIP(xb.shape[1]) if m == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(xb.shape[1]),
+    _ivf,
+    _hnsw,   # không hỗ trợ range_search → search(cap) rồi lọc
+], ids=["flat", "ivf", "hnsw"])
+@pytest.mark.parametrize("metric,min_score", [
+    (faiss.METRIC_INNER_PRODUCT, 1.5),
+    (faiss.METRIC_L2, 6.0),
+], ids=["ip", "l2"])
+@pytest.mark.parametrize("use_rows", [False, True], ids=["all", "rows"])
+def test_range_topk(make, metric, min_score, use_rows):
+    xb, q = _data()
+    index = make(xb, metric)
+    index.add(xb)
+    rows = np.arange(20, 140, dtype=np.int64) if use_rows else None
+    inner_product = metric == faiss.METRIC_INNER_PRODUCT
+    cap = 8
+
+    D, I = range_topk(index, q, min_score, cap, rows=rows)
+    assert I.shape[1] <= cap
+    _check(D, I, _brute(xb, q, min_score, inner_product, rows), inner_product, cap)
+
+
+def test_range_topk_no_hits_is_empty():
+    xb, q = _data()
+    index = faiss.IndexFlatIP(xb.shape[1])
+    index.add(xb)
+    D, I = range_topk(index, q, 1e9, 10)
+    assert I.shape == (2, 0)
+
+
+# ---------- adaptive_cutoff ---------- #
+SHARP = np.r_[[0.9, 0.88, 0.87, 0.86, 0.85, 0.84, 0.83, 0.82, 0.81, 0.8, 0.79, 0.78],
+              np.linspace(0.3, 0.29, 38)]
+
+
+@pytest.mark.parametrize("scores,method,min_keep,expected", [
+    (np.full(50, 0.5), "knee", 10, 50),                 # mọi score bằng nhau → giữ hết
+    (np.full(50, 0.5), "gap", 10, 50),
+    (np.linspace(0.9, 0.1, 5), "knee", 10, 5),          # ít hơn min_keep → giữ hết
+    (np.linspace(0.9, 0.1, 5), "gap", 10, 5),
+    (np.linspace(0.9, 0.1, 50), "knee", 10, 50),        # tuyến tính → không có elbow
+    (np.linspace(0.9, 0.1, 50), "gap", 10, 50),         # bước đều → không có gap nổi bật
+    (SHARP, "knee", 10, 13),                            # giữ cả điểm elbow (score đầu của đuôi phẳng)
+    (SHARP, "gap", 10, 12),
+    (SHARP, "knee", 20, 20),                            # không cắt dưới min_keep
+    (SHARP, "gap", 20, 50),                             # gap nằm trước min_keep → bỏ qua
+])
+def test_adaptive_cutoff(scores, method, min_keep, expected):
+    assert adaptive_cutoff(scores, method, min_keep=min_keep) == expected
+
+
+def test_adaptive_cutoff_unknown_method():
+    with pytest.raises(ValueError):
+        adaptive_cutoff(np.linspace(1, 0, 20), "elbow")